@@ -0,0 +1,135 @@
+#!/usr/bin/env python
+# Copyright 2021 The Johns Hopkins University Applied Physics Laboratory
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Benchmark the blosc settings of Cube.to_blosc() for each Cube class.
+
+Every combination of codec, compression level, shuffle filter and thread count is run on seeded synthetic data:
+smooth images with noise for ImageCube8 and ImageCube16, and labeled blobs with ragged boundaries for
+AnnotateCube64. Each case reports the compression ratio and the median compress and decompress throughput as one
+JSON object per line, and the defaults of each class (see Cube.compression) are flagged:
+
+    python benchmarks/bench_compression.py --extent 1024 1024 16 --output compression.jsonl
+    python benchmarks/bench_compression.py --cnames lz4 zstd --clevels 5 --threads 1 4
+"""
+
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+
+import blosc
+import numpy as np
+
+from cvdb import AnnotateCube64, ImageCube8, ImageCube16
+
+CUBE_CLASSES = {"ImageCube8": ImageCube8, "ImageCube16": ImageCube16, "AnnotateCube64": AnnotateCube64}
+
+SHUFFLES = {"noshuffle": blosc.NOSHUFFLE, "shuffle": blosc.SHUFFLE, "bitshuffle": blosc.BITSHUFFLE}
+
+# Side of the labeled blobs of annotation data, in voxels
+BLOB_SIZE = 16
+
+
+def synthetic_data(rng, dtype, shape):
+    """Build TZYX data that compresses like real volumes of the datatype"""
+    if dtype == np.uint64:
+        blobs = [shape[0], shape[1]] + [-(-s // BLOB_SIZE) for s in shape[2:]]
+        labels = rng.integers(1, 10 ** 7, size=blobs, dtype=np.uint64)
+        data = labels.repeat(BLOB_SIZE, axis=2).repeat(BLOB_SIZE, axis=3)[:, :, :shape[2], :shape[3]]
+        ragged = rng.random(shape) < 0.05
+        data[ragged] = np.roll(data, 1, axis=3)[ragged]
+        return np.ascontiguousarray(data)
+
+    y, x = np.mgrid[0:shape[2], 0:shape[3]]
+    smooth = 0.5 + 0.3 * np.sin(x / 23.0) * np.cos(y / 31.0)
+    data = smooth[np.newaxis, np.newaxis] + rng.normal(0, 0.02, size=shape)
+    return (np.clip(data, 0, 1) * np.iinfo(dtype).max).astype(dtype)
+
+
+def median_time(func, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        times.append(time.perf_counter() - start)
+    return float(np.median(times)), result
+
+
+def bench_class(name, cube_class, args, rng):
+    extent = args.extent
+    shape = (1, extent[2], extent[1], extent[0])
+    dtype = np.dtype(cube_class([1, 1, 1]).datatype)
+    data = synthetic_data(rng, dtype, shape)
+    megabytes = data.nbytes / 2 ** 20
+
+    for cname in args.cnames:
+        for clevel in args.clevels:
+            for shuffle in args.shuffles:
+                for threads in args.threads:
+                    cube = cube_class(extent)
+                    cube.set_data(data)
+                    cube.compression = {"cname": cname, "clevel": clevel, "shuffle": SHUFFLES[shuffle],
+                                        "threads": threads}
+                    compress_s, packed = median_time(cube.to_blosc, args.repeat)
+                    decompress_s, _ = median_time(lambda: blosc.decompress(packed), args.repeat)
+                    yield {
+                        "benchmark": "compression",
+                        "cube": name,
+                        "extent": list(extent),
+                        "bytes": data.nbytes,
+                        "cname": cname,
+                        "clevel": clevel,
+                        "shuffle": shuffle,
+                        "threads": threads,
+                        "default": cube.compression == cube_class.compression,
+                        "ratio": data.nbytes / len(packed),
+                        "compress_mb_per_s": megabytes / compress_s,
+                        "decompress_mb_per_s": megabytes / decompress_s,
+                    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--output", help="File the JSON lines are appended to. Defaults to stdout")
+    parser.add_argument("--cubes", nargs="+", default=list(CUBE_CLASSES), choices=CUBE_CLASSES)
+    parser.add_argument("--extent", type=int, nargs=3, default=[512, 512, 16], help="Cube size in xyz")
+    parser.add_argument("--cnames", nargs="+", default=["blosclz", "lz4", "zstd"], choices=blosc.cnames)
+    parser.add_argument("--clevels", type=int, nargs="+", default=[1, 5, 9])
+    parser.add_argument("--shuffles", nargs="+", default=list(SHUFFLES), choices=SHUFFLES)
+    parser.add_argument("--threads", type=int, nargs="+", default=[1, 4])
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    out = open(args.output, "a") if args.output else sys.stdout
+    try:
+        out.write(json.dumps({"benchmark": "environment", "time": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+                              "python": platform.python_version(), "cpus": os.cpu_count(),
+                              "blosc": blosc.__version__, "c-blosc": blosc.blosclib_version,
+                              "args": vars(args)}) + "\n")
+        for name in args.cubes:
+            rng = np.random.default_rng([args.seed, list(CUBE_CLASSES).index(name)])
+            for record in bench_class(name, CUBE_CLASSES[name], args, rng):
+                out.write(json.dumps(record) + "\n")
+                out.flush()
+    finally:
+        if out is not sys.stdout:
+            out.close()
+
+
+if __name__ == "__main__":
+    main()
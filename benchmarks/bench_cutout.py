@@ -0,0 +1,340 @@
+#!/usr/bin/env python
+# Copyright 2021 The Johns Hopkins University Applied Physics Laboratory
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Benchmark CloudVolumeDB.cutout and Cube operations on local precomputed volumes.
+
+Volumes are built under --root with file:// paths, one per datatype, with a scale per mip. Volume contents are
+seeded so runs are reproducible, and an existing --root with matching parameters is reused so the build cost is
+paid once. Every case is written as one JSON object per line, preceded by an environment record, so results from
+different versions can be compared with any JSON tool:
+
+    python benchmarks/bench_cutout.py --root /tmp/cvdb-bench --output results.jsonl
+    python benchmarks/bench_cutout.py --volume 4096 4096 256 --extents tile medium full   # multi-GB cutouts
+
+Cutout cases cover every datatype, mip, extent and corner alignment. Extents are given by name (tile is one chunk,
+small, medium and large are fixed sizes, full is the whole mip) or as X,Y,Z. Each case reports the latency of
+every repeat and the median phase breakdown from cvdb.instrument. Chunk files may be served from the OS page
+cache after the first repeat.
+"""
+
+import argparse
+import importlib.metadata
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+from cloudvolume import CloudVolume
+
+from cvdb import CloudVolumeDB, ChunkCache, Cube, CVDBError, StatsAggregator, VolumeHandleCache
+from cvdb.instrument import COUNTERS, PHASES
+from cvdb.project import BossResourceBasic
+from cvdb.project.test.resource_setup import get_image_dict, get_anno_dict
+
+DATATYPES = ("uint8", "uint16", "uint64")
+
+# Named cutout extents. tile and full depend on the chunk size and the mip, see case_extent()
+EXTENTS = {
+    "small": (256, 256, 16),
+    "medium": (1024, 1024, 64),
+    "large": (2048, 2048, 128),
+}
+
+# Values written to uint64 volumes, so segmentation-like data repeats IDs
+NUM_IDS = 1000
+
+# Version of the volume layout. Bump when create_volumes() changes so stale --root directories are rebuilt
+LAYOUT_VERSION = 1
+
+
+def get_resource(root, datatype, extent):
+    if datatype == "uint64":
+        data = get_anno_dict(storage_type="cloudvol")
+    else:
+        data = get_image_dict(datatype=datatype, storage_type="cloudvol")
+    data["channel"]["bucket"] = root
+    data["channel"]["cv_path"] = datatype
+    data["coord_frame"]["x_stop"] = extent[0]
+    data["coord_frame"]["y_stop"] = extent[1]
+    data["coord_frame"]["z_stop"] = extent[2]
+    return BossResourceBasic(data)
+
+
+def random_data(rng, datatype, shape):
+    if datatype == "uint64":
+        return rng.integers(1, NUM_IDS, size=shape, dtype=np.uint64)
+    return rng.integers(1, np.iinfo(datatype).max, size=shape, dtype=datatype)
+
+
+def create_volumes(root, args):
+    """Build one local volume per datatype with a scale per mip, unless root already holds matching ones"""
+    params = {"layout": LAYOUT_VERSION, "volume": args.volume, "chunk": args.chunk, "mips": max(args.mips),
+              "seed": args.seed, "compress": args.compress}
+    params_file = os.path.join(root, "params.json")
+    built = {}
+    if os.path.exists(params_file):
+        with open(params_file) as fh:
+            built = json.load(fh)
+        if {key: value for key, value in built.items() if key != "datatypes"} != params:
+            raise SystemExit(f"{root} holds volumes built with {built}, not {params}. Use another --root.")
+
+    done = set(built.get("datatypes", []))
+    for datatype in args.datatypes:
+        if datatype in done:
+            continue
+
+        rng = np.random.default_rng([args.seed, DATATYPES.index(datatype)])
+        info = CloudVolume.create_new_info(
+            num_channels=1,
+            layer_type="segmentation" if datatype == "uint64" else "image",
+            data_type=datatype,
+            encoding="raw",
+            resolution=[4, 4, 35],
+            voxel_offset=[0, 0, 0],
+            chunk_size=args.chunk,
+            volume_size=args.volume,
+        )
+        path = f"file://{root}/{datatype}"
+        vol = CloudVolume(path, info=info, compress=args.compress)
+        for mip in range(1, max(args.mips) + 1):
+            vol.add_scale((2 ** mip, 2 ** mip, 1), chunk_size=args.chunk)
+        vol.commit_info()
+
+        # Write one z-slab at a time to keep setup memory low. Scales get their own random data, which is fine
+        # for timing reads
+        for mip in range(max(args.mips) + 1):
+            vol = CloudVolume(path, mip=mip, compress=args.compress)
+            size = vol.meta.volume_size(mip)
+            for z in range(0, size[2], args.chunk[2]):
+                z_stop = min(z + args.chunk[2], size[2])
+                vol[:, :, z:z_stop] = random_data(rng, datatype, (size[0], size[1], z_stop - z))
+
+        done.add(datatype)
+        with open(params_file, "w") as fh:
+            json.dump(dict(params, datatypes=sorted(done)), fh)
+
+
+def open_local_volume(bucket, cv_path, mip, options):
+    options.pop("use_https", None)
+    options.pop("path_template", None)
+    return CloudVolume(f"file://{bucket}/{cv_path}", mip=mip, **options)
+
+
+def parse_extent(name):
+    if name in ("tile", "full") or name in EXTENTS:
+        return name
+    try:
+        extent = tuple(int(e) for e in name.split(","))
+    except ValueError:
+        extent = ()
+    if len(extent) != 3:
+        raise argparse.ArgumentTypeError(f"Extent must be tile, full, {', '.join(EXTENTS)} or X,Y,Z, not {name}")
+    return extent
+
+
+def case_extent(name, chunk, size):
+    """Resolve an extent name at a mip of the given size. Returns None if it does not fit"""
+    if name == "tile":
+        extent = tuple(chunk)
+    elif name == "full":
+        extent = tuple(size)
+    else:
+        extent = EXTENTS.get(name, name)
+    if any(extent[d] > size[d] for d in range(3)):
+        return None
+    return extent
+
+
+def case_corner(aligned, extent, chunk, size):
+    """Pick a corner one chunk in (aligned) or half a chunk plus a few voxels in (unaligned), where there is room"""
+    corner = []
+    for d in range(3):
+        offset = chunk[d] if aligned else chunk[d] // 2 + 3
+        corner.append(offset if offset + extent[d] <= size[d] else 0)
+    return tuple(corner)
+
+
+def environment():
+    versions = {}
+    for package in ("cvdb", "cloud-volume", "cloud-files", "numpy", "blosc"):
+        try:
+            versions[package] = importlib.metadata.version(package)
+        except importlib.metadata.PackageNotFoundError:
+            versions[package] = None
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], cwd=os.path.dirname(os.path.abspath(__file__)),
+                                capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "benchmark": "environment",
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "versions": versions,
+        "commit": commit,
+    }
+
+
+def summarize(times):
+    times = np.array(times)
+    return {"times_s": [round(t, 6) for t in times], "min_s": float(times.min()), "median_s": float(np.median(times))}
+
+
+def bench_cutouts(root, args, emit):
+    for datatype in args.datatypes:
+        resource = get_resource(root, datatype, args.volume)
+        for mip in args.mips:
+            for access_mode in args.access_modes:
+                stats = StatsAggregator()
+                db = CloudVolumeDB(handle_cache=VolumeHandleCache(factory=open_local_volume),
+                                   chunk_cache=ChunkCache(args.cache_mb * 2 ** 20), hooks=[stats])
+                vol = db.get_volume(resource.get_channel(), mip)
+                size = [int(s) for s in vol.meta.volume_size(mip)]
+
+                for name in args.extents:
+                    extent = case_extent(name, args.chunk, size)
+                    if extent is None:
+                        continue
+                    corners = dict.fromkeys(case_corner(aligned, extent, args.chunk, size) for aligned in (True, False))
+                    for corner in corners:
+                        # Extents spanning the whole mip leave no room to shift the corner
+                        aligned = all(corner[d] % args.chunk[d] == 0 for d in range(3))
+                        nbytes = int(np.prod(extent)) * np.dtype(datatype).itemsize
+                        record = {
+                            "benchmark": "cutout",
+                            "datatype": datatype,
+                            "mip": mip,
+                            "extent_name": name if isinstance(name, str) else "custom",
+                            "extent": list(extent),
+                            "corner": list(corner),
+                            "aligned": aligned,
+                            "access_mode": access_mode,
+                            "bytes": nbytes,
+                        }
+                        try:
+                            db.chunk_cache.clear()
+                            stats.reset()
+                            times = []
+                            for _ in range(args.repeat):
+                                start = time.perf_counter()
+                                cube = db.cutout(resource, corner, extent, mip, access_mode=access_mode)
+                                times.append(time.perf_counter() - start)
+                                del cube
+                            record.update(summarize(times))
+                            record["mb_per_s"] = nbytes / 2 ** 20 / record["median_s"]
+                            summary = stats.summary(percentiles=(50,))
+                            record["breakdown"] = {key: summary[key]["p50"] for key in PHASES + COUNTERS}
+                        except CVDBError as e:
+                            record["error"] = e.message
+                        emit(record)
+
+
+def bench_cube(datatype, extent, repeat, rng):
+    """Time the Cube operations of the read and write paths on a cube of the given xyz extent"""
+    resource = get_resource("unused", datatype, extent)
+    data = random_data(rng, datatype, (1, extent[2], extent[1], extent[0]))
+    half = [e // 2 for e in extent]
+
+    def allocate():
+        cube = Cube.create_cube(resource, extent)
+        cube.set_data(cube.allocate())
+
+    def add_data():
+        cube = Cube.create_cube(resource, extent)
+        cube.set_data(cube.allocate())
+        part = Cube.create_cube(resource, half)
+        part.set_data(np.ascontiguousarray(data[:, :half[2], :half[1], :half[0]]))
+        for index in np.ndindex(2, 2, 2):
+            cube.add_data(part, index)
+
+    def trim():
+        cube = Cube.create_cube(resource, extent)
+        cube.set_data(data.copy())
+        cube.trim(3, half[0], 5, half[1], 1, half[2])
+
+    def blosc_roundtrip():
+        cube = Cube.create_cube(resource, extent)
+        cube.set_data(data)
+        packed = cube.to_blosc()
+        Cube.create_cube(resource, extent).from_blosc(packed)
+
+    for name, op in (("allocate", allocate), ("add_data", add_data), ("trim", trim),
+                     ("blosc_roundtrip", blosc_roundtrip)):
+        record = {"benchmark": "cube", "operation": name, "datatype": datatype, "extent": list(extent),
+                  "bytes": data.nbytes}
+        try:
+            times = []
+            for _ in range(repeat):
+                start = time.perf_counter()
+                op()
+                times.append(time.perf_counter() - start)
+            record.update(summarize(times))
+        except Exception as e:
+            record["error"] = str(e)
+        yield record
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--root", help="Directory holding the volumes. Reused if it exists, temporary otherwise")
+    parser.add_argument("--output", help="File the JSON lines are appended to. Defaults to stdout")
+    parser.add_argument("--datatypes", nargs="+", default=list(DATATYPES), choices=DATATYPES)
+    parser.add_argument("--volume", type=int, nargs=3, default=[2048, 2048, 128], help="Mip 0 size in xyz")
+    parser.add_argument("--chunk", type=int, nargs=3, default=[256, 256, 16], help="Chunk size in xyz")
+    parser.add_argument("--mips", type=int, nargs="+", default=[0, 1, 2])
+    parser.add_argument("--extents", type=parse_extent, nargs="+", default=["tile", "small", "medium", "full"])
+    parser.add_argument("--access-modes", nargs="+", default=["no_cache"], choices=CloudVolumeDB.ACCESS_MODES)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--cache-mb", type=int, default=512, help="Chunk cache budget for access mode cache")
+    parser.add_argument("--compress", default=False, help="Chunk file compression, e.g. gzip. Default none")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--skip-cube", action="store_true", help="Skip the Cube operation benchmarks")
+    args = parser.parse_args()
+
+    out = open(args.output, "a") if args.output else sys.stdout
+
+    def emit(record):
+        out.write(json.dumps(record) + "\n")
+        out.flush()
+
+    root = args.root or tempfile.mkdtemp(prefix="cvdb-bench-")
+    os.makedirs(root, exist_ok=True)
+    try:
+        emit(dict(environment(), args=vars(args)))
+        create_volumes(root, args)
+        bench_cutouts(root, args, emit)
+
+        if not args.skip_cube:
+            rng = np.random.default_rng(args.seed)
+            for datatype in args.datatypes:
+                for name in ("small", "medium"):
+                    for record in bench_cube(datatype, EXTENTS[name], args.repeat, rng):
+                        emit(record)
+    finally:
+        if not args.root:
+            shutil.rmtree(root)
+        if out is not sys.stdout:
+            out.close()
+
+
+if __name__ == "__main__":
+    main()
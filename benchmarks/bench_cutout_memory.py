@@ -0,0 +1,155 @@
+#!/usr/bin/env python
+# Copyright 2021 The Johns Hopkins University Applied Physics Laboratory
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Compare peak RSS and latency of the legacy cutout return path with CloudVolumeDB.cutout.
+
+The legacy path is the pre-chunk-reader implementation: an eagerly zero filled Cube, a full VolumeCutout from
+cloudvolume and a second full copy from np.array(data.T). Each mode runs in its own subprocess. Peak RSS is read
+from VmHWM after resetting it through /proc/self/clear_refs, falling back to getrusage where that is unavailable.
+
+    python benchmarks/bench_cutout_memory.py --datatype uint64 --extent 1024 1024 64
+"""
+
+import argparse
+import json
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+from cloudvolume import CloudVolume
+
+from cvdb import CloudVolumeDB, Cube, VolumeHandleCache
+from cvdb.project import BossResourceBasic
+from cvdb.project.test.resource_setup import get_image_dict, get_anno_dict
+
+CHUNKSIZE = (512, 512, 16)
+
+
+def get_resource(root, datatype):
+    if datatype == "uint64":
+        data = get_anno_dict(storage_type="cloudvol")
+    else:
+        data = get_image_dict(datatype=datatype, storage_type="cloudvol")
+    data["channel"]["bucket"] = root
+    data["channel"]["cv_path"] = datatype
+    return BossResourceBasic(data)
+
+
+def open_local_volume(bucket, cv_path, mip, options):
+    options.pop("use_https", None)
+    options.pop("path_template", None)
+    return CloudVolume(f"file://{bucket}/{cv_path}", mip=mip, **options)
+
+
+def create_volume(root, datatype, extent):
+    info = CloudVolume.create_new_info(
+        num_channels=1,
+        layer_type="image" if datatype != "uint64" else "segmentation",
+        data_type=datatype,
+        encoding="raw",
+        resolution=[4, 4, 35],
+        voxel_offset=[0, 0, 0],
+        chunk_size=CHUNKSIZE,
+        volume_size=extent,
+    )
+    vol = CloudVolume(f"file://{root}/{datatype}", info=info, compress=False)
+    vol.commit_info()
+
+    # Write one z-slab at a time to keep setup memory low
+    for z in range(0, extent[2], CHUNKSIZE[2]):
+        z_stop = min(z + CHUNKSIZE[2], extent[2])
+        vol[:, :, z:z_stop] = np.random.randint(
+            1, 255, size=(extent[0], extent[1], z_stop - z)).astype(datatype)
+
+
+def reset_peak_rss():
+    try:
+        with open("/proc/self/clear_refs", "w") as fh:
+            fh.write("5")
+    except OSError:
+        pass
+
+
+def rss_mb(field="VmRSS"):
+    try:
+        with open("/proc/self/status") as fh:
+            for line in fh:
+                if line.startswith(field + ":"):
+                    return int(line.split()[1]) / 1024.0
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+
+def run_mode(mode, root, datatype, extent):
+    res = get_resource(root, datatype)
+    corner = (0, 0, 0)
+
+    # Warm the handle (info fetch) so only the cutout itself is measured
+    vol = open_local_volume(root, datatype, 0, {"fill_missing": True})
+    db = CloudVolumeDB(handle_cache=VolumeHandleCache(factory=open_local_volume))
+    db.get_volume(res.get_channel(), 0)
+
+    baseline = rss_mb()
+    reset_peak_rss()
+    start = time.perf_counter()
+    if mode == "legacy":
+        cube = Cube.create_cube(res, extent)
+        cube.zeros()
+        data = vol[corner[0]:corner[0] + extent[0], corner[1]:corner[1] + extent[1], corner[2]:corner[2] + extent[2]]
+        cube.set_data(np.array(data.T))
+        del data
+    else:
+        cube = db.cutout(res, corner, extent, 0)
+    elapsed = time.perf_counter() - start
+
+    return {
+        "mode": mode,
+        "datatype": datatype,
+        "extent": list(extent),
+        "output_mb": cube.data.nbytes / 2 ** 20,
+        "latency_s": elapsed,
+        "peak_rss_delta_mb": rss_mb("VmHWM") - baseline,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--datatype", default="uint64", choices=["uint8", "uint16", "uint64"])
+    parser.add_argument("--extent", type=int, nargs=3, default=[1024, 1024, 64])
+    parser.add_argument("--root", help="Existing benchmark volume directory (internal)")
+    parser.add_argument("--mode", choices=["legacy", "chunked"], help="Run a single mode (internal)")
+    args = parser.parse_args()
+
+    if args.mode:
+        print(json.dumps(run_mode(args.mode, args.root, args.datatype, args.extent)))
+        return
+
+    root = tempfile.mkdtemp(prefix="cvdb-bench-")
+    try:
+        create_volume(root, args.datatype, args.extent)
+        for mode in ("legacy", "chunked"):
+            subprocess.run([sys.executable, __file__, "--mode", mode, "--root", root,
+                            "--datatype", args.datatype, "--extent"] + [str(e) for e in args.extent], check=True)
+    finally:
+        shutil.rmtree(root)
+
+
+if __name__ == "__main__":
+    main()
@@ -17,3 +17,14 @@ from .cube import Cube
 from .imagecube import ImageCube8, ImageCube16
 from .annocube import AnnotateCube64
 from .cloudvolumedb import CloudVolumeDB
+from .handlecache import VolumeHandleCache
+from .chunkcache import ChunkCache
+from .diskcache import DiskChunkCache
+from .aio import AsyncReadPool
+from .readahead import ReadAhead
+from .singleflight import SingleFlight
+from .instrument import CutoutTrace, StatsAggregator
+from .occupancy import ChunkOccupancy, OccupancyIndex
+from .propagate import Propagator
+from .payload import BloscPayload
+from .config import configure_blosc, configure_http
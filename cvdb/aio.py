@@ -0,0 +1,192 @@
+# Copyright 2021 The Johns Hopkins University Applied Physics Laboratory
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+import os
+import threading
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+
+from .chunks import ChunkReader, paste_chunk
+
+"""
+.. module:: aio
+    :synopsis: Thread pools and concurrency limits shared by asyncio cutouts.
+"""
+
+# Number of threads blocked on storage transfers, shared by every in-flight asyncio cutout
+DEFAULT_IO_THREADS = 32
+
+# Number of threads decoding chunks and copying them into cutout buffers
+DEFAULT_DECODE_THREADS = min(8, os.cpu_count() or 1)
+
+# Number of chunks of a single channel in flight at once
+DEFAULT_CHANNEL_CONCURRENCY = 16
+
+
+class AsyncReadPool:
+    """Thread pools and per-channel concurrency limits shared by asyncio cutouts.
+
+    cloud-files transfers are blocking, so they run on a small shared I/O pool while the event loop awaits them.
+    A cutout therefore only holds a thread while one of its chunks is actually on the wire, and thousands of
+    requests can be in flight on a few threads. Decoding and pasting run on a separate bounded pool so CPU work
+    can't starve transfers. Each channel gets its own semaphore so one huge cutout can't monopolize the pools.
+
+    Args:
+        io_threads (int): Number of threads running storage transfers
+        decode_threads (int): Number of threads decoding chunks
+        channel_concurrency (int): Number of chunks of a single channel in flight at once
+    """
+    def __init__(self, io_threads=DEFAULT_IO_THREADS, decode_threads=DEFAULT_DECODE_THREADS,
+                 channel_concurrency=DEFAULT_CHANNEL_CONCURRENCY):
+        self.channel_concurrency = channel_concurrency
+        self.io_pool = ThreadPoolExecutor(max_workers=io_threads, thread_name_prefix="cvdb-io")
+        self.decode_pool = ThreadPoolExecutor(max_workers=decode_threads, thread_name_prefix="cvdb-decode")
+
+        # asyncio primitives belong to one event loop, so semaphores are kept per loop
+        self._semaphores = weakref.WeakKeyDictionary()
+        self._lock = threading.Lock()
+
+    def semaphore(self, key):
+        """Get the semaphore limiting the chunks of a channel in flight on the running event loop
+
+        Args:
+            key (hashable): Identifies the channel
+
+        Returns:
+            (asyncio.Semaphore)
+        """
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            semaphores = self._semaphores.setdefault(loop, {})
+            if key not in semaphores:
+                semaphores[key] = asyncio.Semaphore(self.channel_concurrency)
+            return semaphores[key]
+
+    async def run_io(self, func, *args):
+        """Run a blocking storage call on the I/O pool
+
+        Args:
+            func (callable): The blocking call
+            *args: Arguments to func
+
+        Returns:
+            The result of func
+        """
+        return await asyncio.get_running_loop().run_in_executor(self.io_pool, func, *args)
+
+    async def run_decode(self, func, *args):
+        """Run CPU bound work on the decode pool
+
+        Args:
+            func (callable): The function to run
+            *args: Arguments to func
+
+        Returns:
+            The result of func
+        """
+        return await asyncio.get_running_loop().run_in_executor(self.decode_pool, func, *args)
+
+    async def read_chunk(self, reader, index):
+        """Get a decoded chunk, from the reader's cache or by downloading it on the I/O pool
+
+        Args:
+            reader (cvdb.chunks.BaseChunkReader): Reader of the mip
+            index ((int, int, int)): grid index of the chunk
+
+        Returns:
+            (numpy.ndarray|None): xyz ordered chunk data, None if the chunk does not exist
+        """
+        data = reader.lookup(index)
+        if data is not None:
+            return data
+
+        if reader.flights is None:
+            return await self._download(reader, index)
+
+        # Wait on the event loop, not on a pool thread, when the chunk is already being fetched
+        key = reader.flight_key(index)
+        future, leader = reader.flights.claim(key)
+        if not leader:
+            return await asyncio.wrap_future(future)
+
+        try:
+            data = await self._download(reader, index)
+        except BaseException as e:
+            reader.flights.finish(key, future, error=e)
+            raise
+        reader.flights.finish(key, future, data)
+        return data
+
+    async def _download(self, reader, index):
+        """Download a chunk on the I/O pool and decode it on the decode pool, adding it to the reader's cache"""
+        if not isinstance(reader, ChunkReader) or reader.grid.sharded:
+            # Chunks that aren't stored as a single file are built whole on the I/O pool
+            return await self.run_io(reader._fetch, index)
+        if reader.is_absent(index):
+            reader.check_missing(index)
+            return None
+
+        content = await self.run_io(reader.load, index)
+        if not content:
+            return None
+        return await self.run_decode(lambda: reader.store(index, reader.decode(index, content)))
+
+    async def read_into(self, reader, key, indices, out, corner, time_channels=((0, 0),), ids=None):
+        """Fetch chunks concurrently and paste each one into a TZYX buffer as it arrives
+
+        Args:
+            reader (cvdb.chunks.BaseChunkReader): Reader of the mip
+            key (hashable): Identifies the channel for the concurrency limit
+            indices (iterable(tuple(int, int, int))): grid indices of the chunks
+            out (numpy.ndarray): TZYX buffer holding the region. Must be zero filled
+            corner ((int, int, int)): the xyz location of the corner of the region held in out
+            time_channels (iterable(tuple(int, int))): (index into the time axis of out, channel of the volume)
+                pairs to copy out of every chunk
+            ids (numpy.ndarray): Optional sorted IDs. Only voxels holding one of them are copied
+
+        Returns:
+            None
+        """
+        semaphore = self.semaphore(key)
+
+        def paste(index, data):
+            chunk_start = reader.grid.chunk_bounds(index)[0]
+            for t_index, channel in time_channels:
+                paste_chunk(out, t_index, corner, chunk_start, data, channel, ids)
+
+        async def read_one(index):
+            async with semaphore:
+                data = await self.read_chunk(reader, index)
+                if data is not None:
+                    await self.run_decode(paste, index, data)
+
+        tasks = [asyncio.ensure_future(read_one(index)) for index in dict.fromkeys(indices)]
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    def shutdown(self, wait=True):
+        """Stop the thread pools
+
+        Args:
+            wait (bool): If True, wait for queued work to finish
+
+        Returns:
+            None
+        """
+        self.io_pool.shutdown(wait=wait)
+        self.decode_pool.shutdown(wait=wait)
@@ -20,6 +20,12 @@ from .error import CVDBError, ErrorCodes
 
 
 class AnnotateCube64(Cube):
+    # Annotation IDs can't be averaged, so zoom_out() keeps the most frequent ID of each block
+    pooling = "mode"
+
+    # Label volumes are highly redundant, and zstd compresses them several times smaller than the fast codecs
+    compression = dict(Cube.compression, cname="zstd", clevel=5)
+
     def __init__(self, cube_size=None, time_range=None):
         """Create empty array of cube_size"""
 
@@ -29,12 +35,10 @@ class AnnotateCube64(Cube):
         # call the base class constructor
         Cube.__init__(self, cube_size, time_range)
 
-        # Note that this is self.cube_size (which is transposed) in Cube
-        self.data = np.zeros([self.time_range[1] - self.time_range[0]] + self.cube_size, dtype=np.uint64, order='C')
-
         # variable that describes when a cube is created from zeros rather than loaded from another source
         self._created_from_zeros = False
 
+        # self.data is allocated lazily on first access, cutouts usually replace it immediately
         self.datatype = np.uint64
 
     # create an all zeros cube
@@ -96,6 +100,33 @@ class AnnotateCube64(Cube):
         #         self.data[time_sample_range[0], :, :, :], input_data[time_sample_range[0], :, :, :])
         pass
 
+    @staticmethod
+    def id_array(filter_ids):
+        """Convert a list of IDs to the sorted, unique uint64 array used for vectorized membership tests
+
+        Args:
+            filter_ids (iterable(int)): IDs, in any order and possibly repeated
+
+        Returns:
+            (numpy.ndarray)
+        """
+        if not isinstance(filter_ids, np.ndarray):
+            filter_ids = np.fromiter(filter_ids, dtype=np.uint64)
+        return np.unique(filter_ids.astype(np.uint64, copy=False))
+
+    def apply_id_filter(self, filter_ids):
+        """Zero every voxel whose ID is not in filter_ids
+
+        Membership is tested with one vectorized pass over the data, so the cost barely grows with the number of IDs.
+
+        Args:
+            filter_ids (iterable(int)): IDs to keep
+
+        Returns:
+            None
+        """
+        np.multiply(self.data, np.isin(self.data, self.id_array(filter_ids)), out=self.data)
+
     def xy_image(self, z_index=0, t_index=0):
         """Render an image in the XY plane.
 
@@ -157,5 +188,3 @@ class AnnotateCube64(Cube):
         # outimage = Image.frombuffer('RGBA', (ydim, zdim), imagemap.astype(dtype=np.uint32), 'raw', 'RGBA', 0, 1)
         # return outimage.resize([ydim, int(zdim * z_scale)])
         pass
-
-    # TODO: Implement zoom in/zoom out once propagation is implemented
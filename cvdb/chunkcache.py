@@ -0,0 +1,215 @@
+# Copyright 2021 The Johns Hopkins University Applied Physics Laboratory
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import threading
+import time
+from collections import OrderedDict
+
+# Default byte budget of the process-wide decoded chunk cache
+DEFAULT_MAX_BYTES = 512 * 2 ** 20
+
+# Seconds the process-wide decoded chunk cache serves a chunk before reading it again, bounding how stale chunks
+# written outside this process can get
+SHARED_TTL = 60
+
+
+def root_mip(mip):
+    """Get the stored mip that a chunk cache mip is derived from
+
+    Args:
+        mip (int|tuple): A resolution level, or a (source mip, factor) pair for chunks downsampled on the fly
+
+    Returns:
+        (int)
+    """
+    while isinstance(mip, tuple):
+        mip = mip[0]
+    return mip
+
+
+class ChunkCache:
+    """Thread-safe LRU cache of decoded chunks with a byte budget.
+
+    Chunks are keyed by (cloudpath, mip, grid index). Cached arrays are marked read-only because the same array is
+    handed to every reader; copy before modifying. Writes made to a volume outside of this cache's users are not
+    seen until the affected chunks are invalidated or expire.
+
+    Args:
+        max_bytes (int): Byte budget. Least recently used chunks are evicted to stay under it. 0 disables caching
+        ttl (float|None): Seconds a chunk is served after it was added. None keeps chunks until they are evicted
+
+    Attributes:
+        hits (int): Number of lookups served from the cache
+        misses (int): Number of lookups that were not cached
+        evictions (int): Number of chunks dropped to stay within the budget
+    """
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES, ttl=None):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        # key -> (data, time.monotonic() deadline or None)
+        self._chunks = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(cloudpath, mip, index):
+        """Build the cache key for a chunk
+
+        Args:
+            cloudpath (str): Location of the volume
+            mip (int): Resolution level
+            index ((int, int, int)): Grid index of the chunk
+
+        Returns:
+            (tuple)
+        """
+        return cloudpath, mip, tuple(index)
+
+    def get(self, key):
+        """Look up a chunk
+
+        Args:
+            key (tuple): Key from make_key()
+
+        Returns:
+            (numpy.ndarray|None): The decoded chunk, None on a miss
+        """
+        with self._lock:
+            entry = self._chunks.get(key)
+            if entry is not None and entry[1] is not None and entry[1] <= time.monotonic():
+                # Expired, so drop it and read it again
+                self._bytes -= self._chunks.pop(key)[0].nbytes
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._chunks.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, data):
+        """Add a decoded chunk, evicting least recently used chunks if over budget
+
+        Args:
+            key (tuple): Key from make_key()
+            data (numpy.ndarray): The decoded chunk
+
+        Returns:
+            None
+        """
+        if data.nbytes > self.max_bytes:
+            return
+
+        data.flags.writeable = False
+        deadline = None if self.ttl is None else time.monotonic() + self.ttl
+        with self._lock:
+            old = self._chunks.pop(key, None)
+            if old is not None:
+                self._bytes -= old[0].nbytes
+
+            self._chunks[key] = (data, deadline)
+            self._bytes += data.nbytes
+
+            while self._bytes > self.max_bytes:
+                _, (evicted, _) = self._chunks.popitem(last=False)
+                self._bytes -= evicted.nbytes
+                self.evictions += 1
+
+    def pop(self, key):
+        """Remove a chunk and return it. Does not count as a lookup
+
+        Args:
+            key (tuple): Key from make_key()
+
+        Returns:
+            (numpy.ndarray|None): The decoded chunk, None if it is not cached
+        """
+        with self._lock:
+            entry = self._chunks.pop(key, None)
+            if entry is None:
+                return None
+            self._bytes -= entry[0].nbytes
+            if entry[1] is not None and entry[1] <= time.monotonic():
+                return None
+            return entry[0]
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._chunks
+
+    def invalidate(self, cloudpath=None, mip=None, indices=None, derived=False):
+        """Drop cached chunks. Arguments that are None match everything.
+
+        Args:
+            cloudpath (str): Only drop chunks of this volume
+            mip (int): Only drop chunks of this resolution level
+            indices (iterable(tuple(int, int, int))): Only drop these grid indices
+            derived (bool): Also drop every chunk downsampled on the fly from mip, whatever its index. Their mip is
+                a (source mip, factor) pair, see cvdb.downsample.DownsampledGrid
+
+        Returns:
+            (int): Number of chunks dropped
+        """
+        indices = None if indices is None else set(tuple(index) for index in indices)
+        with self._lock:
+            keys = [key for key in self._chunks
+                    if (cloudpath is None or key[0] == cloudpath)
+                    and (((mip is None or key[1] == mip) and (indices is None or key[2] in indices))
+                         or (derived and isinstance(key[1], tuple) and mip in (None, root_mip(key[1]))))]
+            for key in keys:
+                self._bytes -= self._chunks.pop(key)[0].nbytes
+
+        return len(keys)
+
+    def clear(self):
+        """Drop all cached chunks and reset the counters
+
+        Returns:
+            None
+        """
+        with self._lock:
+            self._chunks.clear()
+            self._bytes = 0
+            self.hits = self.misses = self.evictions = 0
+
+    @property
+    def nbytes(self):
+        """Total size of the cached chunks in bytes"""
+        return self._bytes
+
+    def stats(self):
+        """Snapshot of the cache counters
+
+        Returns:
+            (dict)
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "chunks": len(self._chunks),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+    def __len__(self):
+        return len(self._chunks)
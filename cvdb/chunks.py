@@ -0,0 +1,806 @@
+# Copyright 2021 The Johns Hopkins University Applied Physics Laboratory
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import itertools
+from abc import ABCMeta, abstractmethod
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import numpy as np
+from cloudfiles import CloudFiles
+from cloudvolume import chunks as cv_chunks
+from cloudvolume.datasource.precomputed.common import content_type, should_compress
+
+from .error import CVDBError, ErrorCodes
+from .instrument import timed
+
+"""
+.. module:: chunks
+    :synopsis: Chunk level access to a single mip of a precomputed volume.
+"""
+
+# Number of chunks transferred concurrently by a ChunkReader or ChunkWriter
+DEFAULT_PARALLEL = 16
+
+# Encodings whose stored chunks list their labels, so they can be checked for IDs without decoding
+LABEL_ENCODINGS = ("compressed_segmentation", "compresso", "crackle")
+
+
+class ChunkGrid:
+    """Chunk layout of a single mip of a precomputed volume.
+
+    Chunks are addressed by their integer grid index (i, j, k) in xyz. Chunk (0, 0, 0) starts at the voxel offset
+    of the mip and chunks on the upper edges of the volume are clipped to the volume bounds.
+
+    Args:
+        vol (cloudvolume.CloudVolume): Handle bound to the mip of interest
+
+    Attributes:
+        mip (int): Resolution level
+        key (str): Storage key (directory) of the mip
+        chunk_size (tuple(int)): Chunk dimensions in xyz
+        voxel_offset (tuple(int)): Start of the volume in xyz
+        bounds_max (tuple(int)): Exclusive end of the volume in xyz
+        dtype (numpy.dtype): Voxel data type
+        encoding (str): Chunk encoding (raw, compressed_segmentation, ...)
+        sharded (bool): True if the mip is stored in the sharded format
+    """
+    def __init__(self, vol):
+        meta = vol.meta
+        self.mip = vol.mip
+        self.key = meta.key(self.mip)
+        self.chunk_size = tuple(int(v) for v in meta.chunk_size(self.mip))
+        self.voxel_offset = tuple(int(v) for v in meta.voxel_offset(self.mip))
+        self.bounds_max = tuple(int(v) for v in meta.bounds(self.mip).maxpt)
+        self.dtype = np.dtype(meta.dtype)
+        self.encoding = meta.encoding(self.mip)
+        self.num_channels = meta.num_channels
+        self.block_size = meta.compressed_segmentation_block_size(self.mip) or (8, 8, 8)
+        self.sharded = meta.sharding(self.mip) is not None
+
+    def contains(self, corner, extent):
+        """Check if a region lies entirely inside the volume bounds
+
+        Args:
+            corner ((int, int, int)): the xyz location of the corner of the region
+            extent ((int, int, int)): the xyz extents of the region
+
+        Returns:
+            (bool)
+        """
+        return all(self.voxel_offset[d] <= corner[d] and corner[d] + extent[d] <= self.bounds_max[d]
+                   for d in range(3))
+
+    def is_aligned(self, corner, extent):
+        """Check if a region is made of whole chunks: it starts on the chunk grid and ends on it or on the volume bounds
+
+        Args:
+            corner ((int, int, int)): the xyz location of the corner of the region
+            extent ((int, int, int)): the xyz extents of the region
+
+        Returns:
+            (bool)
+        """
+        for d in range(3):
+            stop = corner[d] + extent[d]
+            if (corner[d] - self.voxel_offset[d]) % self.chunk_size[d]:
+                return False
+            if (stop - self.voxel_offset[d]) % self.chunk_size[d] and stop != self.bounds_max[d]:
+                return False
+        return True
+
+    def index_range(self, corner, extent):
+        """Get the per-axis range of grid indices touched by a region, clipped to the volume
+
+        Args:
+            corner ((int, int, int)): the xyz location of the corner of the region
+            extent ((int, int, int)): the xyz extents of the region
+
+        Returns:
+            (list(range)): One range of grid indices per axis
+        """
+        ranges = []
+        for d in range(3):
+            start = max(corner[d], self.voxel_offset[d])
+            stop = min(corner[d] + extent[d], self.bounds_max[d])
+            if stop <= start:
+                ranges.append(range(0))
+                continue
+            ranges.append(range((start - self.voxel_offset[d]) // self.chunk_size[d],
+                                (stop - 1 - self.voxel_offset[d]) // self.chunk_size[d] + 1))
+        return ranges
+
+    def indices(self, corner, extent):
+        """Get the grid indices of all chunks touched by a region, in xyz order with x fastest
+
+        Args:
+            corner ((int, int, int)): the xyz location of the corner of the region
+            extent ((int, int, int)): the xyz extents of the region
+
+        Returns:
+            (list(tuple(int, int, int)))
+        """
+        x_range, y_range, z_range = self.index_range(corner, extent)
+        return [(i, j, k) for k, j, i in itertools.product(z_range, y_range, x_range)]
+
+    def slabs(self, corner, extent, depth=None):
+        """Split a region into z slabs whose boundaries fall on the chunk grid
+
+        Args:
+            corner ((int, int, int)): the xyz location of the corner of the region
+            extent ((int, int, int)): the xyz extents of the region
+            depth (int): Slab depth in voxels, rounded up to a multiple of the chunk depth. Defaults to one chunk
+
+        Returns:
+            (list(tuple(tuple(int), tuple(int)))): xyz corner and xyz extent of each slab, in z order
+        """
+        chunk_depth = self.chunk_size[2]
+        depth = chunk_depth if not depth else -(-depth // chunk_depth) * chunk_depth
+
+        slabs = []
+        z = corner[2]
+        z_stop = corner[2] + extent[2]
+        while z < z_stop:
+            # End on the next slab boundary, counted from the volume offset
+            next_z = min(self.voxel_offset[2] + ((z - self.voxel_offset[2]) // depth + 1) * depth, z_stop)
+            slabs.append(((corner[0], corner[1], z), (extent[0], extent[1], next_z - z)))
+            z = next_z
+        return slabs
+
+    def chunk_bounds(self, index):
+        """Get the voxel bounds of a chunk
+
+        Args:
+            index ((int, int, int)): grid index of the chunk
+
+        Returns:
+            (tuple(tuple(int), tuple(int))): xyz start (inclusive) and stop (exclusive)
+        """
+        start = tuple(self.voxel_offset[d] + index[d] * self.chunk_size[d] for d in range(3))
+        stop = tuple(min(start[d] + self.chunk_size[d], self.bounds_max[d]) for d in range(3))
+        return start, stop
+
+    def filename(self, index):
+        """Get the storage key of a chunk in the unsharded precomputed format
+
+        Args:
+            index ((int, int, int)): grid index of the chunk
+
+        Returns:
+            (str)
+        """
+        start, stop = self.chunk_bounds(index)
+        return "{}/{}-{}_{}-{}_{}-{}".format(self.key, start[0], stop[0], start[1], stop[1], start[2], stop[2])
+
+
+class BaseChunkReader(metaclass=ABCMeta):
+    """Fetches whole chunks of one mip concurrently, through a decoded chunk cache. Subclasses build the chunks.
+
+    Args:
+        grid (ChunkGrid): Chunk layout of the mip
+        cloudpath (str): Cloudpath of the volume, keeping its chunks apart in the cache and the flights coalescer
+        parallel (int): Number of chunks fetched concurrently
+        cache (cvdb.chunkcache.ChunkCache): Optional decoded chunk cache consulted before building a chunk
+        populate (bool): If False, chunks built are not added to the cache
+        channels (bool): If True, chunks keep the channel axis (xyzc)
+        readahead (cvdb.readahead.ReadAhead): Optional read-ahead engine whose prefetched chunks are used on a
+            cache miss
+        flights (cvdb.singleflight.SingleFlight): Optional coalescer so concurrent fetches of the same chunk, from
+            any reader sharing it, build the chunk once
+
+    Attributes:
+        trace (cvdb.instrument.CutoutTrace): Optional trace that download and decode times, bytes read, cache
+            hits and missing chunks are added to
+    """
+    def __init__(self, grid, cloudpath, parallel=DEFAULT_PARALLEL, cache=None, populate=True, channels=False,
+                 readahead=None, flights=None):
+        self.grid = grid
+        self.cloudpath = cloudpath
+        self.parallel = parallel
+        self.cache = cache
+        self.populate = populate
+        self.channels = channels
+        self.readahead = readahead
+        self.flights = flights
+        self.trace = None
+
+    def timer(self, phase):
+        """Time a block into the reader's trace, if it has one
+
+        Args:
+            phase (str): One of cvdb.instrument.PHASES
+
+        Returns:
+            (contextmanager)
+        """
+        return timed(self.trace, phase)
+
+    @abstractmethod
+    def download(self, index):
+        """Build a single chunk, bypassing the decoded chunk cache
+
+        Args:
+            index ((int, int, int)): grid index of the chunk
+
+        Returns:
+            (numpy.ndarray|None): xyz ordered chunk data, None if the chunk does not exist
+        """
+        return NotImplemented
+
+    def store(self, index, data):
+        """Add a decoded chunk to the cache, if this reader populates one
+
+        Args:
+            index ((int, int, int)): grid index of the chunk
+            data (numpy.ndarray|None): xyz ordered chunk data
+
+        Returns:
+            (numpy.ndarray|None): data
+        """
+        if self.cache is not None and self.populate and data is not None:
+            self.cache.put(self.cache.make_key(self.cloudpath, self.grid.mip, index), data)
+        return data
+
+    def flight_key(self, index):
+        """Build the key identifying fetches of a chunk in the flights coalescer
+
+        Args:
+            index ((int, int, int)): grid index of the chunk
+
+        Returns:
+            (tuple)
+        """
+        return self.cloudpath, self.grid.mip, tuple(index), self.channels
+
+    def coalesce(self, index, func, *args):
+        """Run a fetch of a chunk, or wait for the identical one already in flight
+
+        Args:
+            index ((int, int, int)): grid index of the chunk
+            func (callable): The fetch
+            *args: Arguments to func
+
+        Returns:
+            The result of func
+        """
+        if self.flights is None:
+            return func(*args)
+        return self.flights.do(self.flight_key(index), func, *args)
+
+    def fetch(self, index, ids=None):
+        """Build a single chunk, adding it to the cache.
+
+        Concurrent fetches of the same chunk are coalesced if the reader has a flights coalescer. Fetches that
+        filter by ID may skip decoding, so they always run on their own.
+
+        Args:
+            index ((int, int, int)): grid index of the chunk
+            ids (numpy.ndarray): Optional sorted IDs of interest. ChunkReader doesn't decode chunks whose encoding
+                lists its labels (and returns None) if they hold none of them
+
+        Returns:
+            (numpy.ndarray|None): xyz ordered chunk data, None if the chunk does not exist
+        """
+        if ids is None:
+            return self.coalesce(index, self._fetch, index)
+        return self._fetch(index, ids)
+
+    def _fetch(self, index, ids=None):
+        """Build a single chunk, adding it to the cache. See fetch()"""
+        return self.store(index, self.download(index))
+
+    def lookup(self, index):
+        """Get a chunk from the cache (or the read-ahead buffer) without downloading it
+
+        Args:
+            index ((int, int, int)): grid index of the chunk
+
+        Returns:
+            (numpy.ndarray|None): xyz ordered chunk data, None if the chunk is not cached
+        """
+        if self.cache is None:
+            return None
+
+        key = self.cache.make_key(self.cloudpath, self.grid.mip, index)
+        data = self.cache.get(key)
+        if data is None and self.readahead is not None:
+            data = self.readahead.take(key)
+            if data is not None:
+                self.cache.put(key, data)
+        if data is not None and self.trace is not None:
+            self.trace.count("cache_hits")
+        return data
+
+    def iter_read(self, indices, ids=None):
+        """Fetch a set of chunks concurrently, yielding each one as soon as it is decoded.
+
+        Consuming chunks as they arrive keeps at most about `parallel` decoded chunks alive at once. Each chunk
+        is downloaded once even if listed more than once.
+
+        Args:
+            indices (iterable(tuple(int, int, int))): grid indices of the chunks
+            ids (numpy.ndarray): Optional sorted IDs of interest, see fetch()
+
+        Yields:
+            (tuple(tuple(int, int, int), numpy.ndarray|None)): grid index and xyz ordered chunk data
+        """
+        indices = list(dict.fromkeys(indices))
+
+        # Serve cached chunks without touching the thread pool
+        if self.cache is not None:
+            misses = []
+            for index in indices:
+                data = self.lookup(index)
+                if data is None:
+                    misses.append(index)
+                else:
+                    yield index, data
+            indices = misses
+
+        if len(indices) <= 1 or self.parallel <= 1:
+            for index in indices:
+                yield index, self.fetch(index, ids)
+            return
+
+        # Only keep `parallel` fetches outstanding so decoded chunks can't pile up faster than they are consumed
+        pending = iter(indices)
+        with ThreadPoolExecutor(max_workers=min(self.parallel, len(indices))) as pool:
+            futures = {pool.submit(self.fetch, index, ids): index
+                       for index in itertools.islice(pending, self.parallel)}
+            try:
+                while futures:
+                    done, _ = wait(futures, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        index = futures.pop(future)
+                        for next_index in itertools.islice(pending, 1):
+                            futures[pool.submit(self.fetch, next_index, ids)] = next_index
+                        yield index, future.result()
+            finally:
+                for future in futures:
+                    future.cancel()
+
+    def read(self, indices):
+        """Fetch a set of chunks concurrently. Each chunk is downloaded once even if listed more than once.
+
+        Args:
+            indices (iterable(tuple(int, int, int))): grid indices of the chunks
+
+        Returns:
+            (dict): grid index -> xyz ordered chunk data (or None if the chunk does not exist)
+        """
+        return dict(self.iter_read(indices))
+
+
+class ChunkReader(BaseChunkReader):
+    """Downloads and decodes whole chunks of one mip of a volume, fetching chunks concurrently.
+
+    Decoded chunks are numpy arrays in xyz order (the layout cloudvolume returns) with the channel axis dropped,
+    unless `channels` is set. Missing chunks are returned as None so callers can leave the corresponding region
+    zero filled.
+
+    Args:
+        vol (cloudvolume.CloudVolume): Handle bound to the mip of interest
+        parallel (int): Number of chunks fetched concurrently
+        cache (cvdb.chunkcache.ChunkCache): Optional decoded chunk cache consulted before downloading
+        disk_cache (cvdb.diskcache.DiskChunkCache): Optional local cache of chunk files consulted before storage
+        populate (bool): If False, chunks read from storage are not added to the caches
+        channels (bool): If True, decoded chunks keep the channel axis (xyzc)
+        readahead (cvdb.readahead.ReadAhead): Optional read-ahead engine whose prefetched chunks are used on a
+            cache miss
+        flights (cvdb.singleflight.SingleFlight): Optional coalescer so concurrent fetches of the same chunk, from
+            any reader sharing it, download the chunk once
+        occupancy (cvdb.occupancy.ChunkOccupancy): Optional record of which chunks exist. Chunks it knows to be
+            absent are returned as None without asking storage, and chunks found missing are reported to it
+        fill_missing (bool): If False, missing chunks raise CVDBError instead of being returned as None
+
+    Attributes:
+        grid (ChunkGrid): Chunk layout of the mip
+    """
+    def __init__(self, vol, parallel=DEFAULT_PARALLEL, cache=None, disk_cache=None, populate=True, channels=False,
+                 readahead=None, flights=None, occupancy=None, fill_missing=True):
+        super().__init__(ChunkGrid(vol), vol.meta.cloudpath, parallel, cache, populate, channels, readahead, flights)
+        self.vol = vol
+        self.disk_cache = disk_cache
+        self.occupancy = occupancy
+        self.fill_missing = fill_missing
+        self._files = CloudFiles(self.cloudpath, secrets=vol.meta.config.secrets, green=vol.meta.config.green)
+
+    def decode(self, index, content):
+        """Decode the stored bytes of a chunk
+
+        Args:
+            index ((int, int, int)): grid index of the chunk
+            content (bytes|None): decompressed file contents, None if the chunk does not exist
+
+        Returns:
+            (numpy.ndarray|None): xyz ordered chunk data
+        """
+        if not content:
+            return None
+
+        start, stop = self.grid.chunk_bounds(index)
+        shape = [stop[d] - start[d] for d in range(3)] + [self.grid.num_channels]
+        with self.timer("decode"):
+            data = cv_chunks.decode(content, encoding=self.grid.encoding, shape=shape, dtype=self.grid.dtype,
+                                    block_size=self.grid.block_size)
+        return data if self.channels else data[:, :, :, 0]
+
+    def is_absent(self, index):
+        """Check if a chunk is known not to exist, so it can be read as zeros without asking storage
+
+        Args:
+            index ((int, int, int)): grid index of the chunk
+
+        Returns:
+            (bool)
+        """
+        if self.occupancy is None or not self.occupancy.is_absent(self.cloudpath, self.grid.mip, index):
+            return False
+        if self.trace is not None:
+            self.trace.count("missing")
+        return True
+
+    def check_missing(self, index):
+        """Fail on a missing chunk unless the reader reads missing chunks as zeros
+
+        Args:
+            index ((int, int, int)): grid index of the missing chunk
+
+        Returns:
+            None
+
+        Raises:
+            (CVDBError): If fill_missing is off
+        """
+        if not self.fill_missing:
+            raise CVDBError("Chunk {} of {} is missing.".format(self.grid.filename(index), self.cloudpath),
+                            ErrorCodes.OBJECT_STORE_ERROR)
+
+    def load(self, index):
+        """Get the stored bytes of a chunk from the disk cache or storage. Not supported for sharded mips
+
+        Args:
+            index ((int, int, int)): grid index of the chunk
+
+        Returns:
+            (bytes|None): decompressed file contents, None if the chunk does not exist
+
+        Raises:
+            (CVDBError): If the chunk does not exist and fill_missing is off
+        """
+        if self.is_absent(index):
+            self.check_missing(index)
+            return None
+
+        filename = self.grid.filename(index)
+        with self.timer("download"):
+            if self.disk_cache is None:
+                content = self._files.get(filename)
+            else:
+                content = self.disk_cache.get(self.cloudpath, filename)
+                if content is None:
+                    content = self._files.get(filename)
+                    if content and self.populate:
+                        self.disk_cache.put(self.cloudpath, filename, content)
+
+        if not content and self.occupancy is not None:
+            self.occupancy.record_missing(self.cloudpath, self.grid.mip, index)
+        if self.trace is not None:
+            self.trace.count("bytes" if content else "missing", len(content) if content else 1)
+        if not content:
+            self.check_missing(index)
+        return content
+
+    def download(self, index):
+        """Download (or read from the disk cache) and decode a single chunk, bypassing the decoded chunk cache
+
+        Args:
+            index ((int, int, int)): grid index of the chunk
+
+        Returns:
+            (numpy.ndarray|None): xyz ordered chunk data, None if the chunk does not exist
+        """
+        if self.grid.sharded:
+            # Sharded files bundle many chunks, so let cloudvolume resolve the shard index
+            start, stop = self.grid.chunk_bounds(index)
+            with self.timer("download"):
+                data = np.asarray(self.vol[start[0]:stop[0], start[1]:stop[1], start[2]:stop[2]])
+            return data if self.channels else data[:, :, :, 0]
+
+        return self.decode(index, self.load(index))
+
+    def _fetch(self, index, ids=None):
+        """Download and decode a single chunk, adding it to the cache. See fetch()"""
+        if ids is None or self.grid.encoding not in LABEL_ENCODINGS or self.grid.sharded:
+            return self.store(index, self.download(index))
+
+        content = self.load(index)
+        if not content:
+            return None
+
+        start, stop = self.grid.chunk_bounds(index)
+        labels = cv_chunks.labels(content, self.grid.encoding, shape=[stop[d] - start[d] for d in range(3)],
+                                  dtype=self.grid.dtype, block_size=self.grid.block_size)
+        if not np.isin(labels, ids).any():
+            return None
+        return self.store(index, self.decode(index, content))
+
+
+class ChunkWriter:
+    """Encodes and uploads whole chunks of one mip of a volume, uploading chunks concurrently.
+
+    Regions are split on the chunk grid. Chunks covered completely by a region are encoded straight from the input
+    and uploaded without touching storage. Only chunks on unaligned edges of the region are read, patched and
+    written back, unless every chunk needs the existing data (blacking out, or writing a subset of the channels).
+
+    Args:
+        vol (cloudvolume.CloudVolume): Writable handle bound to the mip of interest
+        parallel (int): Number of chunks encoded and uploaded concurrently
+
+    Attributes:
+        grid (ChunkGrid): Chunk layout of the mip
+
+    Raises:
+        (CVDBError): If the mip is sharded. Shards bundle many chunks and can't be rewritten a chunk at a time
+    """
+    def __init__(self, vol, parallel=DEFAULT_PARALLEL):
+        self.vol = vol
+        self.grid = ChunkGrid(vol)
+        if self.grid.sharded:
+            raise CVDBError("Writing to sharded mip {} is not supported.".format(self.grid.mip),
+                            ErrorCodes.CVDB_ERROR)
+
+        self.parallel = parallel
+        self.cloudpath = vol.meta.cloudpath
+        self.compress = should_compress(self.grid.encoding, None, None)
+        self.content_type = content_type(self.grid.encoding)
+        self.compression_params = vol.meta.compression_params(self.grid.mip)
+        self._files = CloudFiles(self.cloudpath, secrets=vol.meta.config.secrets, green=vol.meta.config.green)
+        self._reader = ChunkReader(vol, parallel=parallel, populate=False, channels=True)
+
+    def upload(self, index, data):
+        """Encode and upload a single chunk
+
+        Args:
+            index ((int, int, int)): grid index of the chunk
+            data (numpy.ndarray): xyzc ordered chunk data covering the whole chunk
+
+        Returns:
+            None
+        """
+        content = cv_chunks.encode(data, self.grid.encoding, self.grid.block_size,
+                                   compression_params=self.compression_params)
+        self._files.put(self.grid.filename(index), content, content_type=self.content_type, compress=self.compress)
+
+    def covers(self, corner, extent, index):
+        """Check if a region covers a chunk completely
+
+        Args:
+            corner ((int, int, int)): the xyz location of the corner of the region
+            extent ((int, int, int)): the xyz extents of the region
+            index ((int, int, int)): grid index of the chunk
+
+        Returns:
+            (bool)
+        """
+        start, stop = self.grid.chunk_bounds(index)
+        return all(corner[d] <= start[d] and stop[d] <= corner[d] + extent[d] for d in range(3))
+
+    def patch(self, index, chunk_data, corner, data, channel_start, to_black):
+        """Merge the part of a region that overlaps a chunk into the chunk's existing data
+
+        Args:
+            index ((int, int, int)): grid index of the chunk
+            chunk_data (numpy.ndarray|None): existing xyzc chunk data, None if the chunk does not exist
+            corner ((int, int, int)): the xyz location of the corner of the region
+            data (numpy.ndarray): xyzc ordered region data
+            channel_start (int): first channel written by data
+            to_black (bool): If True, data is a mask and voxels where it is 1 are set to zero
+
+        Returns:
+            (numpy.ndarray|None): The patched chunk, None if there is nothing to write
+        """
+        start, stop = self.grid.chunk_bounds(index)
+        if chunk_data is None:
+            if to_black:
+                return None
+            chunk_data = np.zeros([stop[d] - start[d] for d in range(3)] + [self.grid.num_channels],
+                                  dtype=self.grid.dtype, order="F")
+        else:
+            chunk_data = np.array(chunk_data, order="F")
+
+        src = []
+        dst = []
+        for d in range(3):
+            lo = max(corner[d], start[d])
+            hi = min(corner[d] + data.shape[d], stop[d])
+            src.append(slice(lo - corner[d], hi - corner[d]))
+            dst.append(slice(lo - start[d], hi - start[d]))
+
+        target = chunk_data[dst[0], dst[1], dst[2], channel_start:channel_start + data.shape[3]]
+        values = data[src[0], src[1], src[2]]
+        if to_black:
+            target[values == 1] = 0
+        else:
+            target[...] = values
+        return chunk_data
+
+    def iter_chunks(self, corner, data, channel_start=0, to_black=False):
+        """Split a region into whole chunks ready to upload
+
+        Covered chunks are yielded first as views of data, then boundary chunks as they are read and patched.
+
+        Args:
+            corner ((int, int, int)): the xyz location of the corner of the region
+            data (numpy.ndarray): xyzc ordered region data
+            channel_start (int): first channel written by data
+            to_black (bool): If True, data is a mask and voxels where it is 1 are set to zero
+
+        Yields:
+            (tuple(tuple(int, int, int), numpy.ndarray)): grid index and xyzc chunk data
+        """
+        extent = data.shape[:3]
+        all_channels = channel_start == 0 and data.shape[3] == self.grid.num_channels
+
+        partial = []
+        for index in self.grid.indices(corner, extent):
+            if to_black or not all_channels or not self.covers(corner, extent, index):
+                partial.append(index)
+                continue
+            start, stop = self.grid.chunk_bounds(index)
+            yield index, data[start[0] - corner[0]:stop[0] - corner[0],
+                              start[1] - corner[1]:stop[1] - corner[1],
+                              start[2] - corner[2]:stop[2] - corner[2]]
+
+        for index, chunk_data in self._reader.iter_read(partial):
+            chunk_data = self.patch(index, chunk_data, corner, data, channel_start, to_black)
+            if chunk_data is not None:
+                yield index, chunk_data
+
+    def write(self, corner, data, channel_start=0, to_black=False):
+        """Write a region, uploading up to `parallel` chunks at once
+
+        Args:
+            corner ((int, int, int)): the xyz location of the corner of the region
+            data (numpy.ndarray): xyzc ordered region data
+            channel_start (int): first channel written by data
+            to_black (bool): If True, data is a mask and voxels where it is 1 are set to zero
+
+        Returns:
+            (list(tuple(int, int, int))): grid indices of the chunks that were uploaded
+
+        Raises:
+            (CVDBError)
+        """
+        check_bounds(self.grid, corner, data.shape[:3])
+        if channel_start < 0 or channel_start + data.shape[3] > self.grid.num_channels:
+            raise CVDBError("Channels [{}, {}) are outside the {} channels of mip {}.".format(
+                channel_start, channel_start + data.shape[3], self.grid.num_channels, self.grid.mip),
+                ErrorCodes.CVDB_ERROR)
+
+        written = []
+        chunks = self.iter_chunks(corner, data, channel_start, to_black)
+        if self.parallel <= 1:
+            for index, chunk_data in chunks:
+                self.upload(index, chunk_data)
+                written.append(index)
+            return written
+
+        # Only keep `parallel` uploads outstanding so encoded chunks can't pile up faster than they are sent
+        with ThreadPoolExecutor(max_workers=self.parallel) as pool:
+            futures = set()
+            for index, chunk_data in chunks:
+                if len(futures) >= self.parallel:
+                    done, futures = wait(futures, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        future.result()
+                futures.add(pool.submit(self.upload, index, chunk_data))
+                written.append(index)
+            for future in futures:
+                future.result()
+        return written
+
+
+def paste_chunk(out, t_index, corner, chunk_start, chunk_data, channel=0, ids=None):
+    """Copy the part of a decoded chunk that overlaps a region into a TZYX buffer
+
+    The transpose is a strided view, so each overlapping voxel is copied exactly once. With ids, only voxels holding
+    one of the IDs are copied, so out must be zero filled.
+
+    Args:
+        out (numpy.ndarray): TZYX buffer holding the region
+        t_index (int): index into the time axis of out
+        corner ((int, int, int)): the xyz location of the corner of the region held in out
+        chunk_start ((int, int, int)): the xyz location of the corner of the chunk
+        chunk_data (numpy.ndarray): xyz or xyzc ordered chunk data
+        channel (int): channel of xyzc chunk data to copy
+        ids (numpy.ndarray): Optional sorted IDs to keep
+
+    Returns:
+        (bool): False if the chunk does not overlap the region, or holds none of the IDs in it
+    """
+    if chunk_data.ndim == 4:
+        chunk_data = chunk_data[:, :, :, channel]
+
+    extent = (out.shape[3], out.shape[2], out.shape[1])
+    src = []
+    dst = []
+    for d in range(3):
+        lo = max(corner[d], chunk_start[d])
+        hi = min(corner[d] + extent[d], chunk_start[d] + chunk_data.shape[d])
+        if hi <= lo:
+            return False
+        src.append(slice(lo - chunk_start[d], hi - chunk_start[d]))
+        dst.append(slice(lo - corner[d], hi - corner[d]))
+
+    src_data = chunk_data[src[0], src[1], src[2]]
+    if ids is None:
+        np.copyto(out[t_index, dst[2], dst[1], dst[0]], src_data.T)
+        return True
+
+    mask = np.isin(src_data, ids)
+    if not mask.any():
+        return False
+    np.copyto(out[t_index, dst[2], dst[1], dst[0]], src_data.T, where=mask.T)
+    return True
+
+
+def fill_chunk(out, t_index, corner, chunk_start, chunk_stop, chunk_data, channel=0):
+    """Copy a whole decoded chunk into its slot of a TZYX buffer holding a chunk aligned region
+
+    The slot is found from the chunk's offset in the region, without clipping. A missing chunk zeroes its slot, so
+    out need not be zero filled when every chunk of the region is filled.
+
+    Args:
+        out (numpy.ndarray): TZYX buffer holding the region
+        t_index (int): index into the time axis of out
+        corner ((int, int, int)): the xyz location of the corner of the region held in out
+        chunk_start ((int, int, int)): the xyz location of the corner of the chunk
+        chunk_stop ((int, int, int)): the exclusive xyz end of the chunk
+        chunk_data (numpy.ndarray|None): xyz or xyzc ordered chunk data, None if the chunk does not exist
+        channel (int): channel of xyzc chunk data to copy
+
+    Returns:
+        None
+    """
+    slot = out[t_index,
+               chunk_start[2] - corner[2]:chunk_stop[2] - corner[2],
+               chunk_start[1] - corner[1]:chunk_stop[1] - corner[1],
+               chunk_start[0] - corner[0]:chunk_stop[0] - corner[0]]
+    if chunk_data is None:
+        slot.fill(0)
+        return
+
+    if chunk_data.ndim == 4:
+        chunk_data = chunk_data[:, :, :, channel]
+    # Decoded chunks are Fortran ordered xyz, so the transpose is a C ordered zyx view and the copy keeps memory order
+    np.copyto(slot, chunk_data.T)
+
+
+def check_bounds(grid, corner, extent):
+    """Raise if a region is not contained in the volume
+
+    Args:
+        grid (ChunkGrid): Chunk layout of the mip
+        corner ((int, int, int)): the xyz location of the corner of the region
+        extent ((int, int, int)): the xyz extents of the region
+
+    Returns:
+        None
+
+    Raises:
+        (CVDBError)
+    """
+    if not grid.contains(corner, extent):
+        raise CVDBError("Region at {} with extent {} is outside the bounds of mip {}.".format(
+            tuple(corner), tuple(extent), grid.mip), ErrorCodes.CVDB_ERROR)
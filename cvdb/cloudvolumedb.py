@@ -12,19 +12,546 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+
 import numpy as np
-from cloudvolume import CloudVolume
+from .aio import AsyncReadPool
+from .annocube import AnnotateCube64
+from .chunkcache import SHARED_TTL, ChunkCache
+from .chunks import ChunkGrid, ChunkReader, ChunkWriter, check_bounds, fill_chunk, paste_chunk
+from .config import BackendConfig
 from .cube import Cube
-from .error import CVDBError
+from .downsample import DEFAULT_PARALLEL as DOWNSAMPLE_PARALLEL, DownsampledGrid, DownsampledReader
+from .error import CVDBError, ErrorCodes, logger
+from .handlecache import VolumeHandleCache
+from .instrument import CutoutTrace, timed
+from .occupancy import OccupancyIndex
+from .payload import BloscPayload
+from .propagate import Propagator, pooling_factor
+from .singleflight import SingleFlight
 
 
 class CloudVolumeDB:
     """
-    Wrapper interface for cloudvolume read access to bossDB.
+    Wrapper interface for cloudvolume access to bossDB.
+
+    Args:
+        cv_config (dict): Backend I/O settings: storage protocol and path template, parallelism, green threads and
+        caching, with per-channel overrides. See cvdb.config.BackendConfig. HTTP connection pool size and timeouts
+        are process wide, see cvdb.config.configure_http()
+        handle_cache (VolumeHandleCache): Cache of CloudVolume handles. Defaults to a cache shared by every
+        CloudVolumeDB instance in the process, since instances are usually created per request.
+        chunk_cache (ChunkCache): Optional cache of decoded chunks, used by access_mode "cache". Pass
+        CloudVolumeDB.shared_chunk_cache to share one with every CloudVolumeDB instance in the process. Without one,
+        every read goes to storage (or the disk cache), so writes made by other processes are always seen.
+        disk_cache (DiskChunkCache): Optional persistent local cache of chunk files, used by access_mode "cache"
+        async_pool (AsyncReadPool): Thread pools and concurrency limits used by cutout_async. Defaults to pools shared
+        by every CloudVolumeDB instance in the process.
+        readahead (ReadAhead): Optional read-ahead engine. cutout() calls with access_mode "cache" feed it their
+        regions and are served the chunks it prefetched. Needs a chunk_cache. Share one instance between
+        CloudVolumeDB instances so it sees every request of a client.
+        single_flight (SingleFlight): Coalescer of concurrent fetches of the same chunk, used by access_mode
+        "cache". Defaults to one shared by every CloudVolumeDB instance in the process.
+        hooks (list(callable)): Called with the cvdb.instrument.CutoutTrace of every cutout() once it finishes, e.g.
+        a cvdb.instrument.StatsAggregator. Cutouts are only traced if there is a hook
+        occupancy (ChunkOccupancy): Optional record of which chunks exist, used by access_mode "cache" to read absent
+        chunks of sparse volumes as zeros without asking storage. See build_occupancy()
     """
 
-    def __init__(self, cv_config=None):
+    # Supported values of the access_mode argument of the read methods
+    ACCESS_MODES = ("cache", "no_cache", "raw")
+
+    # Process-wide handle cache so info files are fetched once per volume and mip, not once per request
+    shared_handle_cache = VolumeHandleCache()
+
+    # Opt-in process-wide decoded chunk cache so repeated reads of hot chunks skip download and decode. Chunks expire
+    # after SHARED_TTL seconds, bounding how stale writes made outside this process can be served
+    shared_chunk_cache = ChunkCache(ttl=SHARED_TTL)
+
+    # Process-wide pools so every asyncio cutout in the process shares a few threads
+    shared_async_pool = AsyncReadPool()
+
+    # Process-wide coalescer so concurrent requests for the same chunk, from any thread, download it once
+    shared_single_flight = SingleFlight()
+
+    # Number of per-time layers read concurrently by a time series cutout
+    TIME_PARALLEL = 4
+
+    def __init__(self, cv_config=None, handle_cache=None, chunk_cache=None, disk_cache=None, async_pool=None,
+                 readahead=None, single_flight=None, hooks=None, occupancy=None):
         self.cv_config = cv_config
+        self.config = BackendConfig(cv_config)
+        self.handle_cache = handle_cache if handle_cache is not None else CloudVolumeDB.shared_handle_cache
+        self.chunk_cache = chunk_cache
+        self.disk_cache = disk_cache
+        self.async_pool = async_pool if async_pool is not None else CloudVolumeDB.shared_async_pool
+        self.readahead = readahead
+        self.single_flight = single_flight if single_flight is not None else CloudVolumeDB.shared_single_flight
+        self.hooks = list(hooks or [])
+        self.occupancy = occupancy
+
+    def get_volume(self, channel, resolution, writable=False, time_sample=0):
+        """Get a (cached) CloudVolume handle for a channel at a resolution level
+
+        Args:
+            channel (spdb.project.Channel): Channel being accessed
+            resolution (int): the resolution level
+            writable (bool): If True, get a handle on the authenticated endpoint instead of the read-only HTTPS one
+            time_sample (int): Get the per-time layer of this time sample, see the time_layer_template setting in
+                cvdb.config
+
+        Returns:
+            (cloudvolume.CloudVolume)
+
+        Raises:
+            (CVDBError)
+        """
+        # NOTE: Refer to Tim's changes for channel method to check storage type.
+        if channel.storage_type != "cloudvol":
+            raise CVDBError(
+                f"Storage type {channel.storage_type} not configured for cloudvolume.",
+                701,
+            )
+
+        # Reads default to the HTTPS version of the dataset. This is READ-ONLY and PUBLIC-ONLY, but much faster to
+        # download. The protocol, path and handle options come from cv_config
+        options = self.config.volume_options(channel, writable)
+        cv_path = channel.cv_path
+        if time_sample:
+            template = self.config.settings(channel)["time_layer_template"]
+            if template is None:
+                raise CVDBError(f"Channel {cv_path} has no time sample {time_sample}. Time series are stored on the "
+                                "channel axis of the volume, unless cv_config sets a time_layer_template.",
+                                ErrorCodes.CVDB_ERROR)
+            cv_path = template.format(cv_path=cv_path, time_sample=time_sample)
+        return self.handle_cache.get(channel.bucket, cv_path, resolution, options)
+
+    def get_time_layout(self, channel, resolution, time_samples, writable=False):
+        """Find where each time sample of a channel is stored
+
+        Volumes with several channels store time sample t in channel t. Single channel volumes hold time sample 0,
+        and the other time samples in layers located by the time_layer_template setting, if cv_config has one.
+
+        Args:
+            channel (spdb.project.Channel): Channel being accessed
+            resolution (int): the resolution level
+            time_samples (range): The time samples of interest
+            writable (bool): If True, get writable handles
+
+        Returns:
+            (list(tuple(cloudvolume.CloudVolume, list(tuple(int, int))))): Each volume holding some of the time
+            samples, with (index into time_samples, channel of the volume) pairs for the samples it holds
+
+        Raises:
+            (CVDBError)
+        """
+        vol = self.get_volume(channel, resolution, writable)
+        num_channels = vol.meta.num_channels
+        if num_channels > 1:
+            if time_samples.start < 0 or time_samples.stop > num_channels:
+                raise CVDBError(f"Time samples [{time_samples.start}, {time_samples.stop}) are outside the "
+                                f"{num_channels} stored in the cloudvolume.", ErrorCodes.CVDB_ERROR)
+            return [(vol, [(t_index, t) for t_index, t in enumerate(time_samples)])]
+
+        if time_samples.start < 0:
+            raise CVDBError(f"Invalid time sample {time_samples.start}.", ErrorCodes.CVDB_ERROR)
+        return [(vol if t == 0 else self.get_volume(channel, resolution, writable, t), [(t_index, 0)])
+                for t_index, t in enumerate(time_samples)]
+
+    def get_mip(self, resource, resolution, iso=False):
+        """Map a Boss resolution level to the mip of the channel's volume that holds it
+
+        Anisotropic channels keep z fixed in their hierarchy, so above the isotropic level the "isotropic version"
+        of a resolution is a separate scale of the volume. It is found by matching the voxel size relative to mip 0.
+
+        Args:
+            resource (spdb.project.BossResource): Data model info based on the request or target resource
+            resolution (int): the resolution level
+            iso (bool): If True, get the mip of the isotropic version of the resolution level
+
+        Returns:
+            (int)
+
+        Raises:
+            (CVDBError): If the volume has no isotropic version of the resolution level
+        """
+        if not iso:
+            return resolution
+
+        mip = self.find_iso_mip(resource, resolution)
+        if mip is not None:
+            return mip
+
+        raise CVDBError(f"No isotropic version of resolution {resolution} in the cloudvolume.",
+                        ErrorCodes.RESOLUTION_MISMATCH)
+
+    def find_iso_mip(self, resource, resolution):
+        """Find the mip holding the isotropic version of a resolution level
+
+        Args:
+            resource (spdb.project.BossResource): Data model info based on the request or target resource
+            resolution (int): the resolution level
+
+        Returns:
+            (int|None): None if the volume has no scale with the isotropic voxel size
+        """
+        iso_dims = resource.get_downsampled_voxel_dims(iso=True)
+        if iso_dims[resolution] == resource.get_downsampled_voxel_dims(iso=False)[resolution]:
+            return resolution
+
+        scale = np.array(iso_dims[resolution]) / np.array(iso_dims[0])
+        meta = self.get_volume(resource.get_channel(), 0).meta
+        for mip in range(len(meta.scales)):
+            if np.allclose(np.array(meta.resolution(mip)) / np.array(meta.resolution(0)), scale):
+                return mip
+        return None
+
+    def get_iso_source(self, resource, resolution):
+        """Find how to read the isotropic version of a resolution level
+
+        Args:
+            resource (spdb.project.BossResource): Data model info based on the request or target resource
+            resolution (int): the resolution level
+
+        Returns:
+            (tuple(int, tuple((int, int, int), str)|None)): The mip to read, and the xyz factor and pooling method to
+            downsample it with on the fly, or None if the mip is isotropic already
+        """
+        mip = self.find_iso_mip(resource, resolution)
+        if mip is not None:
+            return mip, None
+
+        # The anisotropic hierarchy keeps z fixed, so the isotropic version only differs by pooling in z
+        z_factor = (resource.get_downsampled_voxel_dims(iso=True)[resolution][2] //
+                    resource.get_downsampled_voxel_dims(iso=False)[resolution][2])
+        method = "mean" if resource.get_channel().is_image() else "mode"
+        return resolution, ((1, 1, z_factor), method)
+
+    def has_level(self, resource, mip):
+        """Check if a mip of a channel's volume holds data
+
+        A mip is missing if the volume has no scale for it, or if its occupancy index lists no chunks, e.g. because
+        the channel hasn't been downsampled yet.
+
+        Args:
+            resource (spdb.project.BossResource): Data model info based on the request or target resource
+            mip (int): the mip of the volume
+
+        Returns:
+            (bool)
+        """
+        channel = resource.get_channel()
+        if mip >= len(self.get_volume(channel, 0).meta.scales):
+            return False
+        if self.occupancy is None:
+            return True
+        index = self.occupancy.get_index(self.get_volume(channel, mip).meta.cloudpath, mip)
+        return index is None or bool(index)
+
+    def get_read_source(self, resource, resolution, iso=False):
+        """Find how to read a resolution level, falling back to a finer level when it is missing
+
+        Missing levels (see has_level()) are synthesized from the nearest finer level that holds data, pooling it one
+        level at a time the way the hierarchy is built. Each step goes through the chunk cache, so repeated views
+        of a region are pooled once.
+
+        Args:
+            resource (spdb.project.BossResource): Data model info based on the request or target resource
+            resolution (int): the resolution level
+            iso (bool): If True, read the isotropic version of the resolution level, see get_iso_source()
+
+        Returns:
+            (tuple(int, list(tuple((int, int, int), str)))): The mip to read, and the xyz factor and pooling method of
+            each downsampling step applied to it on the fly, in order. Empty if the mip is read as stored
+        """
+        mip, downsample = self.get_iso_source(resource, resolution) if iso else (resolution, None)
+        steps = [downsample] if downsample else []
+        if self.has_level(resource, mip):
+            return mip, steps
+
+        aniso_dims = resource.get_downsampled_voxel_dims(iso=False)
+        target_dims = resource.get_downsampled_voxel_dims(iso=iso)[resolution]
+        method = "mean" if resource.get_channel().is_image() else "mode"
+        for finer in range(resolution if mip != resolution else resolution - 1, -1, -1):
+            if not self.has_level(resource, finer):
+                continue
+            steps = [(pooling_factor(aniso_dims[res - 1], aniso_dims[res]), method)
+                     for res in range(finer + 1, resolution + 1)]
+            if target_dims != aniso_dims[resolution]:
+                steps.append((pooling_factor(aniso_dims[resolution], target_dims), method))
+            logger("CloudVolumeDB").debug(f"Resolution {resolution} is missing, synthesizing it from mip {finer}.")
+            return finer, steps
+
+        # Nothing finer holds data either, so read the level as it is
+        return mip, steps
+
+    def invalidate(self, channel, resolution, indices=None, time_sample=0):
+        """Drop cached chunks of a channel so later reads see data written to storage
+
+        Args:
+            channel (spdb.project.Channel): Channel being accessed
+            resolution (int): the mip of the volume
+            indices (iterable(tuple(int, int, int))): Only drop these grid indices. None drops every chunk. Chunks
+                downsampled on the fly from the mip are always dropped
+            time_sample (int): Time sample selecting the per-time layer. See get_volume()
+
+        Returns:
+            None
+        """
+        vol = self.get_volume(channel, resolution, time_sample=time_sample)
+        cloudpath = vol.meta.cloudpath
+        indices = None if indices is None else list(indices)
+        if self.chunk_cache is not None:
+            self.chunk_cache.invalidate(cloudpath, resolution, indices, derived=True)
+        if self.readahead is not None:
+            self.readahead.invalidate(cloudpath, resolution, indices)
+        if self.disk_cache is not None:
+            filenames = None
+            if indices is not None:
+                grid = ChunkReader(vol).grid
+                filenames = [grid.filename(index) for index in indices]
+            self.disk_cache.invalidate(cloudpath, filenames)
+        if self.occupancy is not None:
+            self.occupancy.invalidate(cloudpath, resolution, indices)
+
+    def record_written(self, channel, resolution, indices, time_sample=0):
+        """Update the caches and the occupancy tracker after chunks were uploaded
+
+        Args:
+            channel (spdb.project.Channel): Channel being accessed
+            resolution (int): the mip of the volume
+            indices (list(tuple(int, int, int))): grid indices of the uploaded chunks
+            time_sample (int): Time sample selecting the per-time layer. See get_volume()
+
+        Returns:
+            None
+        """
+        self.invalidate(channel, resolution, indices, time_sample)
+        if self.occupancy is not None:
+            cloudpath = self.get_volume(channel, resolution, time_sample=time_sample).meta.cloudpath
+            self.occupancy.record_present(cloudpath, resolution, indices)
+
+    def build_occupancy(self, resource, resolution, time_sample=0):
+        """Build the occupancy index of a channel's mip by listing its chunk files, and install it
+
+        Listing goes through the authenticated endpoint, since the HTTPS one can't list. This reads the whole
+        listing of the mip, so it is meant to run offline, e.g. after ingest. Later writes through write_cuboid keep
+        the index up to date. Rebuild it after writing with other tools, or absent chunks will read as zeros.
+
+        Args:
+            resource (spdb.project.BossResource): Data model info based on the request or target resource
+            resolution (int): the mip of the volume
+            time_sample (int): Time sample selecting the per-time layer. See get_volume()
+
+        Returns:
+            (cvdb.occupancy.OccupancyIndex)
+
+        Raises:
+            (CVDBError)
+        """
+        if self.occupancy is None:
+            raise CVDBError("CloudVolumeDB has no occupancy tracker to hold the index.", ErrorCodes.CVDB_ERROR)
+
+        channel = resource.get_channel()
+        cloudpath = self.get_volume(channel, resolution, time_sample=time_sample).meta.cloudpath
+        try:
+            index = OccupancyIndex.build(self.get_volume(channel, resolution, writable=True, time_sample=time_sample))
+        except CVDBError:
+            raise
+        except Exception as e:
+            raise CVDBError(f"Error listing cloudvolume chunks: {e}")
+
+        self.occupancy.set_index(cloudpath, resolution, index)
+        return index
+
+    def get_reader(self, vol, access_mode="cache", channel=None):
+        """Get a chunk reader for a volume handle
+
+        access_mode selects how the caches are used:
+            cache: read through the in-memory and disk caches (and the read-ahead buffer), populating both on a miss.
+                Concurrent misses on the same chunk share one download, and chunks the occupancy tracker knows to be
+                absent are read as zeros without asking storage
+            no_cache: read from storage without consulting or populating either cache. Concurrent misses still share
+                one download, and chunks the occupancy tracker knows to be absent are still read as zeros
+            raw: read straight from storage, bypassing every cache, the occupancy tracker and download sharing
+
+        The channel's cv_config settings set the download parallelism and can turn either cache, or the occupancy
+        tracker, off.
+
+        Args:
+            vol (cloudvolume.CloudVolume): Handle bound to a mip
+            access_mode (str): One of ACCESS_MODES
+            channel (spdb.project.Channel): Channel of the volume, selecting its cv_config overrides
+
+        Returns:
+            (cvdb.chunks.ChunkReader)
+
+        Raises:
+            (CVDBError)
+        """
+        if access_mode not in self.ACCESS_MODES:
+            raise CVDBError(f"Unsupported access mode {access_mode}. Must be one of {self.ACCESS_MODES}.",
+                            ErrorCodes.CVDB_ERROR)
+
+        # Multi-channel volumes hold time samples, so their chunks are decoded (and cached) with every channel
+        channels = vol.meta.num_channels > 1
+        settings = self.config.settings(channel)
+        if access_mode == "cache":
+            # Prefetched chunks are handed over through the decoded chunk cache, so read-ahead needs one
+            use_cache = self.chunk_cache is not None and settings["chunk_cache"]
+            return ChunkReader(vol, parallel=settings["parallel"],
+                               cache=self.chunk_cache if use_cache else None,
+                               disk_cache=self.disk_cache if settings["disk_cache"] else None, channels=channels,
+                               readahead=self.readahead if use_cache else None,
+                               flights=self.single_flight,
+                               occupancy=self.occupancy if settings["occupancy"] else None,
+                               fill_missing=settings["fill_missing"])
+        if access_mode == "no_cache":
+            return ChunkReader(vol, parallel=settings["parallel"], populate=False, channels=channels,
+                               flights=self.single_flight,
+                               occupancy=self.occupancy if settings["occupancy"] else None,
+                               fill_missing=settings["fill_missing"])
+        return ChunkReader(vol, parallel=settings["parallel"], populate=False, channels=channels,
+                           fill_missing=settings["fill_missing"])
+
+    @staticmethod
+    def _read_into(reader, data, corner, extent, time_channels=((0, 0),), ids=None, aligned=False):
+        """Fetch the chunks of a region and paste them into a TZYX buffer
+
+        Decoded chunks are pasted straight into the buffer as they arrive. Chunks are XYZ ordered, so the transposed
+        view is copied exactly once and no full size intermediate array is built. Chunk aligned regions copy each
+        chunk whole into its slot and zero the slots of missing chunks, so data may be left uninitialized.
+
+        Args:
+            reader (cvdb.chunks.BaseChunkReader): Reader of the mip
+            data (numpy.ndarray): TZYX buffer holding the region
+            corner ((int, int, int)): the xyz location of the corner of the region
+            extent ((int, int, int)): the xyz extents of the region
+            time_channels (iterable(tuple(int, int))): (index into the time axis of data, channel of the volume)
+                pairs to copy out of every chunk
+            ids (numpy.ndarray): Optional sorted IDs. Only voxels holding one of them are copied
+            aligned (bool): If True, the region is made of whole chunks and ids is None, see _is_aligned()
+
+        Returns:
+            None
+        """
+        indices = reader.grid.indices(corner, extent)
+        if reader.trace is not None:
+            reader.trace.count("chunks", len(indices))
+
+        if aligned:
+            for index, chunk_data in reader.iter_read(indices):
+                chunk_start, chunk_stop = reader.grid.chunk_bounds(index)
+                with reader.timer("paste"):
+                    for t_index, channel in time_channels:
+                        fill_chunk(data, t_index, corner, chunk_start, chunk_stop, chunk_data, channel)
+            return
+
+        for index, chunk_data in reader.iter_read(indices, ids):
+            if chunk_data is None:
+                continue
+            chunk_start = reader.grid.chunk_bounds(index)[0]
+            with reader.timer("paste"):
+                for t_index, channel in time_channels:
+                    paste_chunk(data, t_index, corner, chunk_start, chunk_data, channel, ids)
+
+    @staticmethod
+    def _is_aligned(layout, corner, extent, downsample=()):
+        """Check if a region of a time layout is made of whole chunks, so cutout can skip zero filling its buffer
+
+        Args:
+            layout (list): Volumes and their time samples, from get_time_layout(). They share one chunk layout
+            corner ((int, int, int)): the xyz location of the corner of the region
+            extent ((int, int, int)): the xyz extents of the region
+            downsample (list(tuple((int, int, int), str))): Downsampling steps, see _read_time_series()
+
+        Returns:
+            (bool)
+        """
+        grid = CloudVolumeDB._read_grid(layout, downsample)
+        return grid.contains(corner, extent) and grid.is_aligned(corner, extent)
+
+    @staticmethod
+    def _read_grid(layout, downsample=()):
+        """Get the chunk layout a time layout is read through
+
+        Args:
+            layout (list): Volumes and their time samples, from get_time_layout(). They share one chunk layout
+            downsample (list(tuple((int, int, int), str))): Downsampling steps, see _read_time_series()
+
+        Returns:
+            (cvdb.chunks.ChunkGrid)
+        """
+        grid = ChunkGrid(layout[0][0])
+        for factor, _ in downsample:
+            grid = DownsampledGrid(grid, factor)
+        return grid
+
+    def _layout_readers(self, layout, access_mode, downsample=(), channel=None, trace=None):
+        """Get the readers of every volume of a time layout
+
+        Args:
+            layout (list): Volumes and their time samples, from get_time_layout()
+            access_mode (str): cache, no_cache or raw
+            downsample (list(tuple((int, int, int), str))): Downsampling steps, see _read_time_series()
+            channel (spdb.project.Channel): Channel of the volumes, selecting its cv_config overrides
+            trace (cvdb.instrument.CutoutTrace): Optional trace the readers record into
+
+        Returns:
+            (list(tuple(cvdb.chunks.BaseChunkReader, list(tuple(int, int))))): Each reader with the time samples of
+            its volume
+        """
+        readers = [(self.get_reader(vol, access_mode, channel), time_channels) for vol, time_channels in layout]
+        for reader, _ in readers:
+            reader.trace = trace
+        for step, (factor, method) in enumerate(downsample):
+            # Only the last step builds chunks concurrently, so chained steps don't multiply the thread count
+            parallel = DOWNSAMPLE_PARALLEL if step == len(downsample) - 1 else 1
+            readers = [(DownsampledReader(reader, factor, method, parallel), time_channels)
+                       for reader, time_channels in readers]
+        return readers
+
+    def _read_time_series(self, layout, access_mode, data, corner, extent, ids=None, downsample=(),
+                          client_key=None, channel=None, trace=None, aligned=False):
+        """Fetch a region of every volume of a time layout into a TZYX buffer, reading volumes concurrently
+
+        Args:
+            layout (list): Volumes and their time samples, from get_time_layout()
+            access_mode (str): cache, no_cache or raw
+            data (numpy.ndarray): TZYX buffer holding the region
+            corner ((int, int, int)): the xyz location of the corner of the region
+            extent ((int, int, int)): the xyz extents of the region
+            ids (numpy.ndarray): Optional sorted IDs. Only voxels holding one of them are copied
+            downsample (list(tuple((int, int, int), str))): xyz factor and pooling method of each step the volumes are
+                downsampled by on the fly, in order. The region is then in the coordinates of the downsampled volumes
+            client_key (hashable): Identifies the client for the read-ahead engine
+            channel (spdb.project.Channel): Channel of the volumes, selecting its cv_config overrides
+            trace (cvdb.instrument.CutoutTrace): Optional trace the readers record into
+            aligned (bool): If True, the region is made of whole chunks, see _read_into()
+
+        Returns:
+            None
+        """
+        readers = self._layout_readers(layout, access_mode, downsample, channel, trace)
+        for reader, _ in readers:
+            check_bounds(reader.grid, corner, extent)
+            if reader.readahead is not None:
+                # Queue the next region before reading this one, so the prefetch overlaps with the read
+                reader.readahead.observe(reader, client_key, corner, extent)
+
+        if len(readers) == 1:
+            reader, time_channels = readers[0]
+            self._read_into(reader, data, corner, extent, time_channels, ids, aligned)
+            return
+
+        # Each time sample is a separate layer, so fetch several at once. Every layer writes its own time index
+        with ThreadPoolExecutor(max_workers=min(self.TIME_PARALLEL, len(readers))) as pool:
+            futures = [pool.submit(self._read_into, reader, data, corner, extent, time_channels, ids, aligned)
+                       for reader, time_channels in readers]
+            for future in futures:
+                future.result()
 
     # Main READ interface method
     def cutout(
@@ -37,21 +564,31 @@ class CloudVolumeDB:
         filter_ids=None,
         iso=False,
         access_mode="cache",
+        client_key=None,
     ):
         """Extract a cube of arbitrary size. Need not be aligned to cuboid boundaries.
 
         corner represents the location of the cutout and extent the size.  As an example in 1D, if asking for
         a corner of 3 and extent of 2, this would be the values at 3 and 4.
 
+        Resolution levels missing from the volume, e.g. of channels that aren't downsampled yet, are synthesized from
+        the nearest finer level that holds data and cached. See get_read_source().
+
         Args:
             resource (spdb.project.BossResource): Data model info based on the request or target resource
             corner ((int, int, int)): the xyz location of the corner of the cutout
             extent ((int, int, int)): the xyz extents
             resolution (int): the resolution level
-            time_sample_range : ignored
-            filter_ids (optional[list]): ignored
-            iso (bool): ignored
-            access_mode (str): ignored
+            time_sample_range (list(int)): the time samples to cut out, in python convention (start inclusive, stop
+                exclusive). Defaults to time sample 0. Time samples are read concurrently, see get_time_layout()
+            filter_ids (optional[list]): only return voxels labeled with one of these IDs, the rest are zero. Only
+                supported for annotation channels. Chunks holding none of the IDs are skipped
+            iso (bool): Flag indicating if you want the "isotropic" version of an anisotropic channel. Read from the
+                isotropic scale of the volume if it has one, otherwise downsampled in z on the fly (and cached)
+            access_mode (str): cache reads through the in-memory and disk chunk caches, no_cache reads from storage
+                without consulting or populating the caches, raw also ignores the occupancy tracker. See get_reader()
+            client_key (hashable): Identifies the client (e.g. a session or viewer) so the read-ahead engine can
+                follow its access pattern separately from other clients of the channel
 
         Returns:
             cube.Cube: The cutout data stored in a Cube instance
@@ -59,43 +596,331 @@ class CloudVolumeDB:
         Raises:
             (CVDBError)
         """
+        start = time.perf_counter()
         channel = resource.get_channel()
-        out_cube = Cube.create_cube(resource, extent)
+        out_cube = Cube.create_cube(resource, extent, list(time_sample_range) if time_sample_range else None)
+        trace = None
+        if self.hooks:
+            trace = CutoutTrace(channel=channel.cv_path, resolution=resolution, corner=tuple(corner),
+                                extent=tuple(extent), time_range=tuple(out_cube.time_range), iso=iso,
+                                access_mode=access_mode, ok=False)
 
-        # NOTE: Refer to Tim's changes for channel method to check storage type.
-        if channel.storage_type != "cloudvol":
-            raise CVDBError(
-                f"Storage type {channel.storage_type} not configured for cloudvolume.",
-                701,
-            )
+        ids = None
+        if filter_ids is not None:
+            if not isinstance(out_cube, AnnotateCube64):
+                raise CVDBError("filter_ids is only supported for annotation channels.",
+                                ErrorCodes.DATATYPE_NOT_SUPPORTED)
+            ids = AnnotateCube64.id_array(filter_ids)
 
-        # NOTE: Refer to Tim's changes for S3 bucket and path.
         try:
-            # Accessing HTTPS version of dataset. This is READ-ONLY and PUBLIC-ONLY, but much faster to download.
-            vol = CloudVolume(
-                f"s3://{channel.bucket}/{channel.cv_path}",
-                mip=resolution,
-                use_https=True,
-                fill_missing=True,
-            )
+            with timed(trace, "info"):
+                mip, downsample = self.get_read_source(resource, resolution, iso)
+                layout = self.get_time_layout(channel, mip, range(*out_cube.time_range))
 
-            # Data is downloaded by providing XYZ indicies.
-            data = vol[
-                corner[0] : corner[0] + extent[0],
-                corner[1] : corner[1] + extent[1],
-                corner[2] : corner[2] + extent[2],
-            ]
+            # Chunk aligned regions are written whole, chunk by chunk, so their buffer is not zero filled first
+            aligned = ids is None and self._is_aligned(layout, corner, extent, downsample)
+            with timed(trace, "allocate"):
+                data = out_cube.allocate(zero=not aligned)
+            self._read_time_series(layout, access_mode, data, corner, extent, ids, downsample, client_key,
+                                   channel, trace, aligned)
 
-            # Data returned as cloudvolume VolumeCutout object in XYZT order.
-            # Here we recast it to numpy array and transpose it to TZYX order.
-            data = np.array(data.T)
+            if trace is not None:
+                trace.labels["ok"] = True
 
+        except CVDBError:
+            raise
         except Exception as e:
             raise CVDBError(f"Error downloading cloudvolume data: {e}")
+        finally:
+            if trace is not None:
+                trace.add("total", time.perf_counter() - start)
+                self.emit(trace)
 
         out_cube.set_data(data)
         return out_cube
 
+    def cutout_compressed(
+        self,
+        resource,
+        corner,
+        extent,
+        resolution,
+        time_sample_range=None,
+        filter_ids=None,
+        iso=False,
+        access_mode="cache",
+        client_key=None,
+    ):
+        """Extract a cube of arbitrary size as the blosc payload Cube.to_blosc() would return for cutout()
+
+        The region is read one chunk deep z slab at a time, and the z planes of each slab are compressed on a thread
+        pool while the next slab is read, so the full region is never held decompressed. The blocks are stitched
+        into a single blosc buffer, see cvdb.payload.BloscPayload. Compression follows the settings of the channel's
+        Cube class, see Cube.set_compression(). Regions whose z planes are too small to compress on their own are cut
+        out and compressed whole. Planes are only compressed in parallel if blosc releases the GIL, see
+        cvdb.config.configure_blosc().
+
+        Args:
+            resource (spdb.project.BossResource): Data model info based on the request or target resource
+            corner ((int, int, int)): the xyz location of the corner of the cutout
+            extent ((int, int, int)): the xyz extents
+            resolution (int): the resolution level
+            time_sample_range (list(int)): the time samples to cut out, in python convention. See cutout()
+            filter_ids (optional[list]): only return voxels labeled with one of these IDs. See cutout()
+            iso (bool): Flag indicating if you want the "isotropic" version of an anisotropic channel. See cutout()
+            access_mode (str): cache, no_cache or raw. See cutout()
+            client_key (hashable): Identifies the client for the read-ahead engine. See cutout()
+
+        Returns:
+            (bytes): blosc compressed TZYX data. Decompresses with Cube.from_blosc() like the output of to_blosc()
+
+        Raises:
+            (CVDBError)
+        """
+        channel = resource.get_channel()
+        out_cube = Cube.create_cube(resource, extent, list(time_sample_range) if time_sample_range else None)
+        dtype = np.dtype(resource.get_data_type())
+        shape = (out_cube.time_range[1] - out_cube.time_range[0], extent[2], extent[1], extent[0])
+        settings = dict(out_cube.compression)
+        threads = settings.pop("threads")
+        if not BloscPayload.supported(shape, dtype, **settings):
+            return self.cutout(resource, corner, extent, resolution, time_sample_range, filter_ids, iso, access_mode,
+                               client_key).to_blosc()
+
+        ids = None
+        if filter_ids is not None:
+            if not isinstance(out_cube, AnnotateCube64):
+                raise CVDBError("filter_ids is only supported for annotation channels.",
+                                ErrorCodes.DATATYPE_NOT_SUPPORTED)
+            ids = AnnotateCube64.id_array(filter_ids)
+
+        payload = BloscPayload(shape, dtype, **settings)
+        try:
+            mip, downsample = self.get_read_source(resource, resolution, iso)
+            layout = self.get_time_layout(channel, mip, range(*out_cube.time_range))
+            grid = self._read_grid(layout, downsample)
+            check_bounds(grid, corner, extent)
+
+            with ThreadPoolExecutor(max_workers=threads, thread_name_prefix="cvdb-compress") as pool:
+                pending = []
+                for slab_corner, slab_extent in grid.slabs(corner, extent):
+                    aligned = ids is None and self._is_aligned(layout, slab_corner, slab_extent, downsample)
+                    slab_shape = (shape[0], slab_extent[2], shape[2], shape[3])
+                    slab = np.empty(slab_shape, dtype=dtype) if aligned else np.zeros(slab_shape, dtype=dtype)
+                    self._read_time_series(layout, access_mode, slab, slab_corner, slab_extent, ids, downsample,
+                                           client_key, channel, aligned=aligned)
+
+                    # Only the previous slab may still be compressing, so at most two slabs are held at once
+                    for future in pending:
+                        future.result()
+                    z_offset = slab_corner[2] - corner[2]
+                    pending = [pool.submit(payload.add_plane, t, z_offset + z, slab[t, z])
+                               for t in range(shape[0]) for z in range(slab_extent[2])]
+                for future in pending:
+                    future.result()
+
+            return payload.getvalue()
+
+        except CVDBError:
+            raise
+        except Exception as e:
+            raise CVDBError(f"Error downloading cloudvolume data: {e}")
+
+    def emit(self, trace):
+        """Hand a finished trace to every hook. A failing hook is logged and never fails the cutout
+
+        Args:
+            trace (cvdb.instrument.CutoutTrace): The trace of a cutout
+
+        Returns:
+            None
+        """
+        for hook in self.hooks:
+            try:
+                hook(trace)
+            except Exception as e:
+                logger("CloudVolumeDB").warning("Cutout hook {} failed: {}".format(hook, e))
+
+    def iter_cutout(self, resource, corner, extent, resolution, slab_depth=None, access_mode="cache"):
+        """Extract a cube of arbitrary size as a sequence of z slabs, for regions too large to hold in memory.
+
+        Slab boundaries fall on the chunk grid, so every chunk is downloaded for exactly one slab. The next slab is
+        fetched in the background while the caller processes the current one, so at most two slabs (plus the
+        chunks in flight) are held at once regardless of the size of the region.
+
+        Args:
+            resource (spdb.project.BossResource): Data model info based on the request or target resource
+            corner ((int, int, int)): the xyz location of the corner of the cutout
+            extent ((int, int, int)): the xyz extents
+            resolution (int): the resolution level
+            slab_depth (int): Slab depth in voxels, rounded up to a multiple of the chunk depth. Defaults to one
+                chunk. The first and last slabs are shorter if the region is not aligned
+            access_mode (str): cache, no_cache or raw. See cutout()
+
+        Yields:
+            cube.Cube: One cube per slab, in increasing z. Slab i starts at the sum of the z_dim of earlier slabs
+
+        Raises:
+            (CVDBError)
+        """
+        channel = resource.get_channel()
+        vol = self.get_volume(channel, resolution)
+        reader = self.get_reader(vol, access_mode, channel)
+        check_bounds(reader.grid, corner, extent)
+
+        def read_slab(slab_corner, slab_extent):
+            cube = Cube.create_cube(resource, slab_extent)
+            data = cube.allocate()
+            self._read_into(reader, data, slab_corner, slab_extent)
+            cube.set_data(data)
+            return cube
+
+        slabs = reader.grid.slabs(corner, extent, slab_depth)
+        if not slabs:
+            return
+
+        with ThreadPoolExecutor(max_workers=1, thread_name_prefix="cvdb-slab") as prefetcher:
+            future = prefetcher.submit(read_slab, *slabs[0])
+            try:
+                for next_slab in slabs[1:] + [None]:
+                    try:
+                        cube = future.result()
+                    except CVDBError:
+                        raise
+                    except Exception as e:
+                        raise CVDBError(f"Error downloading cloudvolume data: {e}")
+
+                    future = prefetcher.submit(read_slab, *next_slab) if next_slab else None
+                    yield cube
+                    del cube
+            finally:
+                if future is not None:
+                    future.cancel()
+
+    async def cutout_async(
+        self,
+        resource,
+        corner,
+        extent,
+        resolution,
+        time_sample_range=None,
+        filter_ids=None,
+        iso=False,
+        access_mode="cache",
+    ):
+        """Asyncio version of cutout() for event loop servers.
+
+        Chunk downloads are awaited concurrently, up to the async pool's per-channel limit, and decoded on its
+        bounded decode pool, so the calling thread is never blocked and many requests share a few threads. Chunks of
+        levels downsampled on the fly, see get_read_source(), are built whole on the I/O pool.
+
+        Args:
+            resource (spdb.project.BossResource): Data model info based on the request or target resource
+            corner ((int, int, int)): the xyz location of the corner of the cutout
+            extent ((int, int, int)): the xyz extents
+            resolution (int): the resolution level
+            time_sample_range (list(int)): the time samples to cut out, in python convention. See cutout()
+            filter_ids (optional[list]): only return voxels labeled with one of these IDs. See cutout()
+            iso (bool): Flag indicating if you want the "isotropic" version of an anisotropic channel. See cutout()
+            access_mode (str): cache, no_cache or raw. See cutout()
+
+        Returns:
+            cube.Cube: The cutout data stored in a Cube instance
+
+        Raises:
+            (CVDBError)
+        """
+        channel = resource.get_channel()
+        out_cube = Cube.create_cube(resource, extent, list(time_sample_range) if time_sample_range else None)
+
+        ids = None
+        if filter_ids is not None:
+            if not isinstance(out_cube, AnnotateCube64):
+                raise CVDBError("filter_ids is only supported for annotation channels.",
+                                ErrorCodes.DATATYPE_NOT_SUPPORTED)
+            ids = AnnotateCube64.id_array(filter_ids)
+
+        try:
+            # Finding the source opens handles, which may fetch info files, so keep it off the event loop
+            mip, downsample = await self.async_pool.run_io(self.get_read_source, resource, resolution, iso)
+            layout = await self.async_pool.run_io(self.get_time_layout, channel, mip,
+                                                  range(*out_cube.time_range))
+
+            data = out_cube.allocate()
+            readers = self._layout_readers(layout, access_mode, downsample, channel)
+            for reader, _ in readers:
+                check_bounds(reader.grid, corner, extent)
+
+            # Each time sample is a separate layer, so fetch them all at once
+            tasks = [asyncio.ensure_future(self.async_pool.read_into(
+                reader, (channel.bucket, channel.cv_path), reader.grid.indices(corner, extent), data, corner,
+                time_channels, ids)) for reader, time_channels in readers]
+            try:
+                await asyncio.gather(*tasks)
+            finally:
+                for task in tasks:
+                    task.cancel()
+
+        except CVDBError:
+            raise
+        except Exception as e:
+            raise CVDBError(f"Error downloading cloudvolume data: {e}")
+
+        out_cube.set_data(data)
+        return out_cube
+
+    def cutout_many(self, resource, regions, resolution, access_mode="cache"):
+        """Extract several cubes from the same channel and resolution, downloading each chunk only once.
+
+        The union of chunks touched by all regions is fetched concurrently and every region is sliced out of the
+        shared decoded chunks. Use this instead of repeated calls to cutout() when regions overlap or are adjacent.
+
+        Args:
+            resource (spdb.project.BossResource): Data model info based on the request or target resource
+            regions (list((corner, extent))): xyz corner and xyz extent of each region
+            resolution (int): the resolution level
+            access_mode (str): cache, no_cache or raw. See cutout()
+
+        Returns:
+            (list(cube.Cube)): The cutouts, in the same order as regions
+
+        Raises:
+            (CVDBError)
+        """
+        channel = resource.get_channel()
+        vol = self.get_volume(channel, resolution)
+        reader = self.get_reader(vol, access_mode, channel)
+
+        try:
+            for corner, extent in regions:
+                check_bounds(reader.grid, corner, extent)
+
+            # Map every chunk to the regions it overlaps so each decoded chunk is pasted into all of them and
+            # released, rather than holding the whole union in memory
+            chunk_regions = {}
+            for region_idx, (corner, extent) in enumerate(regions):
+                for index in reader.grid.indices(corner, extent):
+                    chunk_regions.setdefault(index, []).append(region_idx)
+
+            cubes = [Cube.create_cube(resource, extent) for _, extent in regions]
+            buffers = [cube.allocate() for cube in cubes]
+            for index, chunk_data in reader.iter_read(chunk_regions):
+                if chunk_data is None:
+                    continue
+                chunk_start = reader.grid.chunk_bounds(index)[0]
+                for region_idx in chunk_regions[index]:
+                    paste_chunk(buffers[region_idx], 0, regions[region_idx][0], chunk_start, chunk_data)
+
+        except CVDBError:
+            raise
+        except Exception as e:
+            raise CVDBError(f"Error downloading cloudvolume data: {e}")
+
+        for cube, data in zip(cubes, buffers):
+            cube.set_data(data)
+
+        return cubes
+
     # Main WRITE interface method
     def write_cuboid(
         self,
@@ -106,12 +931,17 @@ class CloudVolumeDB:
         time_sample_start=0,
         iso=False,
         to_black=False,
+        propagate=False,
     ):
         """ Write a 3D/4D volume to the key-value store. Used by API/cache in consistent mode as it reconciles writes
 
         If cuboid_data.ndim == 4, data in time-series format - assume t,z,y,x
         If cuboid_data.ndim == 3, data not in time-series format - assume z,y,x
 
+        Chunks covered by the cuboid are encoded and uploaded in parallel without reading storage. Only the chunks
+        on unaligned edges are read, patched and written back. Time samples are stored as described in
+        get_time_layout(). Writing a subset of a volume's channels or blacking out reads back every chunk touched.
+
         Args:
             resource (project.BossResource): Data model info based on the request or target resource
             corner ((int, int, int)): the xyz locatiotn of the corner of the cuout
@@ -120,9 +950,53 @@ class CloudVolumeDB:
             time_sample_start (int): if cuboid_data.ndim == 3, the time sample for the data
                                      if cuboid_data.ndim == 4, the time sample for cuboid_data[0, :, :, :]
             iso (bool): Flag indicating if you want to write to the "isotropic" version of a channel, if available
-            to_black (bool): Flag indicating is this cuboid is a cutout_to_black cuboid. 
+            to_black (bool): Flag indicating is this cuboid is a cutout_to_black cuboid. cuboid_data is then a mask
+                             and voxels where it is 1 are set to zero
+            propagate (bool): If True, rebuild the chunks of the coarser resolutions covering the written chunks.
+                              Use a cvdb.propagate.Propagator instead to batch the rebuild of several writes
 
         Returns:
             None
+
+        Raises:
+            (CVDBError)
         """
-        raise NotImplementedError
+        if cuboid_data.ndim == 3:
+            cuboid_data = cuboid_data[np.newaxis, :, :, :]
+        elif cuboid_data.ndim != 4:
+            raise CVDBError(f"Can only write 3D or 4D cuboids, got {cuboid_data.ndim} dimensions.",
+                            ErrorCodes.CVDB_ERROR)
+
+        channel = resource.get_channel()
+        mip = self.get_mip(resource, resolution, iso)
+        time_samples = range(time_sample_start, time_sample_start + cuboid_data.shape[0])
+        propagator = Propagator(self) if propagate else None
+
+        # TZYX transposes to an XYZT view, so whole chunks are encoded without an intermediate copy
+        data = cuboid_data.T
+
+        try:
+            for vol, time_channels in self.get_time_layout(channel, mip, time_samples, writable=True):
+                writer = ChunkWriter(vol, parallel=self.config.settings(channel)["parallel"])
+                if cuboid_data.dtype != writer.grid.dtype:
+                    raise CVDBError(f"Cuboid datatype {cuboid_data.dtype} does not match volume datatype "
+                                    f"{writer.grid.dtype}.", ErrorCodes.DATATYPE_MISMATCH)
+
+                # The time samples held by a volume are consecutive, on consecutive channels
+                t_start, channel_start = time_channels[0]
+                t_stop = time_channels[-1][0] + 1
+                written = writer.write(corner, data[:, :, :, t_start:t_stop], channel_start=channel_start,
+                                       to_black=to_black)
+
+                layer_time_sample = 0 if writer.grid.num_channels > 1 else time_samples[t_start]
+                self.record_written(channel, mip, written, layer_time_sample)
+                if propagator is not None:
+                    propagator.mark(resource, mip, written, layer_time_sample)
+
+            if propagator is not None:
+                propagator.flush()
+
+        except CVDBError:
+            raise
+        except Exception as e:
+            raise CVDBError(f"Error uploading cloudvolume data: {e}")
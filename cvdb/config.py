@@ -0,0 +1,234 @@
+# Copyright 2021 The Johns Hopkins University Applied Physics Laboratory
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import threading
+
+import blosc
+from cloudfiles.interfaces import HttpInterface
+from requests.adapters import HTTPAdapter
+
+from .chunks import DEFAULT_PARALLEL
+from .error import CVDBError, ErrorCodes
+
+"""
+.. module:: config
+    :synopsis: Backend I/O settings parsed from cv_config, with per-channel overrides.
+"""
+
+# Settings that can be given at the top level of cv_config and overridden per channel
+CHANNEL_DEFAULTS = {
+    # Storage scheme substituted into path_template, e.g. s3, gs or file for local stand-ins
+    "protocol": "s3",
+    # Location of a channel's volume. {protocol}, {bucket} and {cv_path} are substituted
+    "path_template": "{protocol}://{bucket}/{cv_path}",
+    # Location of time sample t > 0 of a single channel volume, e.g. "{cv_path}_t{time_sample}". {cv_path} and
+    # {time_sample} are substituted and the result goes into path_template. Time sample 0 is the channel's own volume.
+    # None keeps time series on the channel axis of the volume only
+    "time_layer_template": None,
+    # Read through the public, read-only HTTPS endpoint of s3:// and gs:// volumes. Writes never use it
+    "use_https": True,
+    # Read missing chunks as zeros instead of failing
+    "fill_missing": True,
+    # Number of chunks downloaded (or uploaded) concurrently per volume
+    "parallel": DEFAULT_PARALLEL,
+    # Let cloudvolume and cloud-files use gevent green threads. Requires gevent monkey patching by the caller
+    "green_threads": False,
+    # Use the decoded chunk cache in access_mode "cache"
+    "chunk_cache": True,
+    # Use the disk cache, if the CloudVolumeDB has one, in access_mode "cache"
+    "disk_cache": True,
+    # Use the occupancy index or negative cache, if the CloudVolumeDB has one, in access_mode "cache"
+    "occupancy": True,
+    # Byte budget of cloudvolume's own LRU, used by sharded reads that go through cloudvolume
+    "lru_bytes": 0,
+}
+
+# Global settings currently installed on cloud-files' HTTP interface
+_http_settings = (None, None)
+_http_lock = threading.Lock()
+
+
+class TimeoutHTTPAdapter(HTTPAdapter):
+    """HTTP adapter that applies a default timeout to requests made without one
+
+    Args:
+        timeout (float|tuple(float, float)|None): Default timeout in seconds
+        **kwargs: Passed to requests.adapters.HTTPAdapter
+    """
+    def __init__(self, timeout=None, **kwargs):
+        self.timeout = timeout
+        super().__init__(**kwargs)
+
+    def send(self, request, **kwargs):
+        if kwargs.get("timeout") is None:
+            kwargs["timeout"] = self.timeout
+        return super().send(request, **kwargs)
+
+
+def configure_http(max_connections=None, timeout=None):
+    """Install the connection pool size and timeout used by cloud-files' HTTP(S) transfers.
+
+    This is an explicit, process wide setup call, made once at startup. cloud-files mounts one adapter on every HTTP
+    session it creates, so the settings apply to every cloud-files user in the process, not only to cvdb. They only
+    cover HTTP(S) transfers, i.e. reads through the HTTPS endpoints of use_https and https:// volumes. s3:// and gs://
+    transfers go through the boto3 and google-cloud-storage clients, and file:// through the local file system, which
+    these settings don't reach. The adapter is only replaced when the settings change, keeping open connections.
+
+    Args:
+        max_connections (int|None): Connections kept open per host. None keeps the requests default
+        timeout (float|tuple(float, float)|list(float)|None): Default request timeout in seconds, either a number or a
+            (connect, read) pair. None waits forever
+
+    Returns:
+        None
+    """
+    global _http_settings
+    if isinstance(timeout, list):
+        timeout = tuple(timeout)
+    settings = (max_connections, timeout)
+    with _http_lock:
+        if settings == _http_settings:
+            return
+        pool = {} if max_connections is None else {"pool_connections": max_connections,
+                                                   "pool_maxsize": max_connections}
+        HttpInterface.adaptor = TimeoutHTTPAdapter(timeout=timeout, **pool)
+        _http_settings = settings
+
+
+def configure_blosc(release_gil=True):
+    """Let blosc compress and decompress without holding the GIL.
+
+    This is an explicit, process wide setup call, made once at startup, and applies to every python-blosc user in the
+    process. Without it, the threads CloudVolumeDB.cutout_compressed() compresses z planes on and the threads
+    Cube.from_blosc() decodes time samples on run one at a time. Cube.to_blosc() compresses on blosc's own threads
+    and doesn't need it.
+
+    Args:
+        release_gil (bool): Release the GIL while blosc runs
+
+    Returns:
+        None
+    """
+    blosc.set_releasegil(release_gil)
+
+
+class BackendConfig:
+    """Backend I/O settings parsed from a CloudVolumeDB cv_config dict.
+
+    Top level keys are the settings of CHANNEL_DEFAULTS. The optional "channels" key maps a
+    channel's cv_path, or "bucket/cv_path" to tell apart channels of different buckets, to a dict overriding some
+    of the CHANNEL_DEFAULTS settings for that channel:
+
+        {
+            "protocol": "s3",
+            "parallel": 32,
+            "channels": {
+                "col1/exp1/em": {"parallel": 64},
+                "local-bucket/col1/exp1/chan1": {"protocol": "file", "chunk_cache": False},
+            },
+        }
+
+    HTTP connection pool size and timeouts are process wide, so they are not part of cv_config. See configure_http().
+
+    Args:
+        cv_config (dict): Backend configuration. None uses the defaults
+
+    Raises:
+        (CVDBError): If a key is unknown
+    """
+    def __init__(self, cv_config=None):
+        cv_config = dict(cv_config or {})
+        overrides = cv_config.pop("channels", None) or {}
+
+        self.check(cv_config, set(CHANNEL_DEFAULTS), "cv_config")
+        self.defaults = {key: cv_config.get(key, value) for key, value in CHANNEL_DEFAULTS.items()}
+
+        self.overrides = {}
+        for name, override in overrides.items():
+            self.check(override, set(CHANNEL_DEFAULTS), f"cv_config channel {name}")
+            self.overrides[name] = dict(override)
+
+        for settings in [self.defaults] + list(self.overrides.values()):
+            parallel = settings.get("parallel", 1)
+            if not isinstance(parallel, int) or parallel < 1:
+                raise CVDBError(f"cv_config parallel must be a positive integer, got {parallel}.",
+                                ErrorCodes.CVDB_ERROR)
+            template = settings.get("time_layer_template")
+            if template is not None and "{time_sample}" not in template:
+                raise CVDBError(f"cv_config time_layer_template must contain {{time_sample}}, got {template}.",
+                                ErrorCodes.CVDB_ERROR)
+
+    @staticmethod
+    def check(config, allowed, where):
+        """Reject unknown settings
+
+        Args:
+            config (dict): Settings to check
+            allowed (set(str)): Known setting names
+            where (str): Location of the settings, for the error message
+
+        Returns:
+            None
+
+        Raises:
+            (CVDBError)
+        """
+        unknown = set(config) - allowed
+        if unknown:
+            raise CVDBError(f"Unsupported {where} settings {sorted(unknown)}. Must be among {sorted(allowed)}.",
+                            ErrorCodes.CVDB_ERROR)
+
+    def settings(self, channel=None):
+        """Get the settings of a channel
+
+        Args:
+            channel (spdb.project.Channel): Channel being accessed. None gets the top level settings
+
+        Returns:
+            (dict): Every CHANNEL_DEFAULTS setting
+        """
+        if channel is None or not self.overrides:
+            return self.defaults
+
+        settings = dict(self.defaults)
+        settings.update(self.overrides.get(channel.cv_path, {}))
+        settings.update(self.overrides.get(f"{channel.bucket}/{channel.cv_path}", {}))
+        return settings
+
+    def volume_options(self, channel, writable=False):
+        """Get the options of a channel's CloudVolume handles, as passed to a VolumeHandleCache
+
+        The path template goes in with the options so the handle factory can locate the volume, see
+        cvdb.handlecache.open_volume.
+
+        Args:
+            channel (spdb.project.Channel): Channel being accessed
+            writable (bool): If True, get options for a handle on the authenticated endpoint
+
+        Returns:
+            (dict)
+        """
+        settings = self.settings(channel)
+        options = {
+            "fill_missing": settings["fill_missing"],
+            "path_template": settings["path_template"].format(protocol=settings["protocol"], bucket="{bucket}",
+                                                              cv_path="{cv_path}"),
+        }
+        if settings["use_https"] and not writable:
+            options["use_https"] = True
+        if settings["green_threads"]:
+            options["green_threads"] = True
+        if settings["lru_bytes"]:
+            options["lru_bytes"] = settings["lru_bytes"]
+        return options
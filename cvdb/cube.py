@@ -11,6 +11,10 @@
 # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 # See the License for the specific language governing permissions and
 # limitations under the License.
+import os
+import struct
+from concurrent.futures import ThreadPoolExecutor
+
 import numpy as np
 import blosc
 from PIL import Image
@@ -18,7 +22,9 @@ from PIL import Image
 from abc import ABCMeta, abstractmethod
 import blosc
 
+from .downsample import downsample
 from .error import CVDBError, ErrorCodes
+from .morton import morton_xyz
 
 """
 .. module:: Cube
@@ -44,9 +50,18 @@ class Cube(metaclass=ABCMeta):
       z_dim (int): The Z dimension of the data matrix
       y_dim (int): The Y dimension of the data matrix
       x_dim (int): The X dimension of the data matrix
-      data (numpy.ndarray): The 3D matrix of data as a numpy array in [t, z, y, x]
+      data (numpy.ndarray): The 3D matrix of data as a numpy array in [t, z, y, x]. Allocated as zeros on first
+      access if it has not been set, so cubes that are immediately filled never pay for a throwaway buffer
       _created_from_zeros (bool): Flag indicates if the data was generated by this instance or pre-existing
     """
+    # Pooling used by zoom_out(), see cvdb.downsample
+    pooling = "mean"
+
+    # blosc settings of pack_array(): codec, compression level, shuffle filter and number of threads compressing
+    # large arrays (and decoding time samples in from_blosc()). Subclasses pick settings suited to their data, change
+    # them with set_compression()
+    compression = {"cname": "blosclz", "clevel": 9, "shuffle": blosc.SHUFFLE, "threads": 4}
+
     def __init__(self, cube_size, time_range=None):
         # cube_size is represented in x,y,z but data is stored c-ordered internally as z,y,x
         # cube_size is in z,y,x for interactions with tile/image data
@@ -68,6 +83,37 @@ class Cube(metaclass=ABCMeta):
             self.is_time_series = False
             self.time_range = [0, 1]
 
+    @property
+    def data(self):
+        if self._data is None and self.datatype is not None:
+            self._data = self.allocate()
+        return self._data
+
+    @data.setter
+    def data(self, data):
+        self._data = data
+
+    def get_shape(self):
+        """Shape of the data matrix in [t, z, y, x]
+
+        Returns:
+            list(int)
+        """
+        return [self.time_range[1] - self.time_range[0]] + self.cube_size
+
+    def allocate(self, zero=True):
+        """Allocate a data matrix of the cube's shape and datatype without assigning it
+
+        Args:
+            zero (bool): If False, leave the matrix uninitialized. Only for callers that write every voxel
+
+        Returns:
+            (np.ndarray)
+        """
+        if not zero:
+            return np.empty(self.get_shape(), dtype=self.datatype, order='C')
+        return np.zeros(self.get_shape(), dtype=self.datatype, order='C')
+
     def set_data(self, data):
         """Method to set the cube data matrix
 
@@ -87,11 +133,13 @@ class Cube(metaclass=ABCMeta):
 
         Args:
             input_cube (CVDB.cube.Cube): Input Cube instance from which to merge data
-            index: relative morton ID indicating where to insert the data
+            index: relative morton ID, or xyz index in units of input_cube, indicating where to insert the data
 
         Returns:
             None
         """
+        if np.ndim(index) == 0:
+            index = morton_xyz(index)
         x_offset = index[0] * input_cube.x_dim
         y_offset = index[1] * input_cube.y_dim
         z_offset = index[2] * input_cube.z_dim
@@ -101,6 +149,50 @@ class Cube(metaclass=ABCMeta):
                             y_offset:y_offset + input_cube.y_dim,
                             x_offset:x_offset + input_cube.x_dim], input_cube.data[:, :, :, :])
 
+    def assemble(self, cuboids, indices):
+        """Add data to a larger cube (this instance) from many cuboids of the same size in a single copy
+
+        The cube is viewed as a grid of cuboid sized blocks and every cuboid is copied to its block at once, so
+        assembling hundreds of cuboids costs no more Python work than one.
+
+        Args:
+            cuboids (list(CVDB.cube.Cube)|np.ndarray): The cuboids, or their data stacked in [n, t, z, y, x]. Each
+                holds every time sample of this instance
+            indices (array-like): Position of each cuboid, as n relative morton IDs or an (n, 3) array of xyz indices
+                in units of the cuboid size, see add_data()
+
+        Returns:
+            None
+
+        Raises:
+            (CVDBError): If the cuboids don't tile the cube or an index is outside of it
+        """
+        indices = np.asarray(indices)
+        if indices.ndim == 1:
+            indices = morton_xyz(indices)
+        if len(indices) == 0:
+            return
+        stack = cuboids if isinstance(cuboids, np.ndarray) else np.stack([cuboid.data for cuboid in cuboids])
+
+        shape = self.get_shape()
+        num_cuboids, num_times, z_size, y_size, x_size = stack.shape
+        grid = np.array([shape[3] // x_size, shape[2] // y_size, shape[1] // z_size])
+        if (num_cuboids != len(indices) or num_times != shape[0] or shape[1] % z_size or shape[2] % y_size or
+                shape[3] % x_size or indices.min() < 0 or (indices.max(axis=0) >= grid).any()):
+            raise CVDBError("Can't assemble {} cuboids of shape {} into a cube of shape {}.".format(
+                num_cuboids, list(stack.shape[1:]), shape), ErrorCodes.DATATYPE_MISMATCH)
+
+        if self._data is None:
+            # Cuboids covering every block leave nothing to zero
+            covered = len(np.unique(indices, axis=0)) == np.prod(grid)
+            self.data = self.allocate(zero=not covered)
+        if not self.data.flags.c_contiguous:
+            self.data = np.ascontiguousarray(self.data)
+
+        blocks = self.data.reshape(shape[0], grid[2], z_size, grid[1], y_size, grid[0], x_size)
+        indices = indices.astype(np.intp)
+        blocks[:, indices[:, 2], :, indices[:, 1], :, indices[:, 0], :] = stack
+
     def trim(self, x_offset, x_size, y_offset, y_size, z_offset, z_size):
         """Trim off excess data if not cuboid aligned. Applies to ALL time samples.
 
@@ -120,10 +212,42 @@ class Cube(metaclass=ABCMeta):
         # update the cube dimensions, ignoring the time component since it does not change
         self.z_dim, self.y_dim, self.x_dim = self.cube_size = list(self.data.shape[1:])
 
+    def zoom_out(self, factor=(2, 2, 1)):
+        """Downsample the cube in place by an integer factor, the way coarser resolutions are built. Applies to ALL
+        time samples.
+
+        Args:
+            factor ((int, int, int)): Pooling factor in xyz, e.g. (2, 2, 1) for an anisotropic resolution step
+
+        Returns:
+            None
+        """
+        self.data = downsample(self.data, factor, self.pooling)
+        self.z_dim, self.y_dim, self.x_dim = self.cube_size = list(self.data.shape[1:])
+
+    def zoom_in(self, factor=(2, 2, 1)):
+        """Upsample the cube in place by an integer factor, repeating each voxel. Applies to ALL time samples.
+
+        Args:
+            factor ((int, int, int)): Upsampling factor in xyz
+
+        Returns:
+            None
+        """
+        data = self.data
+        for axis, f in zip((3, 2, 1), factor):
+            if f > 1:
+                data = np.repeat(data, f, axis=axis)
+        self.data = data
+        self.z_dim, self.y_dim, self.x_dim = self.cube_size = list(self.data.shape[1:])
+
     def pack_array(self, data):
         """Method to serialize and compress data using the blosc compressor.
           Assumes the datatype of the passed in array if the datatype property is not set
 
+        Uses the class's compression settings. The array is compressed by blosc's own thread pool, whose size is
+        process wide in blosc, so it is set to the class's number of threads before each call
+
         Args:
             data (np.ndarray): The array to pack
 
@@ -133,7 +257,36 @@ class Cube(metaclass=ABCMeta):
         if not self.datatype:
             self.datatype = data.dtype
 
-        return blosc.compress(data, typesize=(np.dtype(self.datatype).itemsize * 8))
+        settings = dict(self.compression)
+        threads = min(settings.pop("threads"), os.cpu_count() or 1)
+        data = np.ascontiguousarray(data, dtype=self.datatype)
+        blosc.set_nthreads(threads)
+        return blosc.compress_ptr(data.__array_interface__["data"][0], data.size, typesize=data.itemsize, **settings)
+
+    @classmethod
+    def set_compression(cls, **settings):
+        """Change the blosc settings of pack_array() for a Cube class and its subclasses that don't override them
+
+        Args:
+            **settings: Any of cname (a codec in blosc.cnames), clevel (0-9), shuffle (blosc.NOSHUFFLE,
+                blosc.SHUFFLE or blosc.BITSHUFFLE) and threads (at least 1)
+
+        Returns:
+            None
+
+        Raises:
+            (CVDBError): If a setting is unknown or invalid
+        """
+        unknown = set(settings) - set(cls.compression)
+        if unknown:
+            raise CVDBError("Unknown compression settings: {}".format(sorted(unknown)),
+                            ErrorCodes.SERIALIZATION_ERROR)
+        compression = dict(cls.compression, **settings)
+        if (compression["cname"] not in blosc.cnames or not 0 <= compression["clevel"] <= 9 or
+                compression["shuffle"] not in (blosc.NOSHUFFLE, blosc.SHUFFLE, blosc.BITSHUFFLE) or
+                compression["threads"] < 1):
+            raise CVDBError("Invalid compression settings: {}".format(compression), ErrorCodes.SERIALIZATION_ERROR)
+        cls.compression = compression
 
     def to_blosc(self):
         """A method that packs data in this Cube instance using blosc compressor for all
@@ -175,34 +328,52 @@ class Cube(metaclass=ABCMeta):
             raise CVDBError("Failed to compress cube. {}".format(e),
                             ErrorCodes.SERIALIZATION_ERROR)
 
-    def unpack_array(self, data, num_time_points=1):
+    def unpack_array(self, data, num_time_points=1, out=None):
         """Method to uncompress and deserialize the provided data.
 
-        If only a single time point provided,
+        The data is decompressed straight into the returned array, without an intermediate bytes object.
 
         Args:
-            data (bytes): The array to pack
+            data (bytes): The array to unpack, any bytes-like object
             num_time_points (int): Number of time samples in the compressed data
+            out (np.ndarray): Optional C contiguous TZYX array of the cube's datatype to decompress into, e.g. a slice
+                of self.data. Allocated uninitialized if not given
 
         Returns:
-            (np.ndarray): The resulting serialized and compressed byte array
+            (np.ndarray): The resulting uncompressed and deserialized array, out if it was given
+
+        Raises:
+            (CVDBError): If the datatype is unset, out is unusable or the data doesn't hold an array of the shape
         """
         if not self.datatype:
             raise CVDBError("Cube instance must have datatype parameter set to enable deserialization.",
                             ErrorCodes.SERIALIZATION_ERROR)
 
-        raw_data = blosc.decompress(data)
-        data_mat = np.fromstring(raw_data, dtype=self.datatype)
-        data_mat = np.reshape(data_mat, (num_time_points, self.z_dim, self.y_dim, self.x_dim), order='C')
+        shape = (num_time_points, self.z_dim, self.y_dim, self.x_dim)
+        if out is None:
+            out = np.empty(shape, dtype=self.datatype)
+        elif out.shape != shape or out.dtype != self.datatype or not out.flags.c_contiguous or \
+                not out.flags.writeable:
+            raise CVDBError("Can't decompress into an array of shape {} and type {}.".format(out.shape, out.dtype),
+                            ErrorCodes.SERIALIZATION_ERROR)
+
+        # blosc writes as many bytes as the header says, so check them against the buffer before decompressing
+        view = memoryview(data).cast("B")
+        nbytes, _, cbytes = struct.unpack_from("<iii", view, 4) if len(view) >= 16 else (None, None, None)
+        if nbytes != out.nbytes or cbytes > len(view):
+            raise CVDBError("Blosc data doesn't hold an array of shape {} and type {}.".format(shape, out.dtype),
+                            ErrorCodes.SERIALIZATION_ERROR)
+        blosc.decompress_ptr(view, out.__array_interface__["data"][0])
 
-        return data_mat
+        return out
 
     def from_blosc(self, byte_arrays, time_sample_range=None, missing_time_steps=[]):
         # TODO: Conditional properties of this method are challenging for the developer. break into multiple methods
         """Uncompress and populate Cube data from a Blosc serialized and compressed byte array using the numpy interface
 
         If byte_arrays is a list, assume data is stored internally in this Cube instance in tzyx ordering and
-        each byte array is a single tzyx ordered time sample, in order, matching time_sample_range.
+        each byte array is a single tzyx ordered time sample, in order, matching time_sample_range. Time samples are
+        decoded concurrently, each straight into its slot of the data matrix, and missing ones are left zero.
 
         If byte_arrays is a single bytearray, assume it contains the entire Cube's data for all time samples and is of the
         format tzyx. Directly decompress and replace data in the Cube instance.
@@ -211,6 +382,7 @@ class Cube(metaclass=ABCMeta):
             byte_arrays list[str]:  list of time ordered, compressed, serialized byte array of Cube matrix data
             time_sample_range list(int): The min and max time samples that input_data represents in python convention
             (start inclusive, stop exclusive)
+            missing_time_steps list(int): Time samples of time_sample_range without a byte array in byte_arrays
 
         Returns:
             None
@@ -228,27 +400,27 @@ class Cube(metaclass=ABCMeta):
             if isinstance(byte_arrays, list) or isinstance(byte_arrays, tuple):
                 # Got a list of byte arrays, so assume they are each 4-D, corresponding to time samples
 
-                # Unpack all of the arrays into the cube
-                b_arr_idx = 0
-                missing_gen = self.missing_ts_gen(missing_time_steps)
-                missing_t = next(missing_gen)
-                for data_idx, t in enumerate(range(time_sample_range[0], time_sample_range[1])):
-                    if data_idx == 0:
-                        # On first cube get the size and allocate properly
-                        self.data = np.zeros(shape=(time_sample_range[1] - time_sample_range[0],
-                                                    self.z_dim, self.y_dim, self.x_dim), dtype=self.data.dtype)
-                    if t == missing_t:
-                        # No data for this time step.
-                        self.data[data_idx, :, :, :] = np.zeros(
-                            shape=(1, self.z_dim, self.y_dim, self.x_dim), 
-                            dtype=self.data.dtype)
-                        missing_t = next(missing_gen)
-                    else:
-                        self.data[data_idx, :, :, :] = self.unpack_array(byte_arrays[b_arr_idx], 1)
-                        b_arr_idx += 1
+                # Missing time samples stay zero, the rest are decoded into their slots
+                missing = set(missing_time_steps)
+                present = [data_idx for data_idx, t in enumerate(range(*time_sample_range)) if t not in missing]
+                if len(present) != len(byte_arrays):
+                    raise ValueError("Got {} byte arrays for {} time samples.".format(len(byte_arrays), len(present)))
+                self.data = self.allocate(zero=len(present) < time_sample_range[1] - time_sample_range[0])
+
+                def unpack(data_idx, byte_array):
+                    self.unpack_array(byte_array, 1, out=self.data[data_idx:data_idx + 1])
+
+                # Time samples decode in parallel if blosc releases the GIL, see cvdb.config.configure_blosc()
+                threads = min(self.compression["threads"], os.cpu_count() or 1, len(present))
+                if threads > 1:
+                    with ThreadPoolExecutor(max_workers=threads, thread_name_prefix="cvdb-decompress") as pool:
+                        list(pool.map(unpack, present, byte_arrays))
+                else:
+                    for data_idx, byte_array in zip(present, byte_arrays):
+                        unpack(data_idx, byte_array)
             else:
                 # If you get a single array assume it is the complete 4D array
-                self.data[:, :, :, :] = self.unpack_array(byte_arrays, self.time_range[1] - self.time_range[0])
+                self.data = self.unpack_array(byte_arrays, self.time_range[1] - self.time_range[0])
                 #self.z_dim, self.y_dim, self.x_dim = self.cube_size = list(self.data.shape)[1:]
 
         except Exception as e:
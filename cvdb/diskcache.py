@@ -0,0 +1,222 @@
+# Copyright 2021 The Johns Hopkins University Applied Physics Laboratory
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import hashlib
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+
+from .error import logger
+
+# Default byte budget of a disk chunk cache
+DEFAULT_MAX_BYTES = 16 * 2 ** 30
+
+
+class DiskChunkCache:
+    """Persistent local cache of stored chunk files with a byte budget.
+
+    Chunk files are kept exactly as stored in the volume (after transport decompression) so a hit only costs a
+    local read and a decode. Each volume gets its own directory under `path`, named from a hash of its cloudpath.
+    The index is rebuilt from the directory on construction, so the cache survives process restarts, and files
+    are written atomically so several processes can share one cache directory.
+
+    Args:
+        path (str): Directory holding the cache
+        max_bytes (int): Byte budget. Least recently used files are deleted to stay under it
+
+    Attributes:
+        hits (int): Number of lookups served from disk
+        misses (int): Number of lookups that were not cached
+        evictions (int): Number of files deleted to stay within the budget
+    """
+    def __init__(self, path, max_bytes=DEFAULT_MAX_BYTES):
+        self.path = os.path.abspath(os.path.expanduser(path))
+        self.max_bytes = max_bytes
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self._files = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+        os.makedirs(self.path, exist_ok=True)
+        self._load_index()
+
+    def _load_index(self):
+        """Rebuild the LRU index from the files on disk, oldest modification time first"""
+        entries = []
+        for dir_path, _, filenames in os.walk(self.path):
+            for filename in filenames:
+                if filename.startswith(".tmp"):
+                    continue
+                file_path = os.path.join(dir_path, filename)
+                try:
+                    stat = os.stat(file_path)
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, file_path, stat.st_size))
+
+        for _, file_path, size in sorted(entries):
+            self._files[file_path] = size
+            self._bytes += size
+
+        self._evict()
+
+    def file_path(self, cloudpath, filename):
+        """Get the local path used to cache a chunk file
+
+        Args:
+            cloudpath (str): Location of the volume
+            filename (str): Chunk key relative to the volume (e.g. "4_4_40/0-512_0-512_0-16")
+
+        Returns:
+            (str)
+        """
+        volume_dir = hashlib.sha1(cloudpath.encode("utf-8")).hexdigest()
+        return os.path.join(self.path, volume_dir, *filename.split("/"))
+
+    def get(self, cloudpath, filename):
+        """Read a cached chunk file
+
+        Args:
+            cloudpath (str): Location of the volume
+            filename (str): Chunk key relative to the volume
+
+        Returns:
+            (bytes|None): The file contents, None on a miss
+        """
+        file_path = self.file_path(cloudpath, filename)
+        try:
+            with open(file_path, "rb") as fh:
+                content = fh.read()
+        except OSError:
+            with self._lock:
+                self.misses += 1
+            return None
+
+        # Bump the modification time so recency survives a restart
+        try:
+            os.utime(file_path)
+        except OSError:
+            pass
+
+        with self._lock:
+            self.hits += 1
+            if file_path in self._files:
+                self._files.move_to_end(file_path)
+            else:
+                # Written by another process sharing the directory
+                self._files[file_path] = len(content)
+                self._bytes += len(content)
+        return content
+
+    def put(self, cloudpath, filename, content):
+        """Write a chunk file to the cache, evicting least recently used files if over budget
+
+        Args:
+            cloudpath (str): Location of the volume
+            filename (str): Chunk key relative to the volume
+            content (bytes): The file contents
+
+        Returns:
+            None
+        """
+        if len(content) > self.max_bytes:
+            return
+
+        file_path = self.file_path(cloudpath, filename)
+        try:
+            os.makedirs(os.path.dirname(file_path), exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(prefix=".tmp", dir=os.path.dirname(file_path))
+            with os.fdopen(fd, "wb") as fh:
+                fh.write(content)
+            os.replace(tmp_path, file_path)
+        except OSError as e:
+            # A full or read-only disk should slow reads down, not fail them
+            logger("DiskChunkCache").warning("Failed to cache {}: {}".format(filename, e))
+            return
+
+        with self._lock:
+            self._bytes -= self._files.pop(file_path, 0)
+            self._files[file_path] = len(content)
+            self._bytes += len(content)
+            self._evict()
+
+    def _evict(self):
+        """Delete least recently used files until within budget. Caller holds the lock (or is the constructor)"""
+        while self._bytes > self.max_bytes and self._files:
+            file_path, size = self._files.popitem(last=False)
+            self._bytes -= size
+            self.evictions += 1
+            try:
+                os.remove(file_path)
+            except OSError:
+                pass
+
+    def invalidate(self, cloudpath, filenames=None):
+        """Delete cached files of a volume
+
+        Args:
+            cloudpath (str): Location of the volume
+            filenames (iterable(str)): Only delete these chunk keys. None deletes every chunk of the volume
+
+        Returns:
+            (int): Number of files deleted
+        """
+        if filenames is None:
+            prefix = os.path.dirname(self.file_path(cloudpath, "x")) + os.sep
+            with self._lock:
+                paths = [file_path for file_path in self._files if file_path.startswith(prefix)]
+        else:
+            paths = [self.file_path(cloudpath, filename) for filename in filenames]
+
+        count = 0
+        with self._lock:
+            for file_path in paths:
+                self._bytes -= self._files.pop(file_path, 0)
+                try:
+                    os.remove(file_path)
+                    count += 1
+                except OSError:
+                    pass
+        return count
+
+    @property
+    def nbytes(self):
+        """Total size of the cached files in bytes"""
+        return self._bytes
+
+    def stats(self):
+        """Snapshot of the cache counters
+
+        Returns:
+            (dict)
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "files": len(self._files),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+    def __len__(self):
+        return len(self._files)
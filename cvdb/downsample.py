@@ -0,0 +1,230 @@
+# Copyright 2021 The Johns Hopkins University Applied Physics Laboratory
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import numpy as np
+
+from .chunks import BaseChunkReader, ChunkGrid, paste_chunk
+
+"""
+.. module:: downsample
+    :synopsis: Vectorized pooling of TZYX data and on the fly downsampled reads.
+"""
+
+# Number of downsampled chunks built concurrently. Each one reads its source chunks with the source reader's pool
+DEFAULT_PARALLEL = 4
+
+
+def pool_blocks(data, factor):
+    """Reshape TZYX data so each pooling block is a trailing axis
+
+    Partial blocks on the upper edges are padded by repeating the last voxel.
+
+    Args:
+        data (numpy.ndarray): TZYX data
+        factor ((int, int, int)): Pooling factor in xyz
+
+    Returns:
+        (numpy.ndarray): T, Z', Y', X', block array
+    """
+    fx, fy, fz = factor
+    t, z, y, x = data.shape
+    pad = [(0, 0), (0, -z % fz), (0, -y % fy), (0, -x % fx)]
+    if any(p[1] for p in pad):
+        data = np.pad(data, pad, mode="edge")
+        t, z, y, x = data.shape
+
+    blocks = data.reshape(t, z // fz, fz, y // fy, fy, x // fx, fx)
+    return blocks.transpose(0, 1, 3, 5, 2, 4, 6).reshape(t, z // fz, y // fy, x // fx, fz * fy * fx)
+
+
+def pool_mean(data, factor):
+    """Downsample by averaging each block, rounding to the nearest value. Used for image data
+
+    Args:
+        data (numpy.ndarray): TZYX data
+        factor ((int, int, int)): Pooling factor in xyz
+
+    Returns:
+        (numpy.ndarray): TZYX downsampled data of the same datatype
+    """
+    fx, fy, fz = factor
+    t, z, y, x = data.shape
+    if z % fz or y % fy or x % fx:
+        mean = pool_blocks(data, factor).mean(axis=-1)
+    else:
+        # Reduce the block axes in place of the reshaped view, avoiding the transposed copy
+        mean = data.reshape(t, z // fz, fz, y // fy, fy, x // fx, fx).mean(axis=(2, 4, 6))
+    return np.rint(mean).astype(data.dtype)
+
+
+def pool_mode(data, factor):
+    """Downsample by taking the most frequent value of each block. Used for annotation data
+
+    Counts are built with one vectorized comparison per pair of block positions, so no Python loop runs per voxel.
+    Ties go to the value seen first in the block.
+
+    Args:
+        data (numpy.ndarray): TZYX data
+        factor ((int, int, int)): Pooling factor in xyz
+
+    Returns:
+        (numpy.ndarray): TZYX downsampled data of the same datatype
+    """
+    blocks = pool_blocks(data, factor)
+    size = blocks.shape[-1]
+    if size == 1:
+        return blocks[..., 0].copy()
+
+    counts = np.zeros(blocks.shape, dtype=np.uint8)
+    for i in range(size):
+        for j in range(i + 1, size):
+            same = blocks[..., i] == blocks[..., j]
+            counts[..., i] += same
+            counts[..., j] += same
+
+    winner = counts.argmax(axis=-1)
+    return np.take_along_axis(blocks, winner[..., np.newaxis], axis=-1)[..., 0]
+
+
+POOLING_METHODS = {
+    "mean": pool_mean,
+    "mode": pool_mode,
+}
+
+
+def downsample(data, factor, method):
+    """Downsample TZYX data
+
+    Args:
+        data (numpy.ndarray): TZYX data
+        factor ((int, int, int)): Pooling factor in xyz
+        method (str): mean or mode
+
+    Returns:
+        (numpy.ndarray): TZYX downsampled data of the same datatype
+    """
+    return POOLING_METHODS[method](data, factor)
+
+
+def read_pooled(reader, corner, extent, factor, method, num_channels=1):
+    """Read a region of a mip and downsample it
+
+    Args:
+        reader (cvdb.chunks.BaseChunkReader): Reader of the mip being downsampled
+        corner ((int, int, int)): the xyz location of the corner of the region, in voxels of the mip
+        extent ((int, int, int)): the xyz extents of the region, in voxels of the mip
+        factor ((int, int, int)): Pooling factor in xyz
+        method (str): mean or mode
+        num_channels (int): Number of channels pooled. The reader must keep the channel axis if more than one
+
+    Returns:
+        (numpy.ndarray|None): CZYX downsampled data, None if none of the chunks of the region exist
+    """
+    # Channels take the place of time so every channel is pooled in one pass
+    data = np.zeros([num_channels, extent[2], extent[1], extent[0]], dtype=reader.grid.dtype)
+    found = False
+    for index, chunk_data in reader.iter_read(reader.grid.indices(corner, extent)):
+        if chunk_data is None:
+            continue
+        found = True
+        chunk_start = reader.grid.chunk_bounds(index)[0]
+        for channel in range(num_channels):
+            paste_chunk(data, channel, corner, chunk_start, chunk_data, channel)
+
+    if not found:
+        return None
+    return downsample(data, factor, method)
+
+
+class DownsampledGrid(ChunkGrid):
+    """Virtual chunk grid of a volume downsampled by an integer factor.
+
+    Chunks keep the source chunk size, so a downsampled chunk covers factor source chunks along each pooled axis.
+    The grid's mip is the (source mip, factor) pair, which keeps its chunks apart from real ones in the chunk cache.
+
+    Args:
+        source (cvdb.chunks.ChunkGrid): Grid of the mip being downsampled
+        factor ((int, int, int)): Pooling factor in xyz
+    """
+    def __init__(self, source, factor):
+        self.source = source
+        self.factor = tuple(factor)
+        self.mip = (source.mip, self.factor)
+        self.chunk_size = source.chunk_size
+        self.voxel_offset = tuple(source.voxel_offset[d] // factor[d] for d in range(3))
+        self.bounds_max = tuple(self.voxel_offset[d] + -(-(source.bounds_max[d] - source.voxel_offset[d]) // factor[d])
+                                for d in range(3))
+        self.dtype = source.dtype
+        self.encoding = source.encoding
+        self.num_channels = source.num_channels
+        self.block_size = source.block_size
+        self.sharded = False
+        self.key = None
+
+    def source_region(self, index):
+        """Get the region of the source mip that a downsampled chunk is built from
+
+        Args:
+            index ((int, int, int)): grid index of the downsampled chunk
+
+        Returns:
+            (tuple(tuple(int), tuple(int))): xyz corner and xyz extent in source voxels, clipped to the source
+        """
+        start, stop = self.chunk_bounds(index)
+        corner = tuple(self.source.voxel_offset[d] + (start[d] - self.voxel_offset[d]) * self.factor[d]
+                       for d in range(3))
+        extent = tuple(min(corner[d] + (stop[d] - start[d]) * self.factor[d], self.source.bounds_max[d]) - corner[d]
+                       for d in range(3))
+        return corner, extent
+
+
+class DownsampledReader(BaseChunkReader):
+    """Reads chunks of a mip downsampled on the fly, building each one from the source mip.
+
+    Downsampled chunks go through the same decoded chunk cache as stored chunks, so a region is pooled once and
+    served from memory afterwards. Missing source chunks are handled by the source reader.
+
+    Args:
+        source (cvdb.chunks.BaseChunkReader): Reader of the mip being downsampled
+        factor ((int, int, int)): Pooling factor in xyz
+        method (str): mean or mode
+        parallel (int): Number of downsampled chunks built concurrently
+
+    Attributes:
+        grid (DownsampledGrid): Virtual chunk layout of the downsampled mip
+    """
+    def __init__(self, source, factor, method, parallel=DEFAULT_PARALLEL):
+        super().__init__(DownsampledGrid(source.grid, factor), source.cloudpath, parallel, source.cache,
+                         source.populate, source.channels, flights=source.flights)
+        self.source = source
+        self.method = method
+        self.trace = source.trace
+
+    def download(self, index):
+        """Build a downsampled chunk from the source mip, bypassing the decoded chunk cache
+
+        Args:
+            index ((int, int, int)): grid index of the downsampled chunk
+
+        Returns:
+            (numpy.ndarray|None): xyz (or xyzc) ordered chunk data, None if none of the source chunks exist
+        """
+        corner, extent = self.grid.source_region(index)
+        data = read_pooled(self.source, corner, extent, self.grid.factor, self.method,
+                           self.grid.num_channels if self.channels else 1)
+        if data is None:
+            return None
+
+        data = data.T
+        return data if self.channels else data[:, :, :, 0]
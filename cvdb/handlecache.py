@@ -0,0 +1,183 @@
+# Copyright 2021 The Johns Hopkins University Applied Physics Laboratory
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import threading
+import time
+from collections import OrderedDict
+
+from cloudvolume import CloudVolume
+
+# Location of a volume when the options don't carry a path_template
+DEFAULT_PATH_TEMPLATE = "s3://{bucket}/{cv_path}"
+
+
+def open_volume(bucket, cv_path, mip, options):
+    """Default factory used to construct a CloudVolume handle.
+
+    Args:
+        bucket (str): S3 bucket holding the precomputed volume
+        cv_path (str): Path to the volume inside the bucket
+        mip (int): Resolution level the handle is bound to
+        options (dict): Extra keyword arguments passed to CloudVolume. An optional path_template, with {bucket}
+            and {cv_path} placeholders, locates the volume instead of DEFAULT_PATH_TEMPLATE
+
+    Returns:
+        (cloudvolume.CloudVolume)
+    """
+    path_template = options.pop("path_template", DEFAULT_PATH_TEMPLATE)
+    return CloudVolume(path_template.format(bucket=bucket, cv_path=cv_path), mip=mip, **options)
+
+
+class VolumeHandleCache:
+    """Thread-safe LRU cache of CloudVolume handles.
+
+    Constructing a CloudVolume fetches the volume's info file, which dominates the cost of small cutouts. Handles
+    are keyed by (bucket, cv_path, mip, options) so each one is bound to a single resolution level and can be
+    shared across threads for reads.
+
+    Args:
+        max_size (int): Maximum number of handles to keep before evicting the least recently used
+        ttl (float|None): Seconds before a handle is rebuilt so the info file is re-read. None disables expiry
+        factory (callable): Function of (bucket, cv_path, mip, options) that builds a handle
+
+    Attributes:
+        hits (int): Number of lookups served from the cache
+        misses (int): Number of lookups that constructed a new handle
+        evictions (int): Number of handles dropped to stay within max_size
+        expirations (int): Number of handles dropped because their ttl elapsed
+    """
+    def __init__(self, max_size=128, ttl=300, factory=open_volume):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.factory = factory
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+        self._handles = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(bucket, cv_path, mip, options=None):
+        """Build the cache key for a handle.
+
+        Args:
+            bucket (str): S3 bucket holding the precomputed volume
+            cv_path (str): Path to the volume inside the bucket
+            mip (int): Resolution level
+            options (dict): Extra keyword arguments passed to CloudVolume
+
+        Returns:
+            (tuple)
+        """
+        return bucket, cv_path, mip, tuple(sorted((options or {}).items()))
+
+    def get(self, bucket, cv_path, mip, options=None):
+        """Get a handle for the volume, constructing it on a miss.
+
+        Args:
+            bucket (str): S3 bucket holding the precomputed volume
+            cv_path (str): Path to the volume inside the bucket
+            mip (int): Resolution level
+            options (dict): Extra keyword arguments passed to CloudVolume
+
+        Returns:
+            (cloudvolume.CloudVolume)
+        """
+        key = self.make_key(bucket, cv_path, mip, options)
+        now = time.monotonic()
+
+        with self._lock:
+            entry = self._handles.get(key)
+            if entry is not None:
+                vol, created = entry
+                if self.ttl is not None and now - created > self.ttl:
+                    del self._handles[key]
+                    self.expirations += 1
+                else:
+                    self._handles.move_to_end(key)
+                    self.hits += 1
+                    return vol
+            self.misses += 1
+
+        # Build outside the lock so a slow info fetch doesn't block lookups for other volumes
+        vol = self.factory(bucket, cv_path, mip, dict(options or {}))
+
+        with self._lock:
+            entry = self._handles.get(key)
+            if entry is not None:
+                # Another thread built the same handle first, keep theirs
+                self._handles.move_to_end(key)
+                return entry[0]
+
+            self._handles[key] = (vol, now)
+            while len(self._handles) > self.max_size:
+                self._handles.popitem(last=False)
+                self.evictions += 1
+
+        return vol
+
+    def invalidate(self, bucket=None, cv_path=None, mip=None):
+        """Drop cached handles. Arguments that are None match everything.
+
+        Use after a volume's info file changes (e.g. a new scale was added) so the next lookup re-reads it.
+
+        Args:
+            bucket (str): Only drop handles for this bucket
+            cv_path (str): Only drop handles for this path
+            mip (int): Only drop handles for this resolution level
+
+        Returns:
+            (int): Number of handles dropped
+        """
+        with self._lock:
+            keys = [key for key in self._handles
+                    if (bucket is None or key[0] == bucket)
+                    and (cv_path is None or key[1] == cv_path)
+                    and (mip is None or key[2] == mip)]
+            for key in keys:
+                del self._handles[key]
+
+        return len(keys)
+
+    def clear(self):
+        """Drop all cached handles and reset the counters
+
+        Returns:
+            None
+        """
+        with self._lock:
+            self._handles.clear()
+            self.hits = self.misses = self.evictions = self.expirations = 0
+
+    def stats(self):
+        """Snapshot of the cache counters
+
+        Returns:
+            (dict)
+        """
+        with self._lock:
+            return {
+                "size": len(self._handles),
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+            }
+
+    def __len__(self):
+        return len(self._handles)
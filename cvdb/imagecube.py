@@ -21,6 +21,9 @@ from .error import CVDBError, ErrorCodes
 
 
 class ImageCube8(Cube):
+    # Microscopy images barely compress, so favor lz4's speed
+    compression = dict(Cube.compression, cname="lz4")
+
     def __init__(self, cube_size=None, time_range=None):
         """Create empty array of cube_size"""
 
@@ -30,12 +33,10 @@ class ImageCube8(Cube):
         # call the base class constructor
         Cube.__init__(self, cube_size, time_range)
 
-        # Note that this is self.cube_size (which is transposed) in Cube
-        self.data = np.zeros([self.time_range[1]-self.time_range[0]] + self.cube_size, dtype=np.uint8, order='C')
-
         # variable that describes when a cube is created from zeros rather than loaded from another source
         self._created_from_zeros = False
 
+        # self.data is allocated lazily on first access, cutouts usually replace it immediately
         self.datatype = np.uint8
 
     def zeros(self):
@@ -149,6 +150,9 @@ class ImageCube8(Cube):
 
 
 class ImageCube16(Cube):
+    # See ImageCube8
+    compression = dict(Cube.compression, cname="lz4")
+
     def __init__(self, cube_size=None, time_range=None):
         """Create empty array of cube_size"""
 
@@ -158,12 +162,10 @@ class ImageCube16(Cube):
         # call the base class constructor
         Cube.__init__(self, cube_size, time_range)
 
-        # note that this is self.cube_size (which is transposed) in Cube
-        self.data = np.zeros([self.time_range[1] - self.time_range[0]] + self.cube_size, dtype=np.uint16, order='C')
-
         # variable that describes when a cube is created from zeros rather than loaded from another source
         self._created_from_zeros = False
 
+        # self.data is allocated lazily on first access, cutouts usually replace it immediately
         self.datatype = np.uint16
 
     def zeros(self):
@@ -0,0 +1,203 @@
+# Copyright 2021 The Johns Hopkins University Applied Physics Laboratory
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager, nullcontext
+
+import numpy as np
+
+"""
+.. module:: instrument
+    :synopsis: Per-cutout timing breakdowns and an in-process aggregator of them.
+"""
+
+# Phases timed by a cutout trace
+#   info: opening volume handles, which may fetch info files
+#   allocate: allocating the output buffer
+#   download: reading chunk files from storage or the disk cache
+#   decode: decompressing and decoding chunk files
+#   paste: copying decoded (xyz ordered) chunks into the TZYX output, i.e. the transpose
+#   total: wall clock time of the whole cutout
+PHASES = ("info", "allocate", "download", "decode", "paste", "total")
+
+# Counters kept by a cutout trace
+#   chunks: chunks overlapping the region
+#   cache_hits: chunks served by the decoded chunk cache or the read-ahead buffer
+#   missing: chunks that do not exist in storage
+#   bytes: size of the chunk files read from storage or the disk cache
+COUNTERS = ("chunks", "cache_hits", "missing", "bytes")
+
+# Number of recent traces summarized by a StatsAggregator
+DEFAULT_WINDOW = 10000
+
+# Percentiles reported by StatsAggregator.summary()
+DEFAULT_PERCENTILES = (50, 90, 99)
+
+
+class CutoutTrace:
+    """Timing breakdown and counters of a single cutout.
+
+    Chunks are fetched on several threads, so download, decode and paste are the sum of the time spent by every
+    thread and can add up to more than total.
+
+    Args:
+        **labels: Describe the cutout, e.g. channel, resolution, corner and extent
+
+    Attributes:
+        labels (dict): Description of the cutout
+        phases (dict): Seconds spent in each of PHASES
+        counters (dict): Value of each of COUNTERS
+    """
+    def __init__(self, **labels):
+        self.labels = labels
+        self.phases = dict.fromkeys(PHASES, 0.0)
+        self.counters = dict.fromkeys(COUNTERS, 0)
+        self._lock = threading.Lock()
+
+    def add(self, phase, seconds):
+        """Add time to a phase
+
+        Args:
+            phase (str): One of PHASES
+            seconds (float): Time spent
+
+        Returns:
+            None
+        """
+        with self._lock:
+            self.phases[phase] += seconds
+
+    def count(self, counter, value=1):
+        """Increase a counter
+
+        Args:
+            counter (str): One of COUNTERS
+            value (int): Increment
+
+        Returns:
+            None
+        """
+        with self._lock:
+            self.counters[counter] += value
+
+    @contextmanager
+    def timer(self, phase):
+        """Time a block, adding its duration to a phase
+
+        Args:
+            phase (str): One of PHASES
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(phase, time.perf_counter() - start)
+
+    def as_dict(self):
+        """Flatten the trace into a dict of labels, phase seconds and counters
+
+        Returns:
+            (dict)
+        """
+        with self._lock:
+            result = dict(self.labels)
+            result.update(self.phases)
+            result.update(self.counters)
+            return result
+
+
+def timed(trace, phase):
+    """Time a block into a trace, doing nothing if there is no trace
+
+    Args:
+        trace (CutoutTrace|None): Trace of the cutout
+        phase (str): One of PHASES
+
+    Returns:
+        (contextmanager)
+    """
+    return nullcontext() if trace is None else trace.timer(phase)
+
+
+class StatsAggregator:
+    """Thread-safe summary of recent cutout traces, with percentiles of each phase and counter.
+
+    An instance is a hook: pass it to CloudVolumeDB(hooks=[...]) and every traced cutout is recorded. Only the
+    last `window` traces are kept, so memory stays bounded in long running processes.
+
+    Args:
+        window (int): Number of recent traces kept
+
+    Attributes:
+        count (int): Number of traces recorded since the last reset
+    """
+    def __init__(self, window=DEFAULT_WINDOW):
+        self.window = window
+        self.count = 0
+
+        self._samples = {name: deque(maxlen=window) for name in PHASES + COUNTERS}
+        self._lock = threading.Lock()
+
+    def __call__(self, trace):
+        self.record(trace)
+
+    def record(self, trace):
+        """Add a cutout trace to the summary
+
+        Args:
+            trace (CutoutTrace): A finished trace
+
+        Returns:
+            None
+        """
+        values = trace.as_dict()
+        with self._lock:
+            self.count += 1
+            for name, samples in self._samples.items():
+                samples.append(values[name])
+
+    def summary(self, percentiles=DEFAULT_PERCENTILES):
+        """Summarize the recorded traces
+
+        Args:
+            percentiles (iterable(float)): Percentiles to report, between 0 and 100
+
+        Returns:
+            (dict): phase or counter name -> {"mean", "max", "p<percentile>"...}, over the recent traces
+        """
+        with self._lock:
+            samples = {name: np.array(values, dtype=np.float64) for name, values in self._samples.items()}
+
+        summary = {}
+        for name, values in samples.items():
+            if not len(values):
+                continue
+            entry = {"mean": float(values.mean()), "max": float(values.max())}
+            for percentile, value in zip(percentiles, np.percentile(values, list(percentiles))):
+                entry["p{:g}".format(percentile)] = float(value)
+            summary[name] = entry
+        return summary
+
+    def reset(self):
+        """Forget every recorded trace
+
+        Returns:
+            None
+        """
+        with self._lock:
+            self.count = 0
+            for samples in self._samples.values():
+                samples.clear()
@@ -0,0 +1,97 @@
+# Copyright 2021 The Johns Hopkins University Applied Physics Laboratory
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import numpy as np
+
+from .error import CVDBError, ErrorCodes
+
+"""
+.. module:: morton
+    :synopsis: Vectorized Morton (Z-order) indices of 3D cuboid grids, compatible with spdb cuboid keys.
+"""
+
+# Bits per axis. Three axes fill 63 bits of a uint64 Morton ID
+AXIS_BITS = 21
+
+# Shifts and masks spreading the 21 bits of an axis to every third bit, from the widest step down
+_SPREAD = (
+    (32, 0x1f00000000ffff),
+    (16, 0x1f0000ff0000ff),
+    (8, 0x100f00f00f00f00f),
+    (4, 0x10c30c30c30c30c3),
+    (2, 0x1249249249249249),
+)
+
+# The same steps in reverse, gathering every third bit back into the low 21 bits
+_COMPACT = (
+    (2, 0x10c30c30c30c30c3),
+    (4, 0x100f00f00f00f00f),
+    (8, 0x1f0000ff0000ff),
+    (16, 0x1f00000000ffff),
+    (32, (1 << AXIS_BITS) - 1),
+)
+
+
+def _spread(values):
+    values = values & np.uint64((1 << AXIS_BITS) - 1)
+    for shift, mask in _SPREAD:
+        values = (values | (values << np.uint64(shift))) & np.uint64(mask)
+    return values
+
+
+def _compact(values):
+    values = values & np.uint64(_SPREAD[-1][1])
+    for shift, mask in _COMPACT:
+        values = (values ^ (values >> np.uint64(shift))) & np.uint64(mask)
+    return values
+
+
+def xyz_morton(indices):
+    """Get the Morton IDs of xyz grid indices
+
+    Bit i of x, y and z becomes bit 3i, 3i + 1 and 3i + 2 of the ID, as with ndlib's XYZMorton used by spdb cuboid
+    keys.
+
+    Args:
+        indices (array-like): xyz grid indices, shape (3,) or (N, 3)
+
+    Returns:
+        (numpy.uint64|numpy.ndarray): The Morton ID, or the N Morton IDs as uint64
+
+    Raises:
+        (CVDBError): If an index is negative or doesn't fit in 21 bits
+    """
+    indices = np.asarray(indices)
+    if indices.shape[-1:] != (3,) or indices.ndim > 2:
+        raise CVDBError("Morton indices must have shape (3,) or (N, 3), not {}.".format(indices.shape),
+                        ErrorCodes.CVDB_ERROR)
+    if indices.size and (indices.min() < 0 or indices.max() >= 1 << AXIS_BITS):
+        raise CVDBError("Morton indices must be in [0, {}).".format(1 << AXIS_BITS), ErrorCodes.CVDB_ERROR)
+
+    indices = indices.astype(np.uint64)
+    return (_spread(indices[..., 0]) | (_spread(indices[..., 1]) << np.uint64(1)) |
+            (_spread(indices[..., 2]) << np.uint64(2)))
+
+
+def morton_xyz(ids):
+    """Get the xyz grid indices of Morton IDs. Inverse of xyz_morton()
+
+    Args:
+        ids (int|array-like): A Morton ID or N of them
+
+    Returns:
+        (numpy.ndarray): xyz grid indices as uint64, shape (3,) or (N, 3)
+    """
+    ids = np.asarray(ids, dtype=np.uint64)
+    return np.stack([_compact(ids >> np.uint64(axis)) for axis in range(3)], axis=-1)
@@ -0,0 +1,503 @@
+# Copyright 2021 The Johns Hopkins University Applied Physics Laboratory
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import hashlib
+import os
+import re
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+from cloudfiles import CloudFiles
+
+from .chunks import ChunkGrid
+from .error import CVDBError, ErrorCodes, logger
+
+"""
+.. module:: occupancy
+    :synopsis: Knowledge of which chunks of a volume exist, so reads of sparse volumes skip absent chunks.
+"""
+
+# Seconds a chunk found missing in storage is assumed to stay missing, for volumes without an occupancy index
+DEFAULT_TTL = 300
+
+# Number of missing chunks remembered by the negative cache
+DEFAULT_MAX_MISSING = 1000000
+
+# Seconds between checks of a persisted index for updates saved by other processes
+DEFAULT_RELOAD_INTERVAL = 10
+
+# Seconds updates to a persisted index are batched before it is saved
+DEFAULT_SAVE_DELAY = 5
+
+# Name of an unsharded chunk file, with an optional transport compression suffix (file:// volumes keep it)
+CHUNK_NAME = re.compile(r"^(\d+)-(\d+)_(\d+)-(\d+)_(\d+)-(\d+)(?:\.(?:gz|br|zstd|xz|bz2))?$")
+
+
+class OccupancyIndex:
+    """Bitmap of the chunks of one mip of a volume that exist in storage, one bit per grid index.
+
+    An index is authoritative: chunks it doesn't list are read as zeros without asking storage, so it must be kept
+    up to date with writes (CloudVolumeDB.write_cuboid does this) or rebuilt after writes made by other tools.
+
+    Args:
+        grid_shape ((int, int, int)): Number of chunks along x, y and z
+        bits (numpy.ndarray): Optional packed bitmap, as returned by numpy.packbits, of x fastest grid indices
+
+    Attributes:
+        grid_shape (tuple(int)): Number of chunks along x, y and z
+    """
+    def __init__(self, grid_shape, bits=None):
+        self.grid_shape = tuple(int(v) for v in grid_shape)
+        size = int(np.prod(self.grid_shape))
+        self.bits = np.zeros((size + 7) // 8, dtype=np.uint8) if bits is None else np.asarray(bits, dtype=np.uint8)
+        if self.bits.size != (size + 7) // 8:
+            raise CVDBError("Occupancy bitmap of {} bytes does not match a grid of {}.".format(
+                            self.bits.size, self.grid_shape), ErrorCodes.CVDB_ERROR)
+        self._lock = threading.Lock()
+
+    @classmethod
+    def for_grid(cls, grid):
+        """Create an empty index covering a chunk grid
+
+        Args:
+            grid (cvdb.chunks.ChunkGrid): Chunk layout of the mip
+
+        Returns:
+            (OccupancyIndex)
+        """
+        return cls([-(-(grid.bounds_max[d] - grid.voxel_offset[d]) // grid.chunk_size[d]) for d in range(3)])
+
+    @classmethod
+    def from_filenames(cls, grid, filenames):
+        """Build an index from the names of the chunk files of a mip. Names that aren't chunks are ignored
+
+        Args:
+            grid (cvdb.chunks.ChunkGrid): Chunk layout of the mip
+            filenames (iterable(str)): Chunk keys, e.g. "4_4_40/0-512_0-512_0-16"
+
+        Returns:
+            (OccupancyIndex)
+        """
+        index = cls.for_grid(grid)
+        indices = []
+        for filename in filenames:
+            match = CHUNK_NAME.match(filename.rsplit("/", 1)[-1])
+            if match is None:
+                continue
+            start = [int(match.group(g)) for g in (1, 3, 5)]
+            indices.append(tuple((start[d] - grid.voxel_offset[d]) // grid.chunk_size[d] for d in range(3)))
+        index.add(indices)
+        return index
+
+    @classmethod
+    def build(cls, vol):
+        """Build an index by listing the chunk files of a volume's mip. This is an offline operation: it lists every
+        file of the mip
+
+        Args:
+            vol (cloudvolume.CloudVolume): Handle bound to the mip, on a protocol that supports listing (not the
+                HTTPS endpoint)
+
+        Returns:
+            (OccupancyIndex)
+
+        Raises:
+            (CVDBError): If the mip is sharded
+        """
+        grid = ChunkGrid(vol)
+        if grid.sharded:
+            raise CVDBError("Occupancy indexes of sharded mip {} are not supported.".format(grid.mip),
+                            ErrorCodes.CVDB_ERROR)
+
+        files = CloudFiles(vol.meta.cloudpath, secrets=vol.meta.config.secrets)
+        try:
+            filenames = list(files.list(prefix=grid.key + "/", flat=True))
+        except FileNotFoundError:
+            # Local volumes have no directory for a mip that was never written
+            filenames = []
+        return cls.from_filenames(grid, filenames)
+
+    @classmethod
+    def load(cls, file_path):
+        """Read an index saved by save()
+
+        Args:
+            file_path (str): Location of the index
+
+        Returns:
+            (OccupancyIndex)
+        """
+        with np.load(file_path) as saved:
+            return cls(saved["grid_shape"], saved["bits"])
+
+    def save(self, file_path):
+        """Write the index atomically, so readers in other processes never see a partial file
+
+        Args:
+            file_path (str): Location of the index
+
+        Returns:
+            None
+        """
+        with self._lock:
+            bits = self.bits.copy()
+
+        directory = os.path.dirname(file_path)
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(prefix=".tmp", dir=directory)
+        try:
+            with os.fdopen(fd, "wb") as fh:
+                np.savez(fh, grid_shape=np.array(self.grid_shape), bits=bits)
+            os.replace(tmp_path, file_path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+    def _position(self, index):
+        """Get the bit number of a grid index, None if it is outside the grid"""
+        if any(not 0 <= index[d] < self.grid_shape[d] for d in range(3)):
+            return None
+        return (index[2] * self.grid_shape[1] + index[1]) * self.grid_shape[0] + index[0]
+
+    def __contains__(self, index):
+        position = self._position(index)
+        if position is None:
+            return False
+        return bool(self.bits[position >> 3] & (0x80 >> (position & 7)))
+
+    def __len__(self):
+        return int(np.unpackbits(self.bits).sum())
+
+    def __bool__(self):
+        return bool(self.bits.any())
+
+    def add(self, indices):
+        """Mark chunks as existing
+
+        Args:
+            indices (iterable(tuple(int, int, int))): grid indices of the chunks
+
+        Returns:
+            None
+        """
+        positions = [p for p in (self._position(index) for index in indices) if p is not None]
+        with self._lock:
+            for position in positions:
+                self.bits[position >> 3] |= 0x80 >> (position & 7)
+
+    def discard(self, indices):
+        """Mark chunks as absent
+
+        Args:
+            indices (iterable(tuple(int, int, int))): grid indices of the chunks
+
+        Returns:
+            None
+        """
+        positions = [p for p in (self._position(index) for index in indices) if p is not None]
+        with self._lock:
+            for position in positions:
+                self.bits[position >> 3] &= ~np.uint8(0x80 >> (position & 7))
+
+
+class ChunkOccupancy:
+    """Tracks which chunks exist, so reads zero fill absent chunks without a request to storage.
+
+    Volumes (cloudpath and mip) with an occupancy index are answered from it. Indexes are built offline, see
+    OccupancyIndex.build(), and persisted under `path` so they survive restarts and can be shared by processes.
+    For volumes without an index, chunks found missing in storage are remembered for `ttl` seconds, so a burst of
+    reads of a sparse region only asks storage once per chunk.
+
+    Processes sharing `path` see each other's writes: a persisted index is reloaded when its file changed, checked at
+    most every `reload_interval` seconds. Writes and missing chunks update the index in memory at once, and are saved
+    in a batch `save_delay` seconds later on a background thread, merged into the file's latest version. Call flush()
+    to save them right away, e.g. before the process exits.
+
+    Args:
+        path (str): Optional directory holding persisted indexes. Without it, indexes only live in memory
+        ttl (float): Seconds a missing chunk is remembered by the negative cache
+        max_missing (int): Number of missing chunks remembered. The oldest are forgotten first
+        reload_interval (float): Seconds between checks of a persisted index for changes
+        save_delay (float): Seconds updates to a persisted index are batched before it is saved
+
+    Attributes:
+        skipped (int): Number of reads answered as absent without asking storage
+        learned (int): Number of missing chunks learned from storage
+    """
+    def __init__(self, path=None, ttl=DEFAULT_TTL, max_missing=DEFAULT_MAX_MISSING,
+                 reload_interval=DEFAULT_RELOAD_INTERVAL, save_delay=DEFAULT_SAVE_DELAY):
+        self.path = os.path.abspath(os.path.expanduser(path)) if path else None
+        self.ttl = ttl
+        self.max_missing = max_missing
+        self.reload_interval = reload_interval
+        self.save_delay = save_delay
+
+        self.skipped = 0
+        self.learned = 0
+
+        self._indexes = {}
+        self._missing = OrderedDict()
+        self._lock = threading.Lock()
+
+        # (cloudpath, mip) -> version of the index file the in-memory index was loaded from or saved to
+        self._versions = {}
+        # (cloudpath, mip) -> time.monotonic() of the last check of the index file
+        self._checked = {}
+        # (cloudpath, mip) -> (grid indices added, grid indices discarded) not saved yet
+        self._pending = {}
+        self._timer = None
+
+    def file_path(self, cloudpath, mip):
+        """Get the local path used to persist the index of a volume's mip
+
+        Args:
+            cloudpath (str): Location of the volume
+            mip (int): Resolution level
+
+        Returns:
+            (str|None): None if indexes aren't persisted
+        """
+        if self.path is None:
+            return None
+        volume_dir = hashlib.sha1(cloudpath.encode("utf-8")).hexdigest()
+        return os.path.join(self.path, volume_dir, "{}.npz".format(mip))
+
+    def get_index(self, cloudpath, mip):
+        """Get the index of a volume's mip, loading it from disk the first time and when another process saved it
+
+        Args:
+            cloudpath (str): Location of the volume
+            mip (int): Resolution level
+
+        Returns:
+            (OccupancyIndex|None): None if the volume has no index
+        """
+        key = (cloudpath, mip)
+        now = time.monotonic()
+        with self._lock:
+            if key in self._indexes and (self.path is None or now - self._checked[key] < self.reload_interval):
+                return self._indexes[key]
+            # Claim the check, so concurrent readers keep using the current index meanwhile
+            self._checked[key] = now
+        return self._refresh(key)
+
+    @staticmethod
+    def _version(file_path):
+        """Identify the saved version of an index file. Saves replace the file, so the inode changes too"""
+        try:
+            stat = os.stat(file_path)
+        except OSError:
+            return None
+        return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+    def _refresh(self, key):
+        """Reload the index of a volume's mip if its file changed since it was loaded, keeping unsaved updates"""
+        file_path = self.file_path(*key)
+        version = None if file_path is None else self._version(file_path)
+        with self._lock:
+            if key in self._indexes and self._versions.get(key) == version:
+                return self._indexes[key]
+            if key in self._indexes and version is None and self._versions.get(key) is None:
+                # Never saved, e.g. because saving failed, so the in-memory index is all there is
+                return self._indexes[key]
+
+        index = None
+        if version is not None:
+            try:
+                index = OccupancyIndex.load(file_path)
+            except Exception as e:
+                logger("ChunkOccupancy").warning("Ignoring unreadable occupancy index {}: {}".format(file_path, e))
+
+        with self._lock:
+            added, discarded = self._pending.get(key, ((), ()))
+            if index is not None:
+                index.add(added)
+                index.discard(discarded)
+            self._indexes[key] = index
+            self._versions[key] = version
+            self._checked.setdefault(key, time.monotonic())
+            return index
+
+    def set_index(self, cloudpath, mip, index):
+        """Install (and persist) the index of a volume's mip, replacing any previous one
+
+        Args:
+            cloudpath (str): Location of the volume
+            mip (int): Resolution level
+            index (OccupancyIndex|None): The index. None removes it, falling back to the negative cache
+
+        Returns:
+            None
+        """
+        key = (cloudpath, mip)
+        file_path = self.file_path(cloudpath, mip)
+        if file_path is not None:
+            if index is None:
+                if os.path.exists(file_path):
+                    os.unlink(file_path)
+            else:
+                index.save(file_path)
+
+        with self._lock:
+            self._indexes[key] = index
+            self._versions[key] = None if file_path is None else self._version(file_path)
+            self._checked[key] = time.monotonic()
+            self._pending.pop(key, None)
+        self.invalidate(cloudpath, mip)
+
+    def is_absent(self, cloudpath, mip, index):
+        """Check if a chunk is known not to exist
+
+        Args:
+            cloudpath (str): Location of the volume
+            mip (int): Resolution level
+            index ((int, int, int)): grid index of the chunk
+
+        Returns:
+            (bool): True if the chunk can be read as zeros without asking storage
+        """
+        occupancy = self.get_index(cloudpath, mip)
+        if occupancy is not None:
+            absent = tuple(index) not in occupancy
+        else:
+            key = (cloudpath, mip, tuple(index))
+            with self._lock:
+                expires = self._missing.get(key)
+                absent = expires is not None and expires > time.monotonic()
+                if expires is not None and not absent:
+                    del self._missing[key]
+
+        if absent:
+            with self._lock:
+                self.skipped += 1
+        return absent
+
+    def record_missing(self, cloudpath, mip, index):
+        """Remember that storage doesn't have a chunk
+
+        Args:
+            cloudpath (str): Location of the volume
+            mip (int): Resolution level
+            index ((int, int, int)): grid index of the chunk
+
+        Returns:
+            None
+        """
+        occupancy = self.get_index(cloudpath, mip)
+        if occupancy is not None:
+            # The index listed a chunk that is gone, so it is stale
+            occupancy.discard([index])
+            self._defer((cloudpath, mip), discarded=[tuple(index)])
+            return
+
+        with self._lock:
+            self.learned += 1
+            self._missing[(cloudpath, mip, tuple(index))] = time.monotonic() + self.ttl
+            self._missing.move_to_end((cloudpath, mip, tuple(index)))
+            while len(self._missing) > self.max_missing:
+                self._missing.popitem(last=False)
+
+    def record_present(self, cloudpath, mip, indices):
+        """Remember that chunks were written to storage
+
+        Args:
+            cloudpath (str): Location of the volume
+            mip (int): Resolution level
+            indices (iterable(tuple(int, int, int))): grid indices of the chunks
+
+        Returns:
+            None
+        """
+        indices = [tuple(index) for index in indices]
+        occupancy = self.get_index(cloudpath, mip)
+        if occupancy is not None:
+            occupancy.add(indices)
+            self._defer((cloudpath, mip), added=indices)
+        self.invalidate(cloudpath, mip, indices)
+
+    def invalidate(self, cloudpath, mip=None, indices=None):
+        """Forget missing chunks of a volume, so the next read asks storage again. Indexes are kept
+
+        Args:
+            cloudpath (str): Location of the volume
+            mip (int): Only forget chunks of this mip. None forgets every mip
+            indices (iterable(tuple(int, int, int))): Only forget these grid indices of mip. None forgets every chunk
+
+        Returns:
+            None
+        """
+        with self._lock:
+            if mip is not None and indices is not None:
+                for index in indices:
+                    self._missing.pop((cloudpath, mip, tuple(index)), None)
+                return
+
+            for key in [key for key in self._missing if key[0] == cloudpath and mip in (None, key[1])]:
+                del self._missing[key]
+
+    def __len__(self):
+        with self._lock:
+            return len(self._missing)
+
+    def flush(self):
+        """Save the updates of persisted indexes made since they were last saved
+
+        Each index is merged into the latest version of its file first, so updates saved by other processes are kept.
+        Failures are logged, not raised, so they never fail the reads or writes that made the updates.
+
+        Returns:
+            None
+        """
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+
+        for key, (added, discarded) in pending.items():
+            file_path = self.file_path(*key)
+            if file_path is None:
+                continue
+            index = self._refresh(key)
+            if index is None:
+                continue
+            # Updates made while the file was reloaded may not be in the index yet
+            index.add(added)
+            index.discard(discarded)
+            try:
+                index.save(file_path)
+            except OSError as e:
+                logger("ChunkOccupancy").warning("Could not save occupancy index {}: {}".format(file_path, e))
+                continue
+            with self._lock:
+                if self._indexes.get(key) is index:
+                    self._versions[key] = self._version(file_path)
+
+    def _defer(self, key, added=(), discarded=()):
+        """Queue updates of a persisted index, saved together by flush() after save_delay seconds"""
+        if self.path is None:
+            return
+        with self._lock:
+            pending_added, pending_discarded = self._pending.setdefault(key, (set(), set()))
+            pending_added.update(added)
+            pending_added.difference_update(discarded)
+            pending_discarded.update(discarded)
+            pending_discarded.difference_update(added)
+            if self._timer is None:
+                self._timer = threading.Timer(self.save_delay, self.flush)
+                self._timer.daemon = True
+                self._timer.start()
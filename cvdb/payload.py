@@ -0,0 +1,198 @@
+# Copyright 2021 The Johns Hopkins University Applied Physics Laboratory
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import struct
+import threading
+
+import blosc
+import numpy as np
+
+from .error import CVDBError, ErrorCodes
+
+"""
+.. module:: payload
+    :synopsis: Blosc serialized TZYX payloads assembled from blocks compressed independently.
+"""
+
+# Size of the blosc header, and of the header plus the block offsets of a buffer holding a single block
+HEADER_BYTES = 16
+SINGLE_BLOCK_BYTES = HEADER_BYTES + 4
+
+# Flag set in the header of buffers stored uncompressed
+MEMCPYED = 0x02
+
+# Smallest block worth compressing on its own. Regions with smaller z planes are compressed whole
+MIN_BLOCK_BYTES = 32 * 2 ** 10
+
+# Automatic blosc block size for each (cname, clevel, shuffle, typesize)
+_auto_blocksizes = {}
+_auto_lock = threading.Lock()
+
+
+def auto_blocksize(typesize, clevel, shuffle, cname):
+    """Get the block size blosc picks for large buffers compressed with some settings
+
+    Args:
+        typesize (int): Bytes per item
+        clevel (int): Compression level
+        shuffle (int): blosc.NOSHUFFLE, blosc.SHUFFLE or blosc.BITSHUFFLE
+        cname (str): Codec name
+
+    Returns:
+        (int): Block size in bytes
+    """
+    key = (cname, clevel, shuffle, typesize)
+    with _auto_lock:
+        if key not in _auto_blocksizes:
+            probe = blosc.compress(bytes(8 * 2 ** 20), typesize=typesize, clevel=clevel, shuffle=shuffle, cname=cname)
+            _auto_blocksizes[key] = struct.unpack("<i", probe[8:12])[0]
+        return _auto_blocksizes[key]
+
+
+class BloscPayload:
+    """A blosc buffer of a TZYX array built a few z planes at a time.
+
+    blosc splits a buffer into blocks that are compressed independently, and its header lists where each block
+    starts. A buffer holding exactly one block is a compressed block plus a header, so compressing every block of the
+    array as a buffer of its own, in any order and on any thread, and then concatenating the blocks behind a new
+    header gives the buffer blosc.compress() would build from the whole array. Blocks are whole rows of a z plane,
+    sized so blosc keeps each one as a single block, and the full array never has to exist in memory. Used by
+    CloudVolumeDB.cutout_compressed(). Planes only compress in parallel if blosc releases the GIL, see
+    cvdb.config.configure_blosc().
+
+    blosc.decompress() of the payload returns the bytes of the C ordered TZYX array.
+
+    Args:
+        shape ((int, int, int, int)): TZYX shape of the array
+        dtype (numpy.dtype): Datatype of the array
+        clevel (int): Compression level
+        shuffle (int): blosc.NOSHUFFLE, blosc.SHUFFLE or blosc.BITSHUFFLE
+        cname (str): Codec name
+
+    Attributes:
+        rows (int): Rows of a z plane held by each block
+
+    Raises:
+        (CVDBError): If the array is too large for a single blosc buffer, or its z planes too small, see supported()
+    """
+    def __init__(self, shape, dtype, clevel=9, shuffle=blosc.SHUFFLE, cname="blosclz"):
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        self.clevel = clevel
+        self.shuffle = shuffle
+        self.cname = cname
+
+        self.rows = self.block_rows(self.shape, self.dtype, clevel, shuffle, cname)
+        if self.rows is None:
+            raise CVDBError("Region of shape {} can't be compressed block by block.".format(self.shape),
+                            ErrorCodes.SERIALIZATION_ERROR)
+        self.blocksize = self.rows * self.shape[3] * self.dtype.itemsize
+        self.groups = self.shape[2] // self.rows
+        self._blocks = [None] * (self.shape[0] * self.shape[1] * self.groups)
+
+    @staticmethod
+    def block_rows(shape, dtype, clevel=9, shuffle=blosc.SHUFFLE, cname="blosclz"):
+        """Find how many rows of a z plane go in each block
+
+        Args:
+            shape ((int, int, int, int)): TZYX shape of the array
+            dtype (numpy.dtype): Datatype of the array
+            clevel (int): Compression level
+            shuffle (int): blosc.NOSHUFFLE, blosc.SHUFFLE or blosc.BITSHUFFLE
+            cname (str): Codec name
+
+        Returns:
+            (int|None): The largest number of rows dividing the plane that fits in one blosc block. None if the array
+            can't be built block by block
+        """
+        itemsize = np.dtype(dtype).itemsize
+        row_bytes = shape[3] * itemsize
+        if int(np.prod(shape)) * itemsize > blosc.MAX_BUFFERSIZE or shape[2] * row_bytes < MIN_BLOCK_BYTES:
+            return None
+
+        limit = auto_blocksize(itemsize, clevel, shuffle, cname)
+        rows = [r for r in range(1, shape[2] + 1) if shape[2] % r == 0 and r * row_bytes <= limit]
+        if not rows or rows[-1] * row_bytes < MIN_BLOCK_BYTES:
+            return None
+        return rows[-1]
+
+    @classmethod
+    def supported(cls, shape, dtype, clevel=9, shuffle=blosc.SHUFFLE, cname="blosclz"):
+        """Check if an array can be built block by block
+
+        Args:
+            shape ((int, int, int, int)): TZYX shape of the array
+            dtype (numpy.dtype): Datatype of the array
+            clevel (int): Compression level
+            shuffle (int): blosc.NOSHUFFLE, blosc.SHUFFLE or blosc.BITSHUFFLE
+            cname (str): Codec name
+
+        Returns:
+            (bool)
+        """
+        return cls.block_rows(shape, dtype, clevel, shuffle, cname) is not None
+
+    def add_plane(self, t_index, z_index, plane):
+        """Compress a z plane of the array. Planes may be added in any order and from several threads
+
+        Args:
+            t_index (int): Index into the time axis of the array
+            z_index (int): Index into the z axis of the array
+            plane (numpy.ndarray): C contiguous YX data of the plane
+
+        Returns:
+            None
+        """
+        first = (t_index * self.shape[1] + z_index) * self.groups
+        for group in range(self.groups):
+            rows = plane[group * self.rows:(group + 1) * self.rows]
+            self._blocks[first + group] = blosc.compress(rows, typesize=self.dtype.itemsize, clevel=self.clevel,
+                                                         shuffle=self.shuffle, cname=self.cname)
+
+    def getvalue(self):
+        """Assemble the blosc buffer. Every plane must have been added
+
+        Returns:
+            (bytes)
+
+        Raises:
+            (CVDBError): If a plane is missing
+        """
+        if any(block is None for block in self._blocks):
+            raise CVDBError("Blosc payload is missing planes.", ErrorCodes.SERIALIZATION_ERROR)
+
+        first = self._blocks[0]
+        nbytes = len(self._blocks) * self.blocksize
+        if all(block[2] & MEMCPYED for block in self._blocks):
+            # Nothing compressed, so store the data raw like blosc does with incompressible buffers
+            header = first[:4] + struct.pack("<iii", nbytes, self.blocksize, nbytes + HEADER_BYTES)
+            return b"".join([header] + [memoryview(block)[HEADER_BYTES:] for block in self._blocks])
+
+        single = all(block[2] == first[2] and not block[2] & MEMCPYED and
+                     struct.unpack("<i", block[8:12])[0] == self.blocksize for block in self._blocks)
+        if not single:
+            # Some blocks are stored raw, which only a whole buffer can flag, so compress it whole
+            raw = b"".join(blosc.decompress(block) for block in self._blocks)
+            return blosc.compress(raw, typesize=self.dtype.itemsize, clevel=self.clevel, shuffle=self.shuffle,
+                                  cname=self.cname)
+
+        offsets = []
+        position = HEADER_BYTES + 4 * len(self._blocks)
+        for block in self._blocks:
+            offsets.append(position)
+            position += len(block) - SINGLE_BLOCK_BYTES
+
+        header = first[:4] + struct.pack("<iii", nbytes, self.blocksize, position)
+        return b"".join([header, struct.pack("<{}i".format(len(offsets)), *offsets)] +
+                        [memoryview(block)[SINGLE_BLOCK_BYTES:] for block in self._blocks])
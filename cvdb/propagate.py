@@ -0,0 +1,266 @@
+# Copyright 2021 The Johns Hopkins University Applied Physics Laboratory
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from .chunks import ChunkGrid, ChunkReader, ChunkWriter
+from .downsample import read_pooled
+from .error import CVDBError
+
+"""
+.. module:: propagate
+    :synopsis: Rebuilds the coarser mips of a channel after writes, one dirty chunk at a time.
+"""
+
+# Number of coarser chunks rebuilt concurrently. Each one reads its source chunks with the channel's parallelism
+DEFAULT_PARALLEL = 4
+
+# Values of Channel.downsample_status, as used by the Boss
+NOT_DOWNSAMPLED = "NOT_DOWNSAMPLED"
+IN_PROGRESS = "IN_PROGRESS"
+DOWNSAMPLED = "DOWNSAMPLED"
+FAILED = "FAILED"
+
+
+def pooling_factor(source_dims, target_dims):
+    """Get the xyz pooling factor between two voxel sizes
+
+    Args:
+        source_dims (list(int)): xyz voxel size of the finer level
+        target_dims (list(int)): xyz voxel size of the coarser level
+
+    Returns:
+        (tuple(int, int, int))
+    """
+    return tuple(int(target_dims[d] // source_dims[d]) for d in range(3))
+
+
+def target_indices(source, target, factor, indices):
+    """Find the chunks of a coarser mip that cover chunks of a finer one
+
+    Args:
+        source (cvdb.chunks.ChunkGrid): Chunk layout of the finer mip
+        target (cvdb.chunks.ChunkGrid): Chunk layout of the coarser mip
+        factor ((int, int, int)): xyz pooling factor between them
+        indices (iterable(tuple(int, int, int))): grid indices of chunks of the finer mip
+
+    Returns:
+        (list(tuple(int, int, int))): grid indices of the coarser mip, each listed once
+    """
+    result = {}
+    for index in indices:
+        start, stop = source.chunk_bounds(index)
+        corner = [start[d] // factor[d] for d in range(3)]
+        extent = [-(-stop[d] // factor[d]) - corner[d] for d in range(3)]
+        result.update(dict.fromkeys(target.indices(corner, extent)))
+    return list(result)
+
+
+class Propagator:
+    """Rebuilds the coarser mips of channels after writes, recomputing only the chunks covering dirty chunks.
+
+    Writes are marked dirty with mark() or mark_region() and propagated by flush(), so several writes to the same
+    area rebuild each coarser chunk once. The hierarchy follows get_downsampled_voxel_dims(): each resolution is
+    pooled from the one below it (by 2x2x1 or 2x2x2), and the isotropic scales of anisotropic channels are pooled
+    from the level below them too, when the volume has them. Image channels are mean pooled and annotation channels
+    mode pooled. Sources are read and targets written through the authenticated endpoint, so the rebuild never sees
+    stale reads of the public HTTPS one.
+
+    The downsample_status of the resource's channel object follows the hierarchy: mark() sets it to NOT_DOWNSAMPLED,
+    and flush() to IN_PROGRESS while it rebuilds the channel, then DOWNSAMPLED or FAILED. Only the in-memory channel is
+    updated, so callers that keep the status elsewhere, e.g. in the Boss, must save it themselves.
+
+    Args:
+        db (cvdb.cloudvolumedb.CloudVolumeDB): Gives access to the channels' volumes and caches
+        parallel (int): Number of coarser chunks rebuilt concurrently
+
+    Attributes:
+        rebuilt (int): Number of chunks rebuilt since the Propagator was created
+    """
+    def __init__(self, db, parallel=DEFAULT_PARALLEL):
+        self.db = db
+        self.parallel = parallel
+        self.rebuilt = 0
+
+        # (bucket, cv_path, time_sample) -> (resource, {mip: set of dirty grid indices})
+        self._dirty = {}
+        self._lock = threading.Lock()
+
+    def schedule(self, resource):
+        """Get the steps that rebuild a channel's hierarchy, in the order they must run
+
+        Args:
+            resource (spdb.project.BossResource): Data model info based on the request or target resource
+
+        Returns:
+            (list(tuple(int, int, tuple(int, int, int)))): source mip, target mip and xyz pooling factor of each step.
+            Levels missing from the volume are left out
+        """
+        aniso_dims = resource.get_downsampled_voxel_dims(iso=False)
+        iso_dims = resource.get_downsampled_voxel_dims(iso=True)
+        meta = self.db.get_volume(resource.get_channel(), 0).meta
+
+        # The anisotropic hierarchy is stored as consecutive mips, up to the first missing (or mismatched) scale
+        steps = []
+        for res in range(1, min(len(aniso_dims), len(meta.scales))):
+            scale = np.array(meta.resolution(res)) / np.array(meta.resolution(0))
+            if not np.allclose(scale, np.array(aniso_dims[res]) / np.array(aniso_dims[0])):
+                break
+            steps.append((res - 1, res, pooling_factor(aniso_dims[res - 1], aniso_dims[res])))
+
+        # Isotropic versions above the isotropic level are separate scales, each pooled from the one below
+        for res in range(1, len(iso_dims)):
+            if iso_dims[res] == aniso_dims[res]:
+                continue
+            source = self.db.find_iso_mip(resource, res - 1)
+            target = self.db.find_iso_mip(resource, res)
+            if source is not None and target is not None:
+                steps.append((source, target, pooling_factor(iso_dims[res - 1], iso_dims[res])))
+        return steps
+
+    def mark(self, resource, resolution, indices, time_sample=0):
+        """Mark chunks of a mip as written, so flush() rebuilds the coarser chunks covering them
+
+        Args:
+            resource (spdb.project.BossResource): Data model info based on the request or target resource
+            resolution (int): the mip of the volume
+            indices (iterable(tuple(int, int, int))): grid indices of the written chunks
+            time_sample (int): Time sample selecting the per-time layer. See CloudVolumeDB.get_volume()
+
+        Returns:
+            None
+        """
+        channel = resource.get_channel()
+        with self._lock:
+            _, dirty = self._dirty.setdefault((channel.bucket, channel.cv_path, time_sample), (resource, {}))
+            dirty.setdefault(resolution, set()).update(tuple(index) for index in indices)
+        channel.downsample_status = NOT_DOWNSAMPLED
+
+    def mark_region(self, resource, resolution, corner, extent, time_sample_start=0, num_time_samples=1):
+        """Mark a written region of a mip, e.g. one written by another tool
+
+        Args:
+            resource (spdb.project.BossResource): Data model info based on the request or target resource
+            resolution (int): the mip of the volume
+            corner ((int, int, int)): the xyz location of the corner of the region
+            extent ((int, int, int)): the xyz extents of the region
+            time_sample_start (int): First time sample written
+            num_time_samples (int): Number of time samples written
+
+        Returns:
+            None
+
+        Raises:
+            (CVDBError)
+        """
+        time_samples = range(time_sample_start, time_sample_start + num_time_samples)
+        for vol, time_channels in self.db.get_time_layout(resource.get_channel(), resolution, time_samples):
+            layer_time_sample = 0 if vol.meta.num_channels > 1 else time_samples[time_channels[0][0]]
+            self.mark(resource, resolution, ChunkGrid(vol).indices(corner, extent), layer_time_sample)
+
+    def flush(self):
+        """Rebuild the coarser chunks covering every dirty chunk, level by level
+
+        If a rebuild fails, the channels that weren't finished stay dirty for the next flush.
+
+        Returns:
+            (int): Number of chunks rebuilt
+
+        Raises:
+            (CVDBError)
+        """
+        with self._lock:
+            pending, self._dirty = self._dirty, {}
+
+        rebuilt = 0
+        try:
+            while pending:
+                key, (resource, dirty) = next(iter(pending.items()))
+                resource.get_channel().downsample_status = IN_PROGRESS
+                for source, target, factor in self.schedule(resource):
+                    if dirty.get(source):
+                        written = self.rebuild(resource, source, target, factor, dirty[source], key[2])
+                        dirty.setdefault(target, set()).update(written)
+                        rebuilt += len(written)
+                del pending[key]
+                # Other time samples of the channel may still be waiting
+                if not any(other[:2] == key[:2] for other in pending):
+                    resource.get_channel().downsample_status = DOWNSAMPLED
+        except Exception:
+            resource.get_channel().downsample_status = FAILED
+            with self._lock:
+                for key, (resource, dirty) in pending.items():
+                    _, current = self._dirty.setdefault(key, (resource, {}))
+                    for mip, indices in dirty.items():
+                        current.setdefault(mip, set()).update(indices)
+            raise
+        return rebuilt
+
+    def rebuild(self, resource, source, target, factor, indices, time_sample=0):
+        """Rebuild the chunks of a mip that cover chunks of the mip below it
+
+        Args:
+            resource (spdb.project.BossResource): Data model info based on the request or target resource
+            source (int): the mip pooled
+            target (int): the mip rebuilt
+            factor ((int, int, int)): xyz pooling factor between the mips
+            indices (iterable(tuple(int, int, int))): grid indices of the changed chunks of source
+            time_sample (int): Time sample selecting the per-time layer. See CloudVolumeDB.get_volume()
+
+        Returns:
+            (list(tuple(int, int, int))): grid indices of the rebuilt chunks of target
+
+        Raises:
+            (CVDBError)
+        """
+        channel = resource.get_channel()
+        method = "mean" if channel.is_image() else "mode"
+        parallel = self.db.config.settings(channel)["parallel"]
+        reader = ChunkReader(self.db.get_volume(channel, source, writable=True, time_sample=time_sample),
+                             parallel=parallel, populate=False, channels=True)
+        writer = ChunkWriter(self.db.get_volume(channel, target, writable=True, time_sample=time_sample),
+                             parallel=parallel)
+        targets = target_indices(reader.grid, writer.grid, factor, indices)
+        num_channels = writer.grid.num_channels
+
+        def build(index):
+            start, stop = writer.grid.chunk_bounds(index)
+            corner = tuple(max(start[d] * factor[d], reader.grid.voxel_offset[d]) for d in range(3))
+            extent = tuple(min(stop[d] * factor[d], reader.grid.bounds_max[d]) - corner[d] for d in range(3))
+
+            # Chunks whose source is gone are written as zeros, so stale data doesn't survive in coarser mips
+            data = np.zeros([num_channels, stop[2] - start[2], stop[1] - start[1], stop[0] - start[0]],
+                            dtype=writer.grid.dtype)
+            pooled = read_pooled(reader, corner, extent, factor, method, num_channels)
+            if pooled is not None:
+                _, z, y, x = (min(a, b) for a, b in zip(data.shape, pooled.shape))
+                data[:, :z, :y, :x] = pooled[:, :z, :y, :x]
+            writer.upload(index, data.T)
+
+        try:
+            with ThreadPoolExecutor(max_workers=max(1, min(self.parallel, len(targets)))) as pool:
+                for _ in pool.map(build, targets):
+                    pass
+        except CVDBError:
+            raise
+        except Exception as e:
+            raise CVDBError(f"Error propagating mip {source} to mip {target}: {e}")
+
+        self.db.record_written(channel, target, targets, time_sample)
+        with self._lock:
+            self.rebuilt += len(targets)
+        return targets
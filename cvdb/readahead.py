@@ -0,0 +1,248 @@
+# Copyright 2021 The Johns Hopkins University Applied Physics Laboratory
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import copy
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from .chunkcache import ChunkCache
+from .error import logger
+
+"""
+.. module:: readahead
+    :synopsis: Detects sequential cutouts and prefetches the chunks of the next region in the background.
+"""
+
+# Byte budget of chunks prefetched but not yet read
+DEFAULT_MAX_BYTES = 256 * 2 ** 20
+
+# Number of threads downloading prefetched chunks
+DEFAULT_PARALLEL = 4
+
+# Number of regions ahead of the last cutout that are prefetched
+DEFAULT_DEPTH = 1
+
+# Number of access streams tracked at once. The least recently active stream is forgotten first
+DEFAULT_MAX_STREAMS = 1024
+
+
+class ReadAhead:
+    """Read-ahead engine for sequential cutouts, such as z-stack walks or x/y panning.
+
+    Cutouts are grouped into streams by (volume, mip, client key). When a stream makes two consecutive moves by
+    the same offset with the same extent, the chunks of the next `depth` regions along that offset are downloaded
+    on a background pool. Prefetched chunks wait in a buffer with its own byte budget and are handed to the reader
+    that asks for them, moving into the regular chunk cache. Chunks evicted from the buffer before anyone read them
+    are counted as wasted.
+
+    Args:
+        max_bytes (int): Byte budget of the prefetch buffer
+        parallel (int): Number of threads downloading prefetched chunks
+        depth (int): Number of regions ahead that are prefetched
+        max_streams (int): Number of access streams tracked at once
+
+    Attributes:
+        scheduled (int): Number of chunks queued for prefetching
+        prefetched (int): Number of chunks downloaded by the read-ahead
+        prefetched_bytes (int): Decoded size of the prefetched chunks
+        used (int): Number of prefetched chunks that were read
+        used_bytes (int): Decoded size of the prefetched chunks that were read
+    """
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES, parallel=DEFAULT_PARALLEL, depth=DEFAULT_DEPTH,
+                 max_streams=DEFAULT_MAX_STREAMS):
+        self.depth = depth
+        self.max_streams = max_streams
+        self.max_pending = 4 * parallel * depth
+
+        self.scheduled = 0
+        self.prefetched = 0
+        self.prefetched_bytes = 0
+        self.used = 0
+        self.used_bytes = 0
+
+        self._buffer = ChunkCache(max_bytes)
+        self._pool = ThreadPoolExecutor(max_workers=parallel, thread_name_prefix="cvdb-readahead")
+        self._streams = OrderedDict()
+        self._pending = set()
+        self._closed = False
+        self._lock = threading.Lock()
+
+        # Bumped by invalidate(), so prefetches that started before a write don't buffer what they read
+        self._generation = 0
+
+    def take(self, key):
+        """Hand over a prefetched chunk, removing it from the buffer
+
+        Args:
+            key (tuple): Chunk cache key of the chunk
+
+        Returns:
+            (numpy.ndarray|None): The decoded chunk, None if it was not prefetched
+        """
+        data = self._buffer.pop(key)
+        if data is not None:
+            with self._lock:
+                self.used += 1
+                self.used_bytes += data.nbytes
+        return data
+
+    def observe(self, reader, client_key, corner, extent):
+        """Record a cutout and prefetch the regions that come next if the stream moves sequentially
+
+        Args:
+            reader (cvdb.chunks.ChunkReader): Reader of the cutout, used for the prefetch downloads
+            client_key (hashable): Separates the streams of different clients of the same volume
+            corner ((int, int, int)): the xyz location of the corner of the cutout
+            extent ((int, int, int)): the xyz extents of the cutout
+
+        Returns:
+            (int): Number of chunks queued for prefetching
+        """
+        stream_key = (reader.cloudpath, reader.grid.mip, client_key)
+        corner = tuple(corner)
+        extent = tuple(extent)
+
+        with self._lock:
+            last = self._streams.pop(stream_key, None)
+            step = None
+            if last is not None and last[1] == extent:
+                step = tuple(corner[d] - last[0][d] for d in range(3))
+                if not any(step):
+                    step = None
+            self._streams[stream_key] = (corner, extent, step)
+            while len(self._streams) > self.max_streams:
+                self._streams.popitem(last=False)
+
+        if step is None or last[2] != step:
+            return 0
+
+        indices = []
+        for k in range(1, self.depth + 1):
+            ahead = tuple(corner[d] + k * step[d] for d in range(3))
+            indices.extend(reader.grid.indices(ahead, extent))
+        return self.schedule(reader, indices)
+
+    def schedule(self, reader, indices):
+        """Queue chunks for prefetching, skipping those already cached, buffered or queued
+
+        Args:
+            reader (cvdb.chunks.ChunkReader): Reader used for the downloads
+            indices (iterable(tuple(int, int, int))): grid indices of the chunks
+
+        Returns:
+            (int): Number of chunks queued
+        """
+        if reader.trace is not None:
+            # Prefetches finish after the cutout that queued them, so keep them out of its trace
+            reader = copy.copy(reader)
+            reader.trace = None
+
+        count = 0
+        for index in dict.fromkeys(indices):
+            key = ChunkCache.make_key(reader.cloudpath, reader.grid.mip, index)
+            if key in self._buffer or (reader.cache is not None and key in reader.cache):
+                continue
+            with self._lock:
+                if self._closed or key in self._pending or len(self._pending) >= self.max_pending:
+                    continue
+                self._pending.add(key)
+                self.scheduled += 1
+                generation = self._generation
+            self._pool.submit(self._prefetch, reader, index, key, generation)
+            count += 1
+        return count
+
+    def _prefetch(self, reader, index, key, generation):
+        """Download a chunk into the buffer. Runs on the read-ahead pool"""
+        try:
+            # Share the download with readers asking for the chunk meanwhile
+            data = reader.coalesce(index, reader.download, index)
+            if data is not None:
+                with self._lock:
+                    if generation != self._generation:
+                        # Chunks were invalidated during the download, which may have read stale data
+                        return
+                    self._buffer.put(key, data)
+                    self.prefetched += 1
+                    self.prefetched_bytes += data.nbytes
+        except Exception as e:
+            # A failed prefetch only costs the reader a regular download later
+            logger("ReadAhead").warning("Prefetch of {} failed: {}".format(key, e))
+        finally:
+            with self._lock:
+                self._pending.discard(key)
+
+    def invalidate(self, cloudpath=None, mip=None, indices=None):
+        """Drop buffered chunks, e.g. after they were written, and discard prefetches still downloading
+
+        Arguments that are None match everything. Chunks downsampled on the fly from mip are dropped too.
+
+        Args:
+            cloudpath (str): Only drop chunks of this volume
+            mip (int): Only drop chunks of this resolution level
+            indices (iterable(tuple(int, int, int))): Only drop these grid indices
+
+        Returns:
+            (int): Number of buffered chunks dropped
+        """
+        with self._lock:
+            self._generation += 1
+            return self._buffer.invalidate(cloudpath, mip, indices, derived=True)
+
+    def clear(self):
+        """Drop buffered chunks and forget every stream
+
+        Returns:
+            None
+        """
+        self._buffer.clear()
+        with self._lock:
+            self._streams.clear()
+
+    def stats(self):
+        """Snapshot of the read-ahead counters
+
+        wasted counts prefetched chunks evicted from the buffer before being read.
+
+        Returns:
+            (dict)
+        """
+        with self._lock:
+            return {
+                "streams": len(self._streams),
+                "pending": len(self._pending),
+                "scheduled": self.scheduled,
+                "prefetched": self.prefetched,
+                "prefetched_bytes": self.prefetched_bytes,
+                "used": self.used,
+                "used_bytes": self.used_bytes,
+                "wasted": self._buffer.evictions,
+                "buffered_bytes": self._buffer.nbytes,
+                "max_bytes": self._buffer.max_bytes,
+                "use_rate": self.used / self.prefetched if self.prefetched else 0.0,
+            }
+
+    def shutdown(self, wait=True):
+        """Stop the prefetch pool. Buffered chunks can still be taken, but nothing new is prefetched
+
+        Args:
+            wait (bool): If True, wait for queued prefetches to finish
+
+        Returns:
+            None
+        """
+        with self._lock:
+            self._closed = True
+        self._pool.shutdown(wait=wait)
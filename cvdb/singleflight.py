@@ -0,0 +1,124 @@
+# Copyright 2021 The Johns Hopkins University Applied Physics Laboratory
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import threading
+from concurrent.futures import Future
+
+"""
+.. module:: singleflight
+    :synopsis: Coalesces concurrent fetches of the same chunk into a single download.
+"""
+
+
+class SingleFlight:
+    """Runs at most one fetch per key at a time, handing its result to every concurrent caller.
+
+    The first caller for a key becomes the leader and does the work. Callers arriving while it is in flight wait
+    on the leader's future instead of issuing their own download, and get the same result or exception. The key
+    is forgotten as soon as the leader finishes, so later callers go back to the caches.
+
+    Attributes:
+        fetches (int): Number of fetches actually run
+        saved (int): Number of callers served by a fetch already in flight
+    """
+    def __init__(self):
+        self.fetches = 0
+        self.saved = 0
+
+        self._flights = {}
+        self._lock = threading.Lock()
+
+    def claim(self, key):
+        """Join the fetch in flight for a key, or become its leader
+
+        A leader must call finish() with the same key and future once the fetch is done, even if it fails.
+
+        Args:
+            key (hashable): Identifies the fetch
+
+        Returns:
+            (tuple(concurrent.futures.Future, bool)): Future of the fetch and whether the caller is the leader
+        """
+        with self._lock:
+            future = self._flights.get(key)
+            if future is not None:
+                self.saved += 1
+                return future, False
+
+            future = Future()
+            self._flights[key] = future
+            self.fetches += 1
+            return future, True
+
+    def finish(self, key, future, result=None, error=None):
+        """Publish the outcome of a fetch to its waiters and forget the key
+
+        Args:
+            key (hashable): Identifies the fetch
+            future (concurrent.futures.Future): Future returned by claim()
+            result: Result of the fetch
+            error (BaseException): Exception raised by the fetch, if it failed
+
+        Returns:
+            None
+        """
+        with self._lock:
+            if self._flights.get(key) is future:
+                del self._flights[key]
+
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+
+    def do(self, key, func, *args):
+        """Run func unless a call with the same key is in flight, in which case wait for that call's result
+
+        Args:
+            key (hashable): Identifies the fetch
+            func (callable): The fetch
+            *args: Arguments to func
+
+        Returns:
+            The result of func
+        """
+        future, leader = self.claim(key)
+        if not leader:
+            return future.result()
+
+        try:
+            result = func(*args)
+        except BaseException as e:
+            self.finish(key, future, error=e)
+            raise
+        self.finish(key, future, result)
+        return result
+
+    def stats(self):
+        """Snapshot of the coalescing counters
+
+        Returns:
+            (dict)
+        """
+        with self._lock:
+            requests = self.fetches + self.saved
+            return {
+                "in_flight": len(self._flights),
+                "fetches": self.fetches,
+                "saved": self.saved,
+                "saved_rate": self.saved / requests if requests else 0.0,
+            }
+
+    def __len__(self):
+        return len(self._flights)
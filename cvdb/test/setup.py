@@ -16,9 +16,9 @@ from cloudvolume import CloudVolume
 from cvdb.project import BossResourceBasic
 
 
-def create_new_cloudvolume(resource, chunksize):
+def get_cloudvolume_info(resource, chunksize, num_channels=1, encoding="raw"):
     """
-    Creates a new cloudvolume resource in S3 for testing purposes.
+    Builds the info of a cloudvolume matching a resource's coordinate frame and datatype.
     """
     channel = resource.get_channel()
     coord_frame = resource.get_coord_frame()
@@ -27,11 +27,11 @@ def create_new_cloudvolume(resource, chunksize):
         coord_frame.y_stop - coord_frame.y_start,
         coord_frame.z_stop - coord_frame.z_start,
     ]
-    info = CloudVolume.create_new_info(
-        num_channels=1,
+    return CloudVolume.create_new_info(
+        num_channels=num_channels,
         layer_type="image" if channel.type == "image" else "segmentation",
         data_type=channel.datatype,
-        encoding="raw",
+        encoding=encoding,
         resolution=[
             coord_frame.x_voxel_size,
             coord_frame.y_voxel_size,
@@ -42,8 +42,39 @@ def create_new_cloudvolume(resource, chunksize):
         volume_size=extents,
     )
 
+
+def create_new_cloudvolume(resource, chunksize):
+    """
+    Creates a new cloudvolume resource in S3 for testing purposes.
+    """
+    channel = resource.get_channel()
+    vol = CloudVolume(
+        f"s3://{channel.bucket}/{channel.cv_path}",
+        info=get_cloudvolume_info(resource, chunksize),
+        fill_missing=True,
+    )
+    vol.commit_info()
+    return vol
+
+
+def open_local_volume(bucket, cv_path, mip, options):
+    """
+    Handle factory for VolumeHandleCache that maps a channel's bucket to a local directory.
+    """
+    options.pop("use_https", None)
+    options.pop("path_template", None)
+    return CloudVolume(f"file://{bucket}/{cv_path}", mip=mip, **options)
+
+
+def create_local_cloudvolume(resource, chunksize, num_channels=1, encoding="raw"):
+    """
+    Creates a new cloudvolume resource on the local filesystem, treating the channel's bucket as a directory.
+    """
+    channel = resource.get_channel()
     vol = CloudVolume(
-        f"s3://{channel.bucket}/{channel.cv_path}", info=info, fill_missing=True
+        f"file://{channel.bucket}/{channel.cv_path}",
+        info=get_cloudvolume_info(resource, chunksize, num_channels, encoding),
+        fill_missing=True,
     )
     vol.commit_info()
     return vol
@@ -0,0 +1,146 @@
+# Copyright 2021 The Johns Hopkins University Applied Physics Laboratory
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from cvdb import AsyncReadPool, CloudVolumeDB, ChunkCache, CVDBError, ImageCube8, VolumeHandleCache
+from cvdb.project import BossResourceBasic
+from cvdb.project.test.resource_setup import get_anno_dict, get_image_dict
+from .setup import create_local_cloudvolume, open_local_volume
+
+
+class TestCutoutAsync(unittest.TestCase):
+
+    CHUNKSIZE = (64, 64, 8)
+
+    @classmethod
+    def setUpClass(cls):
+        """Create a local precomputed volume standing in for S3"""
+        cls.bucket = tempfile.mkdtemp()
+        data = get_image_dict(storage_type="cloudvol")
+        data["channel"]["bucket"] = cls.bucket
+        data["coord_frame"]["x_stop"] = 200
+        data["coord_frame"]["y_stop"] = 160
+        data["coord_frame"]["z_stop"] = 20
+        cls.resource = BossResourceBasic(data)
+
+        cls.vol = create_local_cloudvolume(cls.resource, cls.CHUNKSIZE)
+        cls.data = np.random.randint(1, 254, size=(200, 160, 20), dtype=np.uint8)
+        cls.vol[:, :, :] = cls.data
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.bucket)
+
+    def setUp(self):
+        self.pool = AsyncReadPool(io_threads=4, decode_threads=2, channel_concurrency=3)
+        self.db = CloudVolumeDB(handle_cache=VolumeHandleCache(factory=open_local_volume),
+                                chunk_cache=ChunkCache(), async_pool=self.pool)
+
+    def tearDown(self):
+        self.pool.shutdown()
+
+    def test_matches_cutout(self):
+        """cutout_async returns the same cube as cutout"""
+        corner, extent = (30, 50, 5), (150, 100, 12)
+        cube = asyncio.run(self.db.cutout_async(self.resource, corner, extent, 0, access_mode="no_cache"))
+
+        self.assertIsInstance(cube, ImageCube8)
+        np.testing.assert_array_equal(cube.data, self.db.cutout(self.resource, corner, extent, 0).data)
+        np.testing.assert_array_equal(cube.data[0], self.data[30:180, 50:150, 5:17].T)
+
+    def test_concurrent_requests(self):
+        """Many requests share the pools and each gets its own region"""
+        regions = [((x, y, z), (40, 30, 6)) for x in (0, 70, 150) for y in (0, 90) for z in (0, 9)]
+
+        async def run():
+            return await asyncio.gather(*[self.db.cutout_async(self.resource, corner, extent, 0)
+                                          for corner, extent in regions])
+
+        for (corner, extent), cube in zip(regions, asyncio.run(run())):
+            np.testing.assert_array_equal(
+                cube.data[0],
+                self.data[corner[0]:corner[0] + extent[0],
+                          corner[1]:corner[1] + extent[1],
+                          corner[2]:corner[2] + extent[2]].T)
+
+    def test_out_of_bounds(self):
+        """Errors surface as CVDBError from the coroutine"""
+        with self.assertRaises(CVDBError):
+            asyncio.run(self.db.cutout_async(self.resource, (150, 0, 0), self.CHUNKSIZE, 0))
+
+
+class TestCutoutAsyncSources(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        """Create a two time sample image volume and an annotation volume, both holding resolution 0 only"""
+        cls.bucket = tempfile.mkdtemp()
+        cls.image_resource = cls.get_resource(get_image_dict(storage_type="cloudvol"), "col1/exp1/image")
+        vol = create_local_cloudvolume(cls.image_resource, (64, 64, 8), num_channels=2)
+        vol[:, :, :] = np.random.randint(1, 254, size=(128, 128, 16, 2), dtype=np.uint8)
+
+        cls.anno_resource = cls.get_resource(get_anno_dict(storage_type="cloudvol"), "col1/exp1/anno")
+        vol = create_local_cloudvolume(cls.anno_resource, (64, 64, 8))
+        vol[:, :, :] = np.random.randint(1, 6, size=(128, 128, 16)).astype(np.uint64)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.bucket)
+
+    @classmethod
+    def get_resource(cls, data, cv_path):
+        data["channel"]["bucket"] = cls.bucket
+        data["channel"]["cv_path"] = cv_path
+        data["coord_frame"]["x_stop"] = 128
+        data["coord_frame"]["y_stop"] = 128
+        data["coord_frame"]["z_stop"] = 16
+        return BossResourceBasic(data)
+
+    def setUp(self):
+        self.pool = AsyncReadPool(io_threads=4, decode_threads=2)
+        self.db = CloudVolumeDB(handle_cache=VolumeHandleCache(factory=open_local_volume),
+                                chunk_cache=ChunkCache(), async_pool=self.pool)
+
+    def tearDown(self):
+        self.pool.shutdown()
+
+    def assert_matches_cutout(self, resource, corner, extent, resolution, **kwargs):
+        cube = asyncio.run(self.db.cutout_async(resource, corner, extent, resolution, **kwargs))
+        np.testing.assert_array_equal(cube.data, self.db.cutout(resource, corner, extent, resolution, **kwargs).data)
+        return cube
+
+    def test_time_range(self):
+        """Every requested time sample is read"""
+        cube = self.assert_matches_cutout(self.image_resource, (5, 10, 3), (100, 90, 10), 0, time_sample_range=[0, 2])
+        self.assertEqual(cube.data.shape, (2, 10, 90, 100))
+        self.assertTrue(cube.data[1].all())
+
+    def test_filter_ids(self):
+        """Voxels not labeled with the IDs are zero"""
+        cube = self.assert_matches_cutout(self.anno_resource, (5, 10, 3), (100, 90, 10), 0, filter_ids=[2, 4])
+        self.assertTrue(np.isin(cube.data, [0, 2, 4]).all())
+
+        with self.assertRaises(CVDBError):
+            asyncio.run(self.db.cutout_async(self.image_resource, (0, 0, 0), (64, 64, 8), 0, filter_ids=[1]))
+
+    def test_missing_level(self):
+        """Resolutions missing from the volume are synthesized from a finer one"""
+        cube = self.assert_matches_cutout(self.image_resource, (3, 5, 2), (50, 40, 12), 1)
+        self.assertTrue(cube.data.all())
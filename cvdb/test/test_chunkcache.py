@@ -0,0 +1,96 @@
+# Copyright 2021 The Johns Hopkins University Applied Physics Laboratory
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import unittest
+import numpy as np
+
+from cvdb.chunkcache import ChunkCache
+
+
+class TestChunkCache(unittest.TestCase):
+
+    def chunk(self, nbytes=1000):
+        return np.zeros(nbytes, dtype=np.uint8)
+
+    def test_hit_and_miss(self):
+        """Cached chunks are returned read-only and counted"""
+        cache = ChunkCache(max_bytes=10000)
+        key = cache.make_key("file:///vol", 0, (1, 2, 3))
+
+        self.assertIsNone(cache.get(key))
+        cache.put(key, self.chunk())
+        data = cache.get(key)
+
+        self.assertEqual(data.nbytes, 1000)
+        self.assertFalse(data.flags.writeable)
+        self.assertEqual(cache.hits, 1)
+        self.assertEqual(cache.misses, 1)
+        self.assertEqual(cache.stats()["hit_rate"], 0.5)
+
+    def test_byte_budget(self):
+        """Least recently used chunks are evicted to stay within the budget"""
+        cache = ChunkCache(max_bytes=3000)
+        keys = [cache.make_key("file:///vol", 0, (i, 0, 0)) for i in range(4)]
+
+        for key in keys[:3]:
+            cache.put(key, self.chunk())
+        cache.get(keys[0])
+        cache.put(keys[3], self.chunk())
+
+        self.assertEqual(cache.nbytes, 3000)
+        self.assertEqual(cache.evictions, 1)
+        self.assertIsNone(cache.get(keys[1]))
+        self.assertIsNotNone(cache.get(keys[0]))
+
+    def test_oversized_chunk(self):
+        """Chunks larger than the budget are not cached"""
+        cache = ChunkCache(max_bytes=500)
+        cache.put(cache.make_key("file:///vol", 0, (0, 0, 0)), self.chunk())
+        self.assertEqual(len(cache), 0)
+
+    def test_replace(self):
+        """Putting an existing key replaces it without double counting bytes"""
+        cache = ChunkCache(max_bytes=3000)
+        key = cache.make_key("file:///vol", 0, (0, 0, 0))
+        cache.put(key, self.chunk())
+        cache.put(key, self.chunk(2000))
+        self.assertEqual(cache.nbytes, 2000)
+
+    def test_invalidate(self):
+        """Invalidation drops only the matching chunks"""
+        cache = ChunkCache()
+        cache.put(cache.make_key("file:///vol1", 0, (0, 0, 0)), self.chunk())
+        cache.put(cache.make_key("file:///vol1", 0, (1, 0, 0)), self.chunk())
+        cache.put(cache.make_key("file:///vol1", 1, (0, 0, 0)), self.chunk())
+        cache.put(cache.make_key("file:///vol2", 0, (0, 0, 0)), self.chunk())
+
+        self.assertEqual(cache.invalidate("file:///vol1", 0, [(1, 0, 0)]), 1)
+        self.assertEqual(cache.invalidate("file:///vol1"), 2)
+        self.assertEqual(len(cache), 1)
+        self.assertEqual(cache.nbytes, 1000)
+
+    def test_ttl(self):
+        """Chunks expire ttl seconds after they were added"""
+        key = ChunkCache.make_key("file:///vol", 0, (0, 0, 0))
+        cache = ChunkCache(ttl=60)
+        cache.put(key, self.chunk())
+        self.assertIsNotNone(cache.get(key))
+
+        expired = ChunkCache(ttl=0)
+        expired.put(key, self.chunk())
+        self.assertIsNone(expired.get(key))
+        self.assertEqual(len(expired), 0)
+        self.assertEqual(expired.nbytes, 0)
+        expired.put(key, self.chunk())
+        self.assertIsNone(expired.pop(key))
@@ -0,0 +1,129 @@
+# Copyright 2021 The Johns Hopkins University Applied Physics Laboratory
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+from cloudvolume import CloudVolume
+
+from cvdb.chunkcache import ChunkCache
+from cvdb.chunks import ChunkGrid, ChunkReader, fill_chunk, paste_chunk
+
+
+class TestChunks(unittest.TestCase):
+
+    CHUNKSIZE = (64, 64, 8)
+    VOLUMESIZE = (200, 160, 20)
+
+    @classmethod
+    def setUpClass(cls):
+        """Create a small local precomputed volume with partial chunks on the upper edges"""
+        cls.tmp_dir = tempfile.mkdtemp()
+        info = CloudVolume.create_new_info(
+            num_channels=1,
+            layer_type="image",
+            data_type="uint16",
+            encoding="raw",
+            resolution=[4, 4, 35],
+            voxel_offset=[0, 0, 0],
+            chunk_size=cls.CHUNKSIZE,
+            volume_size=cls.VOLUMESIZE,
+        )
+        cls.vol = CloudVolume(f"file://{cls.tmp_dir}", info=info, fill_missing=True)
+        cls.vol.commit_info()
+
+        cls.data = np.random.randint(1, 1000, size=cls.VOLUMESIZE, dtype=np.uint16)
+        cls.vol[:, :, :] = cls.data
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.tmp_dir)
+
+    def test_grid_indices(self):
+        """Grid indices cover the region and are clipped to the volume"""
+        grid = ChunkGrid(self.vol)
+
+        self.assertEqual(grid.indices((0, 0, 0), self.CHUNKSIZE), [(0, 0, 0)])
+        self.assertEqual(len(grid.indices((60, 0, 0), (10, 10, 10))), 4)
+        self.assertEqual(len(grid.indices((0, 0, 0), self.VOLUMESIZE)), 4 * 3 * 3)
+        self.assertEqual(grid.chunk_bounds((3, 2, 2)), ((192, 128, 16), (200, 160, 20)))
+        self.assertEqual(grid.filename((3, 2, 2)), "4_4_35/192-200_128-160_16-20")
+        self.assertTrue(grid.contains((0, 0, 0), self.VOLUMESIZE))
+        self.assertFalse(grid.contains((1, 0, 0), self.VOLUMESIZE))
+
+    def test_read_and_paste(self):
+        """Chunks decoded by the reader reassemble the original data"""
+        reader = ChunkReader(self.vol)
+        corner, extent = (30, 50, 5), (150, 100, 12)
+        out = np.zeros([1, extent[2], extent[1], extent[0]], dtype=np.uint16)
+
+        indices = reader.grid.indices(corner, extent)
+        chunk_data = reader.read(indices + indices)
+        self.assertEqual(len(chunk_data), len(indices))
+
+        for index, data in chunk_data.items():
+            self.assertTrue(paste_chunk(out, 0, corner, reader.grid.chunk_bounds(index)[0], data))
+
+        expected = self.data[corner[0]:corner[0] + extent[0],
+                             corner[1]:corner[1] + extent[1],
+                             corner[2]:corner[2] + extent[2]].T
+        np.testing.assert_array_equal(out[0], expected)
+
+    def test_aligned_fill(self):
+        """Chunk aligned regions are filled whole, chunk by chunk, zeroing the slots of missing chunks"""
+        grid = ChunkGrid(self.vol)
+        self.assertTrue(grid.is_aligned((64, 0, 8), (136, 128, 12)))
+        self.assertFalse(grid.is_aligned((64, 0, 8), (100, 128, 12)))
+        self.assertFalse(grid.is_aligned((1, 0, 0), self.CHUNKSIZE))
+
+        reader = ChunkReader(self.vol)
+        corner, extent = (64, 64, 8), (136, 96, 12)
+        out = np.full([1, extent[2], extent[1], extent[0]], 7, dtype=np.uint16)
+        for index, data in reader.iter_read(reader.grid.indices(corner, extent)):
+            if index == (1, 1, 1):
+                data = None
+            fill_chunk(out, 0, corner, *reader.grid.chunk_bounds(index), data)
+
+        expected = self.data[64:200, 64:160, 8:20].T.copy()
+        expected[0:8, 0:64, 0:64] = 0
+        np.testing.assert_array_equal(out[0], expected)
+
+    def test_read_cached(self):
+        """Chunks read once are served from the cache"""
+        cache = ChunkCache()
+        reader = ChunkReader(self.vol, cache=cache)
+        indices = reader.grid.indices((0, 0, 0), (128, 128, 8))
+
+        first = reader.read(indices)
+        self.assertEqual(cache.misses, 4)
+        self.assertEqual(len(cache), 4)
+
+        second = reader.read(indices)
+        self.assertEqual(cache.hits, 4)
+        for index in indices:
+            self.assertIs(first[index], second[index])
+
+    def test_missing_chunk(self):
+        """Chunks that were never written decode to None"""
+        info = dict(self.vol.info)
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            vol = CloudVolume(f"file://{tmp_dir}", info=info, fill_missing=True)
+            vol.commit_info()
+            reader = ChunkReader(vol)
+            self.assertIsNone(reader.fetch((0, 0, 0)))
+        finally:
+            shutil.rmtree(tmp_dir)
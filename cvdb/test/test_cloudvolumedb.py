@@ -114,6 +114,35 @@ class CloudvolumeDBImageDataTestMixin(object):
 
         np.testing.assert_array_equal(cube1.data, cube2.data)
 
+    def test_cutout_many(self):
+        """Test the cutout_many method - overlapping and adjacent regions"""
+        extents = [2 * self.CHUNKSIZE[0], 2 * self.CHUNKSIZE[1], self.CHUNKSIZE[2]]
+
+        # Generate random data
+        cube1 = Cube.create_cube(self.resource, extents)
+        cube1.random()
+
+        db = CloudVolumeDB()
+
+        # populate dummy data
+        self.write_test_cube(db, self.resource, 0, cube1)
+
+        regions = [
+            ((0, 0, 0), self.CHUNKSIZE),
+            ((256, 256, 4), (512, 300, 8)),
+            ((512, 0, 0), self.CHUNKSIZE),
+        ]
+        cubes = db.cutout_many(self.resource, regions, 0)
+
+        self.assertEqual(len(cubes), len(regions))
+        for (corner, extent), cube2 in zip(regions, cubes):
+            np.testing.assert_array_equal(
+                cube1.data[:,
+                           corner[2]:corner[2] + extent[2],
+                           corner[1]:corner[1] + extent[1],
+                           corner[0]:corner[0] + extent[0]],
+                cube2.data)
+
 
 class TestCloudvolumeDBImage8Data(CloudvolumeDBImageDataTestMixin, unittest.TestCase):
     @classmethod
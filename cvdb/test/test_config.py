@@ -0,0 +1,163 @@
+# Copyright 2021 The Johns Hopkins University Applied Physics Laboratory
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import shutil
+import tempfile
+import unittest
+
+import blosc
+import numpy as np
+from cloudfiles.interfaces import HttpInterface
+
+from cvdb import CloudVolumeDB, ChunkCache, CVDBError, VolumeHandleCache
+from cvdb import config
+from cvdb.config import BackendConfig
+from cvdb.project import BossResourceBasic
+from cvdb.project.test.resource_setup import get_image_dict
+from .setup import create_local_cloudvolume
+
+
+class TestBackendConfig(unittest.TestCase):
+
+    def setUp(self):
+        data = get_image_dict(storage_type="cloudvol")
+        self.channel = BossResourceBasic(data).get_channel()
+
+    def test_defaults(self):
+        """Without a cv_config, reads go to the HTTPS endpoint of the s3 volume"""
+        backend = BackendConfig()
+        self.assertEqual(backend.volume_options(self.channel),
+                         {"fill_missing": True, "use_https": True, "path_template": "s3://{bucket}/{cv_path}"})
+        self.assertEqual(backend.volume_options(self.channel, writable=True),
+                         {"fill_missing": True, "path_template": "s3://{bucket}/{cv_path}"})
+
+    def test_channel_overrides(self):
+        """Overrides keyed by bucket/cv_path win over those keyed by cv_path, which win over the top level"""
+        backend = BackendConfig({
+            "protocol": "gs",
+            "parallel": 8,
+            "channels": {
+                self.channel.cv_path: {"parallel": 32, "chunk_cache": False},
+                f"{self.channel.bucket}/{self.channel.cv_path}": {"parallel": 64},
+                "other/path": {"protocol": "file"},
+            },
+        })
+        settings = backend.settings(self.channel)
+        self.assertEqual(settings["parallel"], 64)
+        self.assertFalse(settings["chunk_cache"])
+        self.assertEqual(settings["protocol"], "gs")
+        self.assertEqual(backend.settings()["parallel"], 8)
+        self.assertEqual(backend.volume_options(self.channel)["path_template"], "gs://{bucket}/{cv_path}")
+
+    def test_invalid(self):
+        """Unknown settings, process wide HTTP settings and bad parallelism are rejected"""
+        with self.assertRaises(CVDBError):
+            BackendConfig({"paralel": 4})
+        with self.assertRaises(CVDBError):
+            BackendConfig({"timeout": 5})
+        with self.assertRaises(CVDBError):
+            BackendConfig({"channels": {"col/exp/chan": {"max_connections": 5}}})
+        with self.assertRaises(CVDBError):
+            BackendConfig({"parallel": 0})
+
+    def test_configure_http(self):
+        """Connection pool size and timeout are only installed by the explicit setup call, once per change"""
+        adaptor = HttpInterface.adaptor
+        try:
+            CloudVolumeDB(cv_config={"parallel": 4})
+            self.assertIs(HttpInterface.adaptor, adaptor)
+
+            config.configure_http(max_connections=48, timeout=[3, 30])
+            installed = HttpInterface.adaptor
+            self.assertIsInstance(installed, config.TimeoutHTTPAdapter)
+            self.assertEqual(installed.timeout, (3, 30))
+            self.assertEqual(installed._pool_maxsize, 48)
+
+            config.configure_http(max_connections=48, timeout=(3, 30))
+            self.assertIs(HttpInterface.adaptor, installed)
+        finally:
+            HttpInterface.adaptor = adaptor
+            config._http_settings = (None, None)
+
+    def test_configure_blosc(self):
+        """Releasing the GIL is only switched by the explicit setup call"""
+        previous = blosc.set_releasegil(False)
+        try:
+            CloudVolumeDB()
+            self.assertFalse(blosc.set_releasegil(False))
+            config.configure_blosc()
+            self.assertTrue(blosc.set_releasegil(True))
+            config.configure_blosc(release_gil=False)
+            self.assertFalse(blosc.set_releasegil(False))
+        finally:
+            blosc.set_releasegil(previous)
+
+
+class TestLocalProtocol(unittest.TestCase):
+
+    CHUNKSIZE = (64, 64, 8)
+
+    def setUp(self):
+        """Create a local volume read through the default handle factory with the file protocol"""
+        self.bucket = tempfile.mkdtemp()
+        data = get_image_dict(storage_type="cloudvol")
+        data["channel"]["bucket"] = self.bucket
+        data["coord_frame"]["x_stop"] = 128
+        data["coord_frame"]["y_stop"] = 128
+        data["coord_frame"]["z_stop"] = 16
+        self.resource = BossResourceBasic(data)
+
+        self.vol = create_local_cloudvolume(self.resource, self.CHUNKSIZE)
+        self.data = np.random.randint(1, 254, size=(128, 128, 16), dtype=np.uint8)
+        self.vol[:, :, :] = self.data
+
+    def tearDown(self):
+        shutil.rmtree(self.bucket)
+
+    def test_file_protocol(self):
+        """Per-channel settings pick the local volume, the parallelism and the caches"""
+        channel = self.resource.get_channel()
+        db = CloudVolumeDB(cv_config={"channels": {channel.cv_path: {"protocol": "file", "parallel": 2,
+                                                                     "chunk_cache": False}}},
+                           handle_cache=VolumeHandleCache(), chunk_cache=ChunkCache())
+
+        cube = db.cutout(self.resource, (10, 20, 3), (100, 90, 10), 0)
+        np.testing.assert_array_equal(cube.data[0], self.data[10:110, 20:110, 3:13].T)
+        self.assertEqual(len(db.chunk_cache), 0)
+
+        reader = db.get_reader(db.get_volume(channel, 0), channel=channel)
+        self.assertEqual(reader.parallel, 2)
+        self.assertIsNone(reader.cache)
+
+        data = np.random.randint(1, 254, size=(8, 64, 64), dtype=np.uint8)
+        db.write_cuboid(self.resource, (0, 0, 0), 0, data)
+        np.testing.assert_array_equal(self.vol[0:64, 0:64, 0:8][:, :, :, 0], data.T)
+
+    def test_fill_missing(self):
+        """Missing chunks read as zeros unless fill_missing is off"""
+        channel = self.resource.get_channel()
+        self.vol.delete(np.s_[0:64, 0:64, 0:8])
+
+        db = CloudVolumeDB(cv_config={"channels": {channel.cv_path: {"protocol": "file"}}},
+                           handle_cache=VolumeHandleCache(), chunk_cache=ChunkCache())
+        cube = db.cutout(self.resource, (0, 0, 0), (128, 128, 16), 0)
+        np.testing.assert_array_equal(cube.data[0, 0:8, 0:64, 0:64], 0)
+        np.testing.assert_array_equal(cube.data[0, 8:], self.data[:, :, 8:].T)
+
+        db = CloudVolumeDB(cv_config={"channels": {channel.cv_path: {"protocol": "file", "fill_missing": False}}},
+                           handle_cache=VolumeHandleCache(), chunk_cache=ChunkCache())
+        with self.assertRaises(CVDBError):
+            db.cutout(self.resource, (0, 0, 0), (128, 128, 16), 0)
+        cube = db.cutout(self.resource, (0, 0, 8), (128, 128, 8), 0)
+        np.testing.assert_array_equal(cube.data[0], self.data[:, :, 8:].T)
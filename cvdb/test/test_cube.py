@@ -0,0 +1,173 @@
+# Copyright 2021 The Johns Hopkins University Applied Physics Laboratory
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import unittest
+import blosc
+import numpy as np
+
+from cvdb import CVDBError, Cube, ImageCube8, ImageCube16, AnnotateCube64
+from cvdb.morton import morton_xyz
+
+
+class TestCube(unittest.TestCase):
+
+    def test_lazy_allocation(self):
+        """Data is only allocated on first access, with the cube's shape and datatype"""
+        for cube_class, dtype in [(ImageCube8, np.uint8), (ImageCube16, np.uint16), (AnnotateCube64, np.uint64)]:
+            cube = cube_class([30, 20, 10], [0, 2])
+            self.assertIsNone(cube._data)
+
+            self.assertEqual(cube.data.shape, (2, 10, 20, 30))
+            self.assertEqual(cube.data.dtype, dtype)
+            self.assertFalse(cube.is_not_zeros())
+
+    def test_set_data_skips_allocation(self):
+        """Setting data on a new cube never allocates the default buffer"""
+        cube = ImageCube8([30, 20, 10])
+        data = np.ones((1, 10, 20, 30), dtype=np.uint8)
+        cube.set_data(data)
+        self.assertIs(cube.data, data)
+
+    def test_apply_id_filter(self):
+        """Only voxels labeled with the filter IDs are kept"""
+        cube = AnnotateCube64([30, 20, 10])
+        cube.random()
+        original = cube.data.copy()
+
+        cube.apply_id_filter([5, 7, 7, 1000])
+        np.testing.assert_array_equal(cube.data, np.where(np.isin(original, [5, 7]), original, 0))
+
+    def test_zoom(self):
+        """Image cubes zoom out by averaging, annotation cubes by keeping the most frequent ID"""
+        image = ImageCube8([4, 4, 2])
+        image.set_data(np.arange(32, dtype=np.uint8).reshape(1, 2, 4, 4))
+        image.zoom_out((2, 2, 1))
+        self.assertEqual(image.cube_size, [2, 2, 2])
+        self.assertEqual(image.data[0, 0, 0, 0], 2)
+
+        anno = AnnotateCube64([4, 4, 1])
+        anno.set_data(np.array([[[[1, 1, 2, 3], [1, 4, 3, 3], [5, 5, 6, 7], [5, 8, 9, 6]]]], dtype=np.uint64))
+        anno.zoom_out((2, 2, 1))
+        np.testing.assert_array_equal(anno.data, [[[[1, 3], [5, 6]]]])
+
+        anno.zoom_in((2, 2, 1))
+        self.assertEqual(anno.cube_size, [1, 4, 4])
+        np.testing.assert_array_equal(anno.data[0, 0, :2, :2], 1)
+        np.testing.assert_array_equal(anno.data[0, 0, 2:, 2:], 6)
+
+    def test_pack_array(self):
+        """Cubes are packed with their class's codec and the datatype's item size, on blosc's threads"""
+        for cube_class, dtype, cname in [(ImageCube8, np.uint8, "lz4"), (ImageCube16, np.uint16, "lz4"),
+                                         (AnnotateCube64, np.uint64, "zstd")]:
+            for shape in ((1, 2, 20, 30), (2, 4, 256, 256)):
+                data = np.zeros(shape, dtype=dtype)
+                data[:, :, 10:] = np.arange(shape[3], dtype=dtype)
+                cube = cube_class(shape[:0:-1], [0, shape[0]])
+                cube.set_data(data)
+
+                packed = cube.to_blosc()
+                self.assertEqual(blosc.set_nthreads(1), min(cube.compression["threads"], os.cpu_count()))
+                self.assertEqual(packed[3], np.dtype(dtype).itemsize)
+                self.assertEqual(blosc.get_clib(packed), blosc.cname2clib[cname])
+                self.assertEqual(blosc.decompress(packed), data.tobytes())
+
+    def test_set_compression(self):
+        """Settings are changed per class and validated"""
+        original = ImageCube16.compression
+        try:
+            ImageCube16.set_compression(cname="zstd", threads=1)
+            self.assertEqual(ImageCube16.compression["cname"], "zstd")
+            self.assertEqual(ImageCube8.compression["cname"], "lz4")
+            self.assertEqual(Cube.compression["cname"], "blosclz")
+        finally:
+            ImageCube16.compression = original
+
+        with self.assertRaises(CVDBError):
+            ImageCube8.set_compression(codec="lz4")
+        with self.assertRaises(CVDBError):
+            ImageCube8.set_compression(cname="snappy-ish")
+
+    def test_from_blosc(self):
+        """Payloads decompress into the cube's buffer, whole or one time sample at a time"""
+        data = np.random.randint(0, 5, size=(3, 4, 20, 30)).astype(np.uint16)
+        packed = ImageCube16([30, 20, 4], [0, 3])
+        packed.set_data(data)
+
+        cube = ImageCube16([30, 20, 4])
+        cube.from_blosc(packed.to_blosc(), [0, 3])
+        np.testing.assert_array_equal(cube.data, data)
+
+        samples = [packed.to_blosc_by_time_index(t) for t in (0, 2)]
+        cube = ImageCube16([30, 20, 4])
+        cube.from_blosc(samples, [0, 3], missing_time_steps=[1])
+        np.testing.assert_array_equal(cube.data[[0, 2]], data[[0, 2]])
+        np.testing.assert_array_equal(cube.data[1], 0)
+
+    def test_unpack_array_checks(self):
+        """Payloads and buffers that don't match the cube's shape are rejected before decompressing"""
+        cube = ImageCube8([30, 20, 4])
+        payload = blosc.compress(np.zeros(30 * 20 * 4, dtype=np.uint8), typesize=1)
+        out = np.empty((1, 4, 20, 30), dtype=np.uint8)
+        self.assertIs(cube.unpack_array(payload, out=out), out)
+
+        with self.assertRaises(CVDBError):
+            cube.unpack_array(payload, 2)
+        with self.assertRaises(CVDBError):
+            cube.unpack_array(payload[:-10])
+        with self.assertRaises(CVDBError):
+            cube.unpack_array(payload, out=np.empty((1, 4, 20, 30), dtype=np.uint16))
+
+    def test_from_blosc_time_series(self):
+        """Many time samples decode into their slots, missing ones stay zero"""
+        data = np.random.randint(1, 1000, size=(40, 2, 16, 16)).astype(np.uint64)
+        packed = AnnotateCube64([16, 16, 2], [0, 40])
+        packed.set_data(data)
+        missing = [3, 4, 17, 39]
+        samples = [packed.to_blosc_by_time_index(t) for t in range(40) if t not in missing]
+
+        cube = AnnotateCube64([16, 16, 2])
+        cube.from_blosc(samples, [0, 40], missing_time_steps=missing)
+        present = [t for t in range(40) if t not in missing]
+        np.testing.assert_array_equal(cube.data[present], data[present])
+        np.testing.assert_array_equal(cube.data[missing], 0)
+
+        with self.assertRaises(CVDBError):
+            cube.from_blosc(samples[1:], [0, 40], missing_time_steps=missing)
+
+    def test_assemble(self):
+        """Cuboids given by morton ID or xyz index land where add_data() puts them"""
+        cuboids = []
+        for _ in range(8):
+            cuboid = ImageCube8([8, 4, 2], [0, 2])
+            cuboid.set_data(np.random.randint(1, 255, size=(2, 2, 4, 8), dtype=np.uint8))
+            cuboids.append(cuboid)
+        expected = ImageCube8([16, 8, 4], [0, 2])
+        for morton, cuboid in enumerate(cuboids):
+            expected.add_data(cuboid, morton)
+
+        cube = ImageCube8([16, 8, 4], [0, 2])
+        cube.assemble(cuboids, range(8))
+        np.testing.assert_array_equal(cube.data, expected.data)
+
+        # Stacked data and xyz indices, leaving a block empty
+        cube = ImageCube8([16, 8, 4], [0, 2])
+        cube.assemble(np.stack([c.data for c in cuboids[:7]]), morton_xyz(np.arange(7)))
+        np.testing.assert_array_equal(cube.data[:, 2:, 4:, 8:], 0)
+        np.testing.assert_array_equal(cube.data[:, :2], expected.data[:, :2])
+
+        with self.assertRaises(CVDBError):
+            cube.assemble(cuboids[:1], [[2, 0, 0]])
+        with self.assertRaises(CVDBError):
+            cube.assemble(cuboids[:2], [0])
@@ -0,0 +1,167 @@
+# Copyright 2021 The Johns Hopkins University Applied Physics Laboratory
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import glob
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+from cloudvolume import CloudVolume
+
+from cvdb import CloudVolumeDB, ChunkCache, CVDBError, DiskChunkCache, VolumeHandleCache
+from cvdb.project import BossResourceBasic
+from cvdb.project.test.resource_setup import get_image_dict
+from .setup import open_local_volume
+
+
+class TestDiskChunkCache(unittest.TestCase):
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+
+    def test_put_get(self):
+        """Files round trip and are counted"""
+        cache = DiskChunkCache(self.cache_dir)
+        self.assertIsNone(cache.get("s3://bucket/vol", "1_1_1/0-64_0-64_0-8"))
+
+        cache.put("s3://bucket/vol", "1_1_1/0-64_0-64_0-8", b"abc")
+        self.assertEqual(cache.get("s3://bucket/vol", "1_1_1/0-64_0-64_0-8"), b"abc")
+        self.assertIsNone(cache.get("s3://bucket/other", "1_1_1/0-64_0-64_0-8"))
+        self.assertEqual(cache.stats()["hits"], 1)
+        self.assertEqual(cache.stats()["misses"], 2)
+
+    def test_budget(self):
+        """Least recently used files are deleted to stay within the budget"""
+        cache = DiskChunkCache(self.cache_dir, max_bytes=30)
+        for i in range(3):
+            cache.put("s3://bucket/vol", f"key/{i}", b"x" * 10)
+        cache.get("s3://bucket/vol", "key/0")
+        cache.put("s3://bucket/vol", "key/3", b"x" * 10)
+
+        self.assertEqual(cache.nbytes, 30)
+        self.assertEqual(cache.evictions, 1)
+        self.assertIsNone(cache.get("s3://bucket/vol", "key/1"))
+        self.assertIsNotNone(cache.get("s3://bucket/vol", "key/0"))
+
+    def test_persistence(self):
+        """A new instance on the same directory sees earlier files and their sizes"""
+        cache = DiskChunkCache(self.cache_dir)
+        cache.put("s3://bucket/vol", "key/0", b"x" * 10)
+        cache.put("s3://bucket/vol", "key/1", b"x" * 20)
+
+        restarted = DiskChunkCache(self.cache_dir)
+        self.assertEqual(len(restarted), 2)
+        self.assertEqual(restarted.nbytes, 30)
+        self.assertEqual(restarted.get("s3://bucket/vol", "key/1"), b"x" * 20)
+
+    def test_invalidate(self):
+        """Invalidation deletes the volume's files only"""
+        cache = DiskChunkCache(self.cache_dir)
+        cache.put("s3://bucket/vol", "key/0", b"x")
+        cache.put("s3://bucket/vol", "key/1", b"x")
+        cache.put("s3://bucket/other", "key/0", b"x")
+
+        self.assertEqual(cache.invalidate("s3://bucket/vol", ["key/0"]), 1)
+        self.assertEqual(cache.invalidate("s3://bucket/vol"), 1)
+        self.assertEqual(len(cache), 1)
+
+
+class TestCutoutAccessMode(unittest.TestCase):
+
+    CHUNKSIZE = (64, 64, 8)
+
+    @classmethod
+    def setUpClass(cls):
+        """Create a local precomputed volume standing in for S3"""
+        cls.bucket = tempfile.mkdtemp()
+        data = get_image_dict(storage_type="cloudvol")
+        data["channel"]["bucket"] = cls.bucket
+        data["coord_frame"]["x_stop"] = 128
+        data["coord_frame"]["y_stop"] = 128
+        data["coord_frame"]["z_stop"] = 16
+        cls.resource = BossResourceBasic(data)
+
+        info = CloudVolume.create_new_info(
+            num_channels=1,
+            layer_type="image",
+            data_type="uint8",
+            encoding="raw",
+            resolution=[4, 4, 35],
+            voxel_offset=[0, 0, 0],
+            chunk_size=cls.CHUNKSIZE,
+            volume_size=[128, 128, 16],
+        )
+        cls.cloudpath = f"file://{cls.bucket}/{data['channel']['cv_path']}"
+        cls.vol = CloudVolume(cls.cloudpath, info=info)
+        cls.vol.commit_info()
+        cls.data = np.random.randint(1, 254, size=(128, 128, 16), dtype=np.uint8)
+        cls.vol[:, :, :] = cls.data
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.bucket)
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+
+    def get_db(self):
+        return CloudVolumeDB(handle_cache=VolumeHandleCache(factory=open_local_volume),
+                             chunk_cache=ChunkCache(),
+                             disk_cache=DiskChunkCache(self.cache_dir))
+
+    def test_cache_survives_restart(self):
+        """Chunks cached on disk are served to a new CloudVolumeDB instance without reading storage"""
+        db = self.get_db()
+        cube = db.cutout(self.resource, (0, 0, 0), self.CHUNKSIZE, 0)
+        np.testing.assert_array_equal(cube.data[0], self.data[:64, :64, :8].T)
+        self.assertEqual(len(db.disk_cache), 1)
+
+        # Stand in for a restarted worker, and take the source chunk away
+        db = self.get_db()
+        chunk_name = db.get_reader(self.vol).grid.filename((0, 0, 0))
+        chunk_path, = glob.glob(os.path.join(self.bucket, "col1/exp1/chan2", chunk_name) + "*")
+        shutil.move(chunk_path, chunk_path + ".bak")
+        try:
+            cube = db.cutout(self.resource, (0, 0, 0), self.CHUNKSIZE, 0)
+            np.testing.assert_array_equal(cube.data[0], self.data[:64, :64, :8].T)
+            self.assertEqual(db.disk_cache.hits, 1)
+
+            cube = db.cutout(self.resource, (0, 0, 0), self.CHUNKSIZE, 0, access_mode="raw")
+            self.assertFalse(cube.is_not_zeros())
+        finally:
+            shutil.move(chunk_path + ".bak", chunk_path)
+
+    def test_no_cache_does_not_populate(self):
+        """no_cache and raw reads leave both caches empty"""
+        db = self.get_db()
+        for access_mode in ("no_cache", "raw"):
+            cube = db.cutout(self.resource, (10, 10, 2), (100, 50, 10), 0, access_mode=access_mode)
+            np.testing.assert_array_equal(cube.data[0], self.data[10:110, 10:60, 2:12].T)
+
+        self.assertEqual(len(db.disk_cache), 0)
+        self.assertEqual(len(db.chunk_cache), 0)
+
+    def test_invalid_access_mode(self):
+        """Unknown access modes are rejected"""
+        db = self.get_db()
+        with self.assertRaises(CVDBError):
+            db.cutout(self.resource, (0, 0, 0), self.CHUNKSIZE, 0, access_mode="bogus")
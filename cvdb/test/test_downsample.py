@@ -0,0 +1,177 @@
+# Copyright 2021 The Johns Hopkins University Applied Physics Laboratory
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+from cloudvolume import CloudVolume
+
+from cvdb import AsyncReadPool, CloudVolumeDB, ChunkCache, ChunkOccupancy, VolumeHandleCache
+from cvdb.downsample import DownsampledReader, pool_mean, pool_mode
+from cvdb.project import BossResourceBasic
+from cvdb.project.test.resource_setup import get_image_dict
+from .setup import create_local_cloudvolume, open_local_volume
+
+
+class TestPooling(unittest.TestCase):
+
+    def test_mean(self):
+        """Blocks are averaged and rounded, partial edge blocks repeat the last voxel"""
+        data = np.arange(2 * 5 * 4 * 4, dtype=np.uint16).reshape(2, 5, 4, 4)
+        pooled = pool_mean(data, (2, 2, 2))
+
+        self.assertEqual(pooled.shape, (2, 3, 2, 2))
+        self.assertEqual(pooled.dtype, np.uint16)
+        self.assertEqual(pooled[1, 0, 1, 0], np.rint(data[1, 0:2, 2:4, 0:2].mean()))
+        self.assertEqual(pooled[0, 2, 0, 0], np.rint(data[0, 4, 0:2, 0:2].mean()))
+
+    def test_mode(self):
+        """The most frequent label of each block wins, ties go to the first"""
+        data = np.array([[[[1, 1], [2, 3]],
+                          [[5, 6], [7, 8]]]], dtype=np.uint64)
+        np.testing.assert_array_equal(pool_mode(data, (2, 2, 1)), [[[[1]], [[5]]]])
+        np.testing.assert_array_equal(pool_mode(data, (1, 1, 2)), data[:, :1])
+
+
+class TestIsoCutout(unittest.TestCase):
+
+    def setUp(self):
+        """Create a volume with the anisotropic hierarchy down to resolution 4"""
+        self.bucket = tempfile.mkdtemp()
+        data = get_image_dict(storage_type="cloudvol")
+        data["channel"]["bucket"] = self.bucket
+        data["coord_frame"]["x_stop"] = 256
+        data["coord_frame"]["y_stop"] = 256
+        data["coord_frame"]["z_stop"] = 40
+        self.resource = BossResourceBasic(data)
+
+        self.vol = create_local_cloudvolume(self.resource, (64, 64, 8))
+        for factor in ((2, 2, 1), (4, 4, 1), (8, 8, 1), (16, 16, 1)):
+            self.vol.add_scale(factor, chunk_size=(8, 8, 8))
+        self.vol.commit_info()
+
+        self.mip4 = np.random.randint(0, 255, size=(16, 16, 40), dtype=np.uint8)
+        CloudVolume(self.vol.cloudpath, mip=4)[:, :, :] = self.mip4
+
+        self.db = CloudVolumeDB(handle_cache=VolumeHandleCache(factory=open_local_volume), chunk_cache=ChunkCache())
+
+    def tearDown(self):
+        shutil.rmtree(self.bucket)
+
+    def test_downsample_on_read(self):
+        """Without an isotropic scale, the anisotropic mip is pooled in z and the result is cached"""
+        cube = self.db.cutout(self.resource, (2, 3, 5), (12, 10, 14), 4, iso=True)
+        expected = pool_mean(self.mip4.T[np.newaxis], (1, 1, 2))[:, 5:19, 3:13, 2:14]
+        np.testing.assert_array_equal(cube.data, expected)
+
+        cached = [key for key in self.db.chunk_cache._chunks if key[1] == (4, (1, 1, 2))]
+        self.assertEqual(len(cached), 2 * 2 * 3)
+
+        again = self.db.cutout(self.resource, (2, 3, 5), (12, 10, 14), 4, iso=True)
+        np.testing.assert_array_equal(again.data, expected)
+        self.assertGreaterEqual(self.db.chunk_cache.hits, 2 * 2 * 3)
+
+    def test_iso_scale(self):
+        """An isotropic scale in the volume is read directly"""
+        self.vol.add_scale((16, 16, 2), chunk_size=(8, 8, 8))
+        self.vol.commit_info()
+        iso = np.random.randint(0, 255, size=(16, 16, 20), dtype=np.uint8)
+        CloudVolume(self.vol.cloudpath, mip=5)[:, :, :] = iso
+
+        cube = self.db.cutout(self.resource, (0, 0, 0), (16, 16, 20), 4, iso=True)
+        np.testing.assert_array_equal(cube.data[0], iso.T)
+
+    def test_below_isotropic_level(self):
+        """Resolutions that are isotropic already ignore the flag"""
+        cube = self.db.cutout(self.resource, (0, 0, 0), (64, 64, 8), 0, iso=True)
+        self.assertEqual(cube.data.shape, (1, 8, 64, 64))
+
+
+class TestFallbackCutout(unittest.TestCase):
+
+    def setUp(self):
+        """Create a volume holding resolution 0 only"""
+        self.bucket = tempfile.mkdtemp()
+        self.index_dir = tempfile.mkdtemp()
+        data = get_image_dict(storage_type="cloudvol")
+        data["channel"]["bucket"] = self.bucket
+        data["coord_frame"]["x_stop"] = 256
+        data["coord_frame"]["y_stop"] = 256
+        data["coord_frame"]["z_stop"] = 16
+        self.resource = BossResourceBasic(data)
+
+        self.vol = create_local_cloudvolume(self.resource, (64, 64, 8))
+        self.data = np.random.randint(0, 255, size=(1, 16, 256, 256), dtype=np.uint8)
+        self.vol[:, :, :] = self.data[0].T
+
+        self.occupancy = ChunkOccupancy(self.index_dir)
+        self.db = CloudVolumeDB(handle_cache=VolumeHandleCache(factory=open_local_volume), chunk_cache=ChunkCache(),
+                                occupancy=self.occupancy)
+
+    def tearDown(self):
+        shutil.rmtree(self.bucket)
+        shutil.rmtree(self.index_dir)
+
+    def test_missing_scale(self):
+        """Resolutions without a scale are pooled level by level from the finest one"""
+        self.assertEqual(self.db.get_read_source(self.resource, 3), (0, [((2, 2, 1), "mean")] * 3))
+
+        expected = pool_mean(pool_mean(pool_mean(self.data, (2, 2, 1)), (2, 2, 1)), (2, 2, 1))
+        cube = self.db.cutout(self.resource, (3, 5, 2), (20, 25, 12), 3)
+        np.testing.assert_array_equal(cube.data, expected[:, 2:14, 5:30, 3:23])
+
+        # Repeat views are served from the chunk cache
+        hits = self.db.chunk_cache.hits
+        self.db.cutout(self.resource, (3, 5, 2), (20, 25, 12), 3)
+        self.assertGreater(self.db.chunk_cache.hits, hits)
+
+    def test_async_reader(self):
+        """Downsampled chunks are built through the async pool like stored chunks are downloaded"""
+        self.db.build_occupancy(self.resource, 0)
+        channel = self.resource.get_channel()
+        source = self.db.get_reader(self.db.get_volume(channel, 0), channel=channel)
+        reader = DownsampledReader(source, (2, 2, 1), "mean")
+
+        pool = AsyncReadPool(io_threads=2, decode_threads=1)
+        try:
+            chunk = asyncio.run(pool.read_chunk(reader, (0, 0, 0)))
+        finally:
+            pool.shutdown()
+        np.testing.assert_array_equal(chunk.T[:8, :32, :32], pool_mean(self.data, (2, 2, 1))[0, :8, :32, :32])
+        self.assertIs(reader.lookup((0, 0, 0)), chunk)
+
+    def test_empty_level(self):
+        """Levels whose occupancy index is empty are synthesized, and writes to the source are seen"""
+        for factor in ((2, 2, 1), (4, 4, 1)):
+            self.vol.add_scale(factor, chunk_size=(32, 32, 8))
+        self.vol.commit_info()
+        for mip in range(3):
+            self.db.build_occupancy(self.resource, mip)
+        self.assertEqual(self.db.get_read_source(self.resource, 2), (0, [((2, 2, 1), "mean")] * 2))
+
+        cube = self.db.cutout(self.resource, (0, 0, 0), (64, 64, 16), 2)
+        np.testing.assert_array_equal(cube.data, pool_mean(pool_mean(self.data, (2, 2, 1)), (2, 2, 1)))
+
+        data = np.full((16, 256, 256), 9, dtype=np.uint8)
+        self.db.write_cuboid(self.resource, (0, 0, 0), 0, data)
+        cube = self.db.cutout(self.resource, (0, 0, 0), (64, 64, 16), 2)
+        np.testing.assert_array_equal(cube.data, 9)
+
+        # Once resolution 1 is built, resolution 2 is pooled from it
+        self.db.write_cuboid(self.resource, (0, 0, 0), 1, np.full((16, 128, 128), 7, dtype=np.uint8))
+        self.assertEqual(self.db.get_read_source(self.resource, 2), (1, [((2, 2, 1), "mean")]))
+        np.testing.assert_array_equal(self.db.cutout(self.resource, (0, 0, 0), (64, 64, 16), 2).data, 7)
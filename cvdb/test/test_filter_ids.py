@@ -0,0 +1,82 @@
+# Copyright 2021 The Johns Hopkins University Applied Physics Laboratory
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+import numpy as np
+
+from cvdb import CloudVolumeDB, ChunkCache, CVDBError, VolumeHandleCache
+from cvdb.chunks import ChunkReader
+from cvdb.project import BossResourceBasic
+from cvdb.project.test.resource_setup import get_anno_dict, get_image_dict
+from .setup import create_local_cloudvolume, open_local_volume
+
+
+class TestFilterIds(unittest.TestCase):
+
+    CHUNKSIZE = (64, 64, 8)
+
+    @classmethod
+    def setUpClass(cls):
+        """Create raw and compressed_segmentation annotation volumes where only the first chunk holds low IDs"""
+        cls.bucket = tempfile.mkdtemp()
+        cls.data = np.random.randint(1000, 2000, size=(128, 128, 16)).astype(np.uint64)
+        cls.data[:64, :64, :8] = np.random.randint(1, 20, size=(64, 64, 8))
+
+        cls.resources = {}
+        for encoding in ("raw", "compressed_segmentation"):
+            data = get_anno_dict(storage_type="cloudvol")
+            data["channel"]["bucket"] = cls.bucket
+            data["channel"]["cv_path"] = f"col1/exp1/anno_{encoding}"
+            data["coord_frame"]["x_stop"] = 128
+            data["coord_frame"]["y_stop"] = 128
+            data["coord_frame"]["z_stop"] = 16
+            cls.resources[encoding] = BossResourceBasic(data)
+            vol = create_local_cloudvolume(cls.resources[encoding], cls.CHUNKSIZE, encoding=encoding)
+            vol[:, :, :] = cls.data
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.bucket)
+
+    def setUp(self):
+        self.db = CloudVolumeDB(handle_cache=VolumeHandleCache(factory=open_local_volume), chunk_cache=ChunkCache())
+
+    def test_filter(self):
+        """Only voxels labeled with the requested IDs are returned"""
+        filter_ids = list(range(5, 15)) + list(range(1500, 1600)) + [10 ** 12]
+        corner, extent = (10, 20, 2), (110, 100, 12)
+        expected = self.data[10:120, 20:120, 2:14].T
+        expected = np.where(np.isin(expected, filter_ids), expected, 0)
+
+        for resource in self.resources.values():
+            cube = self.db.cutout(resource, corner, extent, 0, filter_ids=filter_ids, access_mode="no_cache")
+            np.testing.assert_array_equal(cube.data[0], expected)
+
+    def test_precheck_skips_decode(self):
+        """compressed_segmentation chunks without any of the IDs are never decoded"""
+        with mock.patch.object(ChunkReader, "decode", autospec=True, side_effect=ChunkReader.decode) as decode:
+            cube = self.db.cutout(self.resources["compressed_segmentation"], (0, 0, 0), (128, 128, 16), 0,
+                                  filter_ids=[3, 4])
+        self.assertEqual(decode.call_count, 1)
+        self.assertFalse(cube.data[:, :, 64:, :].any())
+
+    def test_image_channel(self):
+        """filter_ids is rejected for image channels"""
+        data = get_image_dict(storage_type="cloudvol")
+        with self.assertRaises(CVDBError):
+            self.db.cutout(BossResourceBasic(data), (0, 0, 0), self.CHUNKSIZE, 0, filter_ids=[1])
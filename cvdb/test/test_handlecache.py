@@ -0,0 +1,103 @@
+# Copyright 2021 The Johns Hopkins University Applied Physics Laboratory
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+from cvdb.handlecache import VolumeHandleCache
+
+
+class FakeFactory(object):
+    """Stands in for CloudVolume construction and counts the calls"""
+    def __init__(self):
+        self.calls = 0
+
+    def __call__(self, bucket, cv_path, mip, options):
+        self.calls += 1
+        return object()
+
+
+class TestVolumeHandleCache(unittest.TestCase):
+
+    def setUp(self):
+        self.factory = FakeFactory()
+
+    def test_hit_and_miss(self):
+        """Same key returns the same handle, different mip or options builds a new one"""
+        cache = VolumeHandleCache(factory=self.factory)
+
+        vol1 = cache.get("bucket", "col/exp/ch", 0, {"fill_missing": True})
+        vol2 = cache.get("bucket", "col/exp/ch", 0, {"fill_missing": True})
+        vol3 = cache.get("bucket", "col/exp/ch", 1, {"fill_missing": True})
+        vol4 = cache.get("bucket", "col/exp/ch", 0, {"fill_missing": False})
+
+        self.assertIs(vol1, vol2)
+        self.assertIsNot(vol1, vol3)
+        self.assertIsNot(vol1, vol4)
+        self.assertEqual(cache.hits, 1)
+        self.assertEqual(cache.misses, 3)
+        self.assertEqual(self.factory.calls, 3)
+
+    def test_lru_eviction(self):
+        """Least recently used handle is evicted first"""
+        cache = VolumeHandleCache(max_size=2, factory=self.factory)
+
+        vol0 = cache.get("bucket", "path", 0)
+        cache.get("bucket", "path", 1)
+        cache.get("bucket", "path", 0)
+        cache.get("bucket", "path", 2)
+
+        self.assertEqual(len(cache), 2)
+        self.assertEqual(cache.evictions, 1)
+        self.assertIs(cache.get("bucket", "path", 0), vol0)
+
+        cache.get("bucket", "path", 1)
+        self.assertEqual(self.factory.calls, 4)
+
+    def test_ttl_expiry(self):
+        """Handles older than the ttl are rebuilt"""
+        cache = VolumeHandleCache(ttl=0.01, factory=self.factory)
+
+        vol1 = cache.get("bucket", "path", 0)
+        time.sleep(0.02)
+        vol2 = cache.get("bucket", "path", 0)
+
+        self.assertIsNot(vol1, vol2)
+        self.assertEqual(cache.expirations, 1)
+        self.assertEqual(cache.misses, 2)
+
+    def test_invalidate(self):
+        """Invalidation drops only the matching handles"""
+        cache = VolumeHandleCache(factory=self.factory)
+        cache.get("bucket", "path1", 0)
+        cache.get("bucket", "path1", 1)
+        cache.get("bucket", "path2", 0)
+
+        self.assertEqual(cache.invalidate(cv_path="path1"), 2)
+        self.assertEqual(len(cache), 1)
+
+        cache.get("bucket", "path2", 0)
+        self.assertEqual(cache.hits, 1)
+
+    def test_threaded_access(self):
+        """Concurrent lookups of one key construct a single cached handle"""
+        cache = VolumeHandleCache(factory=self.factory)
+
+        with ThreadPoolExecutor(8) as pool:
+            vols = list(pool.map(lambda _: cache.get("bucket", "path", 0), range(64)))
+
+        self.assertEqual(len(cache), 1)
+        self.assertEqual(len(set(id(v) for v in vols)), 1)
+        self.assertEqual(cache.hits + cache.misses, 64)
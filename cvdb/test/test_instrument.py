@@ -0,0 +1,108 @@
+# Copyright 2021 The Johns Hopkins University Applied Physics Laboratory
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from cvdb import CloudVolumeDB, ChunkCache, CutoutTrace, CVDBError, StatsAggregator, VolumeHandleCache
+from cvdb.project import BossResourceBasic
+from cvdb.project.test.resource_setup import get_image_dict
+from .setup import create_local_cloudvolume, open_local_volume
+
+
+class TestStatsAggregator(unittest.TestCase):
+
+    def test_summary(self):
+        """Percentiles cover the recent traces only"""
+        stats = StatsAggregator(window=100)
+        for i in range(150):
+            trace = CutoutTrace()
+            trace.add("total", float(i))
+            trace.count("chunks", 2)
+            stats(trace)
+
+        summary = stats.summary(percentiles=(50, 99.9))
+        self.assertEqual(stats.count, 150)
+        self.assertEqual(summary["total"]["max"], 149.0)
+        self.assertEqual(summary["total"]["p50"], 99.5)
+        self.assertIn("p99.9", summary["total"])
+        self.assertEqual(summary["chunks"]["mean"], 2.0)
+
+        stats.reset()
+        self.assertEqual(stats.summary(), {})
+
+
+class TestCutoutTrace(unittest.TestCase):
+
+    CHUNKSIZE = (64, 64, 8)
+
+    @classmethod
+    def setUpClass(cls):
+        """Create a local precomputed volume standing in for S3, with its last chunks missing"""
+        cls.bucket = tempfile.mkdtemp()
+        data = get_image_dict(storage_type="cloudvol")
+        data["channel"]["bucket"] = cls.bucket
+        data["coord_frame"]["x_stop"] = 128
+        data["coord_frame"]["y_stop"] = 128
+        data["coord_frame"]["z_stop"] = 16
+        cls.resource = BossResourceBasic(data)
+
+        cls.vol = create_local_cloudvolume(cls.resource, cls.CHUNKSIZE)
+        cls.vol[:, :, 0:8] = np.random.randint(1, 254, size=(128, 128, 8), dtype=np.uint8)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.bucket)
+
+    def setUp(self):
+        self.traces = []
+        self.stats = StatsAggregator()
+        self.db = CloudVolumeDB(handle_cache=VolumeHandleCache(factory=open_local_volume), chunk_cache=ChunkCache(),
+                                hooks=[self.traces.append, self.stats])
+
+    def test_breakdown(self):
+        """Each cutout reports its phases, bytes, chunks, cache hits and missing chunks"""
+        self.db.cutout(self.resource, (0, 0, 0), (128, 128, 16), 0)
+        self.db.cutout(self.resource, (0, 0, 0), (64, 64, 8), 0)
+
+        first, second = [trace.as_dict() for trace in self.traces]
+        self.assertTrue(first["ok"])
+        self.assertEqual(first["extent"], (128, 128, 16))
+        self.assertEqual(first["chunks"], 8)
+        self.assertEqual(first["missing"], 4)
+        self.assertEqual(first["cache_hits"], 0)
+        self.assertEqual(first["bytes"], 4 * 64 * 64 * 8)
+        for phase in ("info", "allocate", "download", "decode", "paste", "total"):
+            self.assertGreater(first[phase], 0)
+
+        self.assertEqual(second["chunks"], 1)
+        self.assertEqual(second["cache_hits"], 1)
+        self.assertEqual(second["bytes"], 0)
+        self.assertEqual(self.stats.summary()["chunks"]["max"], 8)
+
+    def test_failed_cutout(self):
+        """Failed cutouts are traced, and a failing hook doesn't fail the cutout"""
+        def broken(trace):
+            raise ValueError("broken hook")
+
+        self.db.hooks.insert(0, broken)
+        with self.assertRaises(CVDBError):
+            self.db.cutout(self.resource, (100, 0, 0), self.CHUNKSIZE, 0)
+        self.assertFalse(self.traces[-1].labels["ok"])
+
+        self.db.cutout(self.resource, (0, 0, 0), self.CHUNKSIZE, 0)
+        self.assertTrue(self.traces[-1].labels["ok"])
@@ -0,0 +1,72 @@
+# Copyright 2021 The Johns Hopkins University Applied Physics Laboratory
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from cvdb import CloudVolumeDB, ChunkCache, CVDBError, VolumeHandleCache
+from cvdb.project import BossResourceBasic
+from cvdb.project.test.resource_setup import get_image_dict
+from .setup import create_local_cloudvolume, open_local_volume
+
+
+class TestIterCutout(unittest.TestCase):
+
+    CHUNKSIZE = (64, 64, 8)
+
+    @classmethod
+    def setUpClass(cls):
+        """Create a local precomputed volume standing in for S3"""
+        cls.bucket = tempfile.mkdtemp()
+        data = get_image_dict(storage_type="cloudvol")
+        data["channel"]["bucket"] = cls.bucket
+        data["coord_frame"]["x_stop"] = 128
+        data["coord_frame"]["y_stop"] = 128
+        data["coord_frame"]["z_stop"] = 40
+        cls.resource = BossResourceBasic(data)
+
+        cls.vol = create_local_cloudvolume(cls.resource, cls.CHUNKSIZE)
+        cls.data = np.random.randint(1, 254, size=(128, 128, 40), dtype=np.uint8)
+        cls.vol[:, :, :] = cls.data
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.bucket)
+
+    def setUp(self):
+        self.db = CloudVolumeDB(handle_cache=VolumeHandleCache(factory=open_local_volume), chunk_cache=ChunkCache())
+
+    def test_slabs(self):
+        """Slabs are chunk aligned, in order and reassemble the region"""
+        corner, extent = (10, 20, 3), (100, 90, 30)
+        cubes = list(self.db.iter_cutout(self.resource, corner, extent, 0, slab_depth=10))
+
+        # Depth rounds up to 16, so boundaries fall on z = 16 and 32
+        self.assertEqual([cube.z_dim for cube in cubes], [13, 16, 1])
+        np.testing.assert_array_equal(np.concatenate([cube.data for cube in cubes], axis=1),
+                                      self.db.cutout(self.resource, corner, extent, 0).data)
+
+    def test_default_depth(self):
+        """Without a depth, each slab is one chunk deep"""
+        cubes = list(self.db.iter_cutout(self.resource, (0, 0, 0), (128, 128, 40), 0))
+        self.assertEqual([cube.z_dim for cube in cubes], [8] * 5)
+        np.testing.assert_array_equal(cubes[2].data[0], self.data[:, :, 16:24].T)
+
+    def test_out_of_bounds(self):
+        """Bounds are checked when iteration starts"""
+        with self.assertRaises(CVDBError):
+            next(self.db.iter_cutout(self.resource, (0, 0, 0), (128, 128, 41), 0))
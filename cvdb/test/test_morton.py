@@ -0,0 +1,54 @@
+# Copyright 2021 The Johns Hopkins University Applied Physics Laboratory
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import unittest
+
+import numpy as np
+
+from cvdb import CVDBError
+from cvdb.morton import xyz_morton, morton_xyz
+
+
+def reference_morton(x, y, z):
+    """Bit by bit interleaving, as in ndlib's XYZMorton"""
+    morton = 0
+    for bit in range(21):
+        morton |= ((x >> bit) & 1) << 3 * bit | ((y >> bit) & 1) << 3 * bit + 1 | ((z >> bit) & 1) << 3 * bit + 2
+    return morton
+
+
+class TestMorton(unittest.TestCase):
+
+    def test_encode(self):
+        """IDs interleave x, y and z bits, x lowest"""
+        self.assertEqual(xyz_morton([1, 0, 0]), 1)
+        self.assertEqual(xyz_morton([0, 1, 0]), 2)
+        self.assertEqual(xyz_morton([0, 0, 1]), 4)
+        self.assertEqual(xyz_morton([2, 3, 1]), 0b011110)
+
+        indices = np.random.randint(0, 2 ** 21, size=(200, 3))
+        ids = xyz_morton(indices)
+        self.assertEqual(ids.dtype, np.uint64)
+        self.assertEqual([int(i) for i in ids], [reference_morton(*(int(i) for i in index)) for index in indices])
+
+    def test_decode(self):
+        indices = np.random.randint(0, 2 ** 21, size=(1000, 3))
+        np.testing.assert_array_equal(morton_xyz(xyz_morton(indices)), indices)
+        np.testing.assert_array_equal(morton_xyz(6), [0, 1, 1])
+
+    def test_out_of_range(self):
+        with self.assertRaises(CVDBError):
+            xyz_morton([2 ** 21, 0, 0])
+        with self.assertRaises(CVDBError):
+            xyz_morton([[-1, 0, 0]])
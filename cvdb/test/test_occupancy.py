@@ -0,0 +1,196 @@
+# Copyright 2021 The Johns Hopkins University Applied Physics Laboratory
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+import numpy as np
+
+from cvdb import CloudVolumeDB, ChunkCache, ChunkOccupancy, OccupancyIndex, VolumeHandleCache
+from cvdb.chunks import ChunkGrid
+from cvdb.project import BossResourceBasic
+from cvdb.project.test.resource_setup import get_image_dict
+from .setup import create_local_cloudvolume, open_local_volume
+
+
+class TestOccupancy(unittest.TestCase):
+
+    CHUNKSIZE = (64, 64, 8)
+
+    def setUp(self):
+        """Create a sparse local volume: only the chunks of the first z slab exist"""
+        self.bucket = tempfile.mkdtemp()
+        self.index_dir = tempfile.mkdtemp()
+        data = get_image_dict(storage_type="cloudvol")
+        data["channel"]["bucket"] = self.bucket
+        data["coord_frame"]["x_stop"] = 128
+        data["coord_frame"]["y_stop"] = 128
+        data["coord_frame"]["z_stop"] = 16
+        self.resource = BossResourceBasic(data)
+
+        self.vol = create_local_cloudvolume(self.resource, self.CHUNKSIZE)
+        self.data = np.zeros((128, 128, 16), dtype=np.uint8)
+        self.data[:, :, 0:8] = np.random.randint(1, 254, size=(128, 128, 8), dtype=np.uint8)
+        self.vol[:, :, 0:8] = self.data[:, :, 0:8]
+
+    def tearDown(self):
+        shutil.rmtree(self.bucket)
+        shutil.rmtree(self.index_dir)
+
+    def get_db(self, occupancy):
+        return CloudVolumeDB(handle_cache=VolumeHandleCache(factory=open_local_volume), chunk_cache=ChunkCache(),
+                             occupancy=occupancy)
+
+    def test_index(self):
+        """Indexes parse chunk names, including compressed file:// ones, and survive a save and load"""
+        grid = ChunkGrid(self.vol)
+        index = OccupancyIndex.from_filenames(grid, ["4_4_35/0-64_64-128_8-16.gz", "4_4_35/64-128_0-64_0-8",
+                                                     "info", "4_4_35/provenance"])
+        self.assertEqual(index.grid_shape, (2, 2, 2))
+        self.assertEqual(len(index), 2)
+        self.assertIn((0, 1, 1), index)
+        self.assertIn((1, 0, 0), index)
+        self.assertNotIn((0, 0, 0), index)
+        self.assertNotIn((5, 0, 0), index)
+
+        index.discard([(1, 0, 0)])
+        file_path = os.path.join(self.index_dir, "index.npz")
+        index.save(file_path)
+        loaded = OccupancyIndex.load(file_path)
+        self.assertEqual(loaded.grid_shape, (2, 2, 2))
+        self.assertEqual(len(loaded), 1)
+        self.assertIn((0, 1, 1), loaded)
+
+    def test_built_index(self):
+        """An index built offline answers for absent chunks, follows writes and is persisted"""
+        occupancy = ChunkOccupancy(self.index_dir)
+        db = self.get_db(occupancy)
+        index = db.build_occupancy(self.resource, 0)
+        self.assertEqual(len(index), 4)
+
+        cube = db.cutout(self.resource, (0, 0, 0), (128, 128, 16), 0)
+        np.testing.assert_array_equal(cube.data[0], self.data.T)
+        self.assertEqual(occupancy.skipped, 4)
+
+        data = np.random.randint(1, 254, size=(8, 64, 64), dtype=np.uint8)
+        db.write_cuboid(self.resource, (64, 0, 8), 0, data)
+        self.assertEqual(len(index), 5)
+        cube = db.cutout(self.resource, (64, 0, 8), (64, 64, 8), 0)
+        np.testing.assert_array_equal(cube.data[0], data)
+
+        # A new tracker picks up the persisted index once the update is saved
+        occupancy.flush()
+        reloaded = ChunkOccupancy(self.index_dir)
+        cloudpath = db.get_volume(self.resource.get_channel(), 0).meta.cloudpath
+        self.assertEqual(len(reloaded.get_index(cloudpath, 0)), 5)
+        self.assertIsNone(reloaded.get_index(cloudpath, 1))
+
+    def test_negative_cache(self):
+        """Without an index, missing chunks are learned from storage and remembered until they expire or are written"""
+        occupancy = ChunkOccupancy(ttl=60)
+        db = self.get_db(occupancy)
+
+        db.cutout(self.resource, (0, 0, 0), (128, 128, 16), 0)
+        self.assertEqual(occupancy.learned, 4)
+        self.assertEqual(len(occupancy), 4)
+
+        cube = db.cutout(self.resource, (0, 0, 0), (128, 128, 16), 0)
+        np.testing.assert_array_equal(cube.data[0], self.data.T)
+        self.assertEqual(occupancy.skipped, 4)
+
+        # no_cache skips the chunk caches but not the tracker, raw asks storage
+        db.cutout(self.resource, (0, 0, 8), (128, 128, 8), 0, access_mode="no_cache")
+        self.assertEqual(occupancy.skipped, 8)
+        db.cutout(self.resource, (0, 0, 8), (128, 128, 8), 0, access_mode="raw")
+        self.assertEqual(occupancy.skipped, 8)
+
+        data = np.random.randint(1, 254, size=(8, 64, 64), dtype=np.uint8)
+        db.write_cuboid(self.resource, (0, 64, 8), 0, data)
+        self.assertEqual(len(occupancy), 3)
+        cube = db.cutout(self.resource, (0, 64, 8), (64, 64, 8), 0)
+        np.testing.assert_array_equal(cube.data[0], data)
+
+        expired = ChunkOccupancy(ttl=0)
+        db = self.get_db(expired)
+        db.cutout(self.resource, (0, 0, 8), (128, 128, 8), 0)
+        db.cutout(self.resource, (0, 0, 8), (128, 128, 8), 0)
+        self.assertEqual(expired.skipped, 0)
+        self.assertEqual(expired.learned, 6)
+
+    def test_unreadable_index(self):
+        """A corrupt index file is ignored and the volume is read as if it had no index"""
+        occupancy = ChunkOccupancy(self.index_dir)
+        db = self.get_db(occupancy)
+        cloudpath = db.get_volume(self.resource.get_channel(), 0).meta.cloudpath
+        file_path = occupancy.file_path(cloudpath, 0)
+        os.makedirs(os.path.dirname(file_path))
+        with open(file_path, "wb") as fh:
+            fh.write(b"not an index")
+
+        with self.assertLogs(level="WARNING"):
+            cube = db.cutout(self.resource, (0, 0, 0), (128, 128, 16), 0)
+        np.testing.assert_array_equal(cube.data[0], self.data.T)
+        self.assertIsNone(occupancy.get_index(cloudpath, 0))
+
+    def test_unsaved_index(self):
+        """Failing to persist the index doesn't fail the write that updated it"""
+        occupancy = ChunkOccupancy(self.index_dir)
+        db = self.get_db(occupancy)
+        index = db.build_occupancy(self.resource, 0)
+
+        data = np.random.randint(1, 254, size=(8, 64, 64), dtype=np.uint8)
+        with mock.patch.object(OccupancyIndex, "save", side_effect=OSError("disk full")):
+            with self.assertLogs(level="WARNING"):
+                db.write_cuboid(self.resource, (64, 0, 8), 0, data)
+                occupancy.flush()
+        self.assertEqual(len(index), 5)
+        np.testing.assert_array_equal(db.cutout(self.resource, (64, 0, 8), (64, 64, 8), 0).data[0], data)
+
+    def test_shared_index(self):
+        """Saves are batched until flushed, and other processes reload the index and keep each other's updates"""
+        writer = ChunkOccupancy(self.index_dir, reload_interval=0, save_delay=60)
+        db = self.get_db(writer)
+        db.build_occupancy(self.resource, 0)
+        cloudpath = db.get_volume(self.resource.get_channel(), 0).meta.cloudpath
+        file_path = writer.file_path(cloudpath, 0)
+        reader = ChunkOccupancy(self.index_dir, reload_interval=0)
+        self.assertNotIn((1, 0, 1), reader.get_index(cloudpath, 0))
+
+        data = np.random.randint(1, 254, size=(8, 64, 64), dtype=np.uint8)
+        mtime = os.stat(file_path).st_mtime_ns
+        db.write_cuboid(self.resource, (64, 0, 8), 0, data)
+        self.assertEqual(os.stat(file_path).st_mtime_ns, mtime)
+        self.assertNotIn((1, 0, 1), reader.get_index(cloudpath, 0))
+
+        writer.flush()
+        self.assertIn((1, 0, 1), reader.get_index(cloudpath, 0))
+        np.testing.assert_array_equal(self.get_db(reader).cutout(self.resource, (64, 0, 8), (64, 64, 8), 0).data[0],
+                                      data)
+
+        # Each process merges its updates into the other's
+        reader.record_present(cloudpath, 0, [(0, 1, 1)])
+        writer.record_present(cloudpath, 0, [(0, 0, 1)])
+        reader.flush()
+        writer.flush()
+        index = OccupancyIndex.load(file_path)
+        self.assertEqual(len(index), 7)
+        self.assertIn((0, 1, 1), index)
+        self.assertIn((0, 0, 1), index)
+
+        # A deleted index stops being trusted
+        os.unlink(file_path)
+        self.assertIsNone(reader.get_index(cloudpath, 0))
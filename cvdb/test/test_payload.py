@@ -0,0 +1,124 @@
+# Copyright 2021 The Johns Hopkins University Applied Physics Laboratory
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import shutil
+import tempfile
+import unittest
+
+import blosc
+import numpy as np
+
+from cvdb import BloscPayload, CloudVolumeDB, ChunkCache, Cube, VolumeHandleCache
+from cvdb.project import BossResourceBasic
+from cvdb.project.test.resource_setup import get_anno_dict, get_image_dict
+from .setup import create_local_cloudvolume, open_local_volume
+
+
+class TestBloscPayload(unittest.TestCase):
+
+    def build(self, data, **kwargs):
+        payload = BloscPayload(data.shape, data.dtype, **kwargs)
+        # Planes are added out of order, as the compression threads finish them
+        for t in reversed(range(data.shape[0])):
+            for z in reversed(range(data.shape[1])):
+                payload.add_plane(t, z, data[t, z])
+        return payload.getvalue()
+
+    def test_stitched(self):
+        """The stitched buffer decompresses to the whole array with every codec and shuffle"""
+        data = np.zeros((2, 3, 512, 300), dtype=np.uint16)
+        data[:, :, 100:400] = np.arange(300, dtype=np.uint16)
+        for cname in ("blosclz", "lz4", "zstd"):
+            for shuffle in (blosc.NOSHUFFLE, blosc.SHUFFLE, blosc.BITSHUFFLE):
+                payload = self.build(data, cname=cname, shuffle=shuffle)
+                self.assertEqual(blosc.decompress(payload), data.tobytes())
+                self.assertEqual(blosc.get_clib(payload), blosc.cname2clib[cname])
+
+    def test_incompressible(self):
+        """Blocks blosc stores raw are kept raw, or recompressed as a whole buffer if others compressed"""
+        data = np.random.randint(0, 255, size=(1, 2, 256, 256), dtype=np.uint8)
+        payload = self.build(data)
+        self.assertEqual(len(payload), data.nbytes + 16)
+        self.assertEqual(blosc.decompress(payload), data.tobytes())
+
+        data[0, 0] = 0
+        self.assertEqual(blosc.decompress(self.build(data)), data.tobytes())
+
+    def test_supported(self):
+        self.assertTrue(BloscPayload.supported((1, 16, 512, 512), np.uint8))
+        self.assertTrue(BloscPayload.supported((1, 16, 64, 64), np.uint64))
+        self.assertFalse(BloscPayload.supported((1, 16, 64, 64), np.uint8))
+
+
+class TestCutoutCompressed(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.bucket = tempfile.mkdtemp()
+        cls.image = np.zeros((2, 40, 256, 256), dtype=np.uint8)
+        cls.image[:, :, 64:192, 32:224] = np.random.randint(1, 8, size=(2, 40, 128, 192))
+        cls.image_resource = cls.get_resource(get_image_dict(storage_type="cloudvol"), "col1/exp1/image")
+        vol = create_local_cloudvolume(cls.image_resource, (64, 64, 8), num_channels=2)
+        vol[:, :, :] = cls.image.T
+
+        cls.anno = np.random.randint(1, 4, size=(40, 256, 256)).astype(np.uint64)
+        cls.anno_resource = cls.get_resource(get_anno_dict(storage_type="cloudvol"), "col1/exp1/anno")
+        vol = create_local_cloudvolume(cls.anno_resource, (64, 64, 8))
+        vol[:, :, :] = cls.anno.T
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.bucket)
+
+    @classmethod
+    def get_resource(cls, data, cv_path):
+        data["channel"]["bucket"] = cls.bucket
+        data["channel"]["cv_path"] = cv_path
+        data["coord_frame"]["x_stop"] = 256
+        data["coord_frame"]["y_stop"] = 256
+        data["coord_frame"]["z_stop"] = 40
+        return BossResourceBasic(data)
+
+    def setUp(self):
+        self.db = CloudVolumeDB(handle_cache=VolumeHandleCache(factory=open_local_volume), chunk_cache=ChunkCache())
+
+    def unpack(self, resource, payload, extent, num_time_samples=1):
+        cube = Cube.create_cube(resource, extent)
+        cube.from_blosc(payload, [0, num_time_samples])
+        return cube.data
+
+    def test_image(self):
+        """Aligned and unaligned regions, with several time samples, match cutout()"""
+        for corner, extent in (((0, 0, 0), (256, 256, 40)), ((3, 10, 5), (250, 240, 30))):
+            payload = self.db.cutout_compressed(self.image_resource, corner, extent, 0, time_sample_range=[0, 2])
+            expected = self.db.cutout(self.image_resource, corner, extent, 0, time_sample_range=[0, 2]).data
+            np.testing.assert_array_equal(self.unpack(self.image_resource, payload, extent, 2), expected)
+
+    def test_annotation(self):
+        """Annotation regions match cutout(), also when filtered"""
+        corner, extent = (30, 5, 7), (100, 120, 20)
+        payload = self.db.cutout_compressed(self.anno_resource, corner, extent, 0)
+        np.testing.assert_array_equal(self.unpack(self.anno_resource, payload, extent),
+                                      self.anno[np.newaxis, 7:27, 5:125, 30:130])
+
+        payload = self.db.cutout_compressed(self.anno_resource, corner, extent, 0, filter_ids=[2])
+        expected = self.db.cutout(self.anno_resource, corner, extent, 0, filter_ids=[2]).data
+        np.testing.assert_array_equal(self.unpack(self.anno_resource, payload, extent), expected)
+
+    def test_small_region(self):
+        """Regions with small z planes are compressed whole"""
+        corner, extent = (10, 20, 3), (30, 40, 12)
+        payload = self.db.cutout_compressed(self.image_resource, corner, extent, 0)
+        np.testing.assert_array_equal(self.unpack(self.image_resource, payload, extent),
+                                      self.image[:1, 3:15, 20:60, 10:40])
@@ -0,0 +1,99 @@
+# Copyright 2021 The Johns Hopkins University Applied Physics Laboratory
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from cvdb import CloudVolumeDB, ChunkCache, Propagator, VolumeHandleCache
+from cvdb.downsample import pool_mean, pool_mode
+from cvdb.project import BossResourceBasic
+from cvdb.project.test.resource_setup import get_anno_dict, get_image_dict
+from .setup import create_local_cloudvolume, open_local_volume
+
+
+class TestPropagator(unittest.TestCase):
+
+    def setUp(self):
+        self.bucket = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.bucket)
+
+    def create(self, data):
+        """Create a volume with the anisotropic hierarchy down to resolution 4 and the isotropic version of 4"""
+        data["channel"]["bucket"] = self.bucket
+        data["coord_frame"]["x_stop"] = 256
+        data["coord_frame"]["y_stop"] = 256
+        data["coord_frame"]["z_stop"] = 40
+        resource = BossResourceBasic(data)
+
+        vol = create_local_cloudvolume(resource, (64, 64, 8))
+        for factor in ((2, 2, 1), (4, 4, 1), (8, 8, 1), (16, 16, 1), (16, 16, 2)):
+            vol.add_scale(factor, chunk_size=(16, 16, 8))
+        vol.commit_info()
+
+        db = CloudVolumeDB(handle_cache=VolumeHandleCache(factory=open_local_volume), chunk_cache=ChunkCache())
+        return resource, db
+
+    def test_schedule(self):
+        """Anisotropic levels pool x and y, the isotropic scale is pooled from the isotropic level"""
+        resource, db = self.create(get_image_dict(storage_type="cloudvol"))
+        self.assertEqual(Propagator(db).schedule(resource),
+                         [(0, 1, (2, 2, 1)), (1, 2, (2, 2, 1)), (2, 3, (2, 2, 1)), (3, 4, (2, 2, 1)),
+                          (3, 5, (2, 2, 2))])
+
+    def test_image(self):
+        """Writes are mean pooled into every coarser mip, rebuilding only the chunks covering them"""
+        resource, db = self.create(get_image_dict(storage_type="cloudvol"))
+        data = np.random.randint(1, 254, size=(40, 256, 256), dtype=np.uint8)
+        db.write_cuboid(resource, (0, 0, 0), 0, data, propagate=True)
+
+        expected = data[np.newaxis]
+        for mip in range(1, 5):
+            expected = pool_mean(expected, (2, 2, 1))
+            np.testing.assert_array_equal(db.cutout(resource, (0, 0, 0), expected.shape[:0:-1], mip).data,
+                                          expected)
+        iso = pool_mean(pool_mean(pool_mean(data[np.newaxis], (2, 2, 1)), (2, 2, 1)), (2, 2, 1))
+        iso = pool_mean(iso, (2, 2, 2))
+        np.testing.assert_array_equal(db.cutout(resource, (0, 0, 0), (16, 16, 20), 4, iso=True).data, iso)
+
+        # One chunk of mip 0 dirties 4 chunks of mip 1 and a single chunk of every level above
+        patch = np.zeros((8, 64, 64), dtype=np.uint8)
+        db.write_cuboid(resource, (0, 0, 0), 0, patch)
+        propagator = Propagator(db)
+        self.assertEqual(resource.get_channel().downsample_status, "DOWNSAMPLED")
+        propagator.mark_region(resource, 0, (0, 0, 0), (64, 64, 8))
+        self.assertEqual(resource.get_channel().downsample_status, "NOT_DOWNSAMPLED")
+        self.assertEqual(propagator.flush(), 4 + 1 + 1 + 1 + 1)
+        self.assertEqual(resource.get_channel().downsample_status, "DOWNSAMPLED")
+        self.assertEqual(propagator.flush(), 0)
+
+        mip1 = db.cutout(resource, (0, 0, 0), (64, 64, 8), 1).data
+        np.testing.assert_array_equal(mip1[:, :, :32, :32], 0)
+        expected = pool_mean(data[np.newaxis, :8], (2, 2, 1))
+        np.testing.assert_array_equal(mip1[:, :, 32:, 32:], expected[:, :, 32:64, 32:64])
+
+    def test_annotation(self):
+        """Annotations are mode pooled"""
+        resource, db = self.create(get_anno_dict(storage_type="cloudvol"))
+        data = np.random.randint(1, 4, size=(8, 64, 64), dtype=np.uint64)
+        db.write_cuboid(resource, (64, 0, 8), 0, data, propagate=True)
+
+        expected = pool_mode(data[np.newaxis], (2, 2, 1))
+        np.testing.assert_array_equal(db.cutout(resource, (32, 0, 8), (32, 32, 8), 1).data, expected)
+        expected = pool_mode(expected, (2, 2, 1))
+        np.testing.assert_array_equal(db.cutout(resource, (16, 0, 8), (16, 16, 8), 2).data, expected)
@@ -0,0 +1,131 @@
+# Copyright 2021 The Johns Hopkins University Applied Physics Laboratory
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import shutil
+import tempfile
+import threading
+import unittest
+
+import numpy as np
+
+from cvdb import CloudVolumeDB, ChunkCache, ReadAhead, VolumeHandleCache
+from cvdb.project import BossResourceBasic
+from cvdb.project.test.resource_setup import get_image_dict
+from .setup import create_local_cloudvolume, open_local_volume
+
+
+class TestReadAhead(unittest.TestCase):
+
+    CHUNKSIZE = (64, 64, 8)
+
+    @classmethod
+    def setUpClass(cls):
+        """Create a local precomputed volume standing in for S3"""
+        cls.bucket = tempfile.mkdtemp()
+        data = get_image_dict(storage_type="cloudvol")
+        data["channel"]["bucket"] = cls.bucket
+        data["coord_frame"]["x_stop"] = 128
+        data["coord_frame"]["y_stop"] = 128
+        data["coord_frame"]["z_stop"] = 48
+        cls.resource = BossResourceBasic(data)
+
+        cls.vol = create_local_cloudvolume(cls.resource, cls.CHUNKSIZE)
+        cls.data = np.random.randint(1, 254, size=(128, 128, 48), dtype=np.uint8)
+        cls.vol[:, :, :] = cls.data
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.bucket)
+
+    def get_db(self, **kwargs):
+        self.readahead = ReadAhead(**kwargs)
+        self.addCleanup(self.readahead.shutdown)
+        return CloudVolumeDB(handle_cache=VolumeHandleCache(factory=open_local_volume), chunk_cache=ChunkCache(),
+                             readahead=self.readahead)
+
+    def test_z_stack(self):
+        """A z walk prefetches the next slab, which the next cutout uses"""
+        db = self.get_db()
+        for z in (0, 8, 16):
+            db.cutout(self.resource, (0, 0, z), (128, 128, 8), 0, client_key="viewer")
+        self.readahead.shutdown()
+        self.assertEqual(self.readahead.stats()["prefetched"], 4)
+
+        cube = db.cutout(self.resource, (0, 0, 24), (128, 128, 8), 0, client_key="viewer")
+        np.testing.assert_array_equal(cube.data[0], self.data[:, :, 24:32].T)
+        stats = self.readahead.stats()
+        self.assertEqual(stats["used"], 4)
+        self.assertEqual(stats["use_rate"], 1.0)
+
+    def test_streams_are_separate(self):
+        """Interleaved clients and irregular moves don't trigger prefetching"""
+        db = self.get_db()
+        for z in (0, 8, 16):
+            db.cutout(self.resource, (0, 0, z), (64, 64, 8), 0, client_key="a")
+            db.cutout(self.resource, (64, 64, 40 - z), (64, 64, 8), 0, client_key="b")
+        db.cutout(self.resource, (0, 0, 40), (64, 64, 8), 0, client_key="c")
+        db.cutout(self.resource, (64, 0, 0), (64, 64, 8), 0, client_key="c")
+        self.readahead.shutdown()
+
+        # Only the two regular streams prefetch, one chunk each
+        self.assertEqual(self.readahead.stats()["prefetched"], 2)
+        self.assertEqual(self.readahead.stats()["streams"], 3)
+
+    def test_budget(self):
+        """Prefetched chunks beyond the budget are dropped and counted as wasted"""
+        db = self.get_db(max_bytes=64 * 64 * 8, depth=2)
+        for z in (0, 8, 16):
+            db.cutout(self.resource, (0, 0, z), (64, 64, 8), 0, client_key="viewer")
+        self.readahead.shutdown()
+
+        stats = self.readahead.stats()
+        self.assertEqual(stats["prefetched"], 2)
+        self.assertEqual(stats["wasted"], 1)
+        self.assertLessEqual(stats["buffered_bytes"], 64 * 64 * 8)
+
+    def test_write_after_prefetch(self):
+        """Writes drop prefetched chunks, so the next cutout reads the new data"""
+        db = self.get_db()
+        for z in (0, 8, 16):
+            db.cutout(self.resource, (0, 0, z), (128, 128, 8), 0, client_key="viewer")
+        self.readahead.shutdown()
+        self.assertEqual(self.readahead.stats()["prefetched"], 4)
+
+        self.addCleanup(self.vol.__setitem__, (slice(None), slice(None), slice(24, 32)), self.data[:, :, 24:32])
+        db.write_cuboid(self.resource, (0, 0, 24), 0, np.full((8, 128, 128), 9, dtype=np.uint8))
+        cube = db.cutout(self.resource, (0, 0, 24), (128, 128, 8), 0, client_key="viewer")
+        np.testing.assert_array_equal(cube.data, 9)
+        self.assertEqual(self.readahead.stats()["used"], 0)
+
+    def test_invalidate_during_prefetch(self):
+        """Prefetches downloading when chunks are invalidated don't reach the buffer"""
+        db = self.get_db()
+        reader = db.get_reader(db.get_volume(self.resource.get_channel(), 0), channel=self.resource.get_channel())
+        started, release = threading.Event(), threading.Event()
+        download = reader.download
+
+        def slow_download(index):
+            started.set()
+            release.wait()
+            return download(index)
+
+        reader.download = slow_download
+        self.assertEqual(self.readahead.schedule(reader, [(0, 0, 0)]), 1)
+        started.wait()
+        self.readahead.invalidate(reader.cloudpath, 0, [(0, 0, 0)])
+        release.set()
+        self.readahead.shutdown()
+
+        self.assertEqual(self.readahead.stats()["prefetched"], 0)
+        self.assertIsNone(self.readahead.take(ChunkCache.make_key(reader.cloudpath, 0, (0, 0, 0))))
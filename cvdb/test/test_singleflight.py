@@ -0,0 +1,129 @@
+# Copyright 2021 The Johns Hopkins University Applied Physics Laboratory
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+
+import numpy as np
+
+from cvdb import CloudVolumeDB, ChunkCache, SingleFlight, VolumeHandleCache
+from cvdb.chunks import ChunkReader
+from cvdb.project import BossResourceBasic
+from cvdb.project.test.resource_setup import get_image_dict
+from .setup import create_local_cloudvolume, open_local_volume
+
+
+class TestSingleFlight(unittest.TestCase):
+
+    def test_coalesce(self):
+        """Callers arriving while a fetch is in flight share its result"""
+        flights = SingleFlight()
+        started = threading.Event()
+        release = threading.Event()
+        calls = []
+
+        def fetch():
+            calls.append(1)
+            started.set()
+            release.wait(5)
+            return "data"
+
+        with ThreadPoolExecutor(max_workers=4) as pool:
+            leader = pool.submit(flights.do, "key", fetch)
+            started.wait(5)
+            followers = [pool.submit(flights.do, "key", fetch) for _ in range(3)]
+            while flights.saved < 3:
+                time.sleep(0.001)
+            release.set()
+            results = [leader.result()] + [f.result() for f in followers]
+
+        self.assertEqual(results, ["data"] * 4)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(flights.stats(), {"in_flight": 0, "fetches": 1, "saved": 3, "saved_rate": 0.75})
+
+        # Finished fetches are forgotten
+        self.assertEqual(flights.do("key", lambda: "new"), "new")
+        self.assertEqual(flights.fetches, 2)
+
+    def test_error(self):
+        """Waiters get the leader's exception"""
+        flights = SingleFlight()
+        future, leader = flights.claim("key")
+        waiter, waiter_leader = flights.claim("key")
+        self.assertTrue(leader)
+        self.assertFalse(waiter_leader)
+
+        flights.finish("key", future, error=ValueError("boom"))
+        with self.assertRaises(ValueError):
+            waiter.result()
+        self.assertEqual(len(flights), 0)
+
+
+class TestCoalescedCutouts(unittest.TestCase):
+
+    CHUNKSIZE = (64, 64, 8)
+
+    @classmethod
+    def setUpClass(cls):
+        """Create a local precomputed volume standing in for S3"""
+        cls.bucket = tempfile.mkdtemp()
+        data = get_image_dict(storage_type="cloudvol")
+        data["channel"]["bucket"] = cls.bucket
+        data["coord_frame"]["x_stop"] = 128
+        data["coord_frame"]["y_stop"] = 128
+        data["coord_frame"]["z_stop"] = 16
+        cls.resource = BossResourceBasic(data)
+
+        cls.vol = create_local_cloudvolume(cls.resource, cls.CHUNKSIZE)
+        cls.data = np.random.randint(1, 254, size=(128, 128, 16), dtype=np.uint8)
+        cls.vol[:, :, :] = cls.data
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.bucket)
+
+    def test_concurrent_cutouts(self):
+        """Concurrent cutouts of the same region share chunk downloads"""
+        flights = SingleFlight()
+        db = CloudVolumeDB(handle_cache=VolumeHandleCache(factory=open_local_volume), chunk_cache=ChunkCache(),
+                           single_flight=flights)
+        db.get_volume(self.resource.get_channel(), 0)
+
+        load = ChunkReader.load
+        loads = []
+        barrier = threading.Barrier(4)
+
+        def slow_load(reader, index):
+            loads.append(index)
+            time.sleep(0.05)
+            return load(reader, index)
+
+        def cutout():
+            barrier.wait(5)
+            return db.cutout(self.resource, (0, 0, 0), (128, 128, 16), 0)
+
+        with mock.patch.object(ChunkReader, "load", slow_load):
+            with ThreadPoolExecutor(max_workers=4) as pool:
+                cubes = list(pool.map(lambda _: cutout(), range(4)))
+
+        for cube in cubes:
+            np.testing.assert_array_equal(cube.data[0], self.data.T)
+        self.assertEqual(len(loads), flights.fetches)
+        self.assertLess(flights.fetches, 4 * 8)
+        self.assertGreater(flights.saved, 0)
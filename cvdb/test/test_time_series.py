@@ -0,0 +1,136 @@
+# Copyright 2021 The Johns Hopkins University Applied Physics Laboratory
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+import numpy as np
+
+from cvdb import CloudVolumeDB, ChunkCache, Cube, CVDBError, VolumeHandleCache
+from cvdb.project import BossResourceBasic
+from cvdb.project.test.resource_setup import get_image_dict
+from .setup import create_local_cloudvolume, open_local_volume
+
+
+class TestTimeSeries(unittest.TestCase):
+
+    CHUNKSIZE = (64, 64, 8)
+    NUM_TIME_SAMPLES = 3
+
+    @classmethod
+    def setUpClass(cls):
+        """Create one volume with time on the channel axis and one with a layer per time sample"""
+        cls.bucket = tempfile.mkdtemp()
+        cls.data = np.random.randint(1, 254, size=(cls.NUM_TIME_SAMPLES, 16, 100, 120), dtype=np.uint8)
+
+        cls.channel_resource = cls.get_resource("col1/exp1/chan_axis")
+        vol = create_local_cloudvolume(cls.channel_resource, cls.CHUNKSIZE, num_channels=cls.NUM_TIME_SAMPLES)
+        vol[:, :, :] = cls.data.T
+
+        cls.layer_resource = cls.get_resource("col1/exp1/chan_layers")
+        for t in range(cls.NUM_TIME_SAMPLES):
+            cv_path = "col1/exp1/chan_layers" + (f"_t{t}" if t else "")
+            vol = create_local_cloudvolume(cls.get_resource(cv_path), cls.CHUNKSIZE)
+            vol[:, :, :] = cls.data[t].T
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.bucket)
+
+    @classmethod
+    def get_resource(cls, cv_path):
+        data = get_image_dict(storage_type="cloudvol")
+        data["channel"]["bucket"] = cls.bucket
+        data["channel"]["cv_path"] = cv_path
+        data["coord_frame"]["x_stop"] = 120
+        data["coord_frame"]["y_stop"] = 100
+        data["coord_frame"]["z_stop"] = 16
+        return BossResourceBasic(data)
+
+    def setUp(self):
+        self.db = CloudVolumeDB(cv_config={"time_layer_template": "{cv_path}_t{time_sample}"},
+                                handle_cache=VolumeHandleCache(factory=open_local_volume), chunk_cache=ChunkCache())
+
+    def test_cutout_time_range(self):
+        """Both layouts return the requested time samples in a 4D cube"""
+        corner, extent = (10, 20, 3), (100, 70, 10)
+        for resource in (self.channel_resource, self.layer_resource):
+            cube = self.db.cutout(resource, corner, extent, 0, time_sample_range=[1, 3])
+            self.assertTrue(cube.is_time_series)
+            self.assertEqual(cube.time_range, [1, 3])
+            np.testing.assert_array_equal(cube.data, self.data[1:3, 3:13, 20:90, 10:110])
+
+    def test_cutout_default_time_sample(self):
+        """Without a time range, time sample 0 is returned"""
+        for resource in (self.channel_resource, self.layer_resource):
+            cube = self.db.cutout(resource, (0, 0, 0), self.CHUNKSIZE, 0)
+            np.testing.assert_array_equal(cube.data[0], self.data[0, :8, :64, :64])
+
+    def test_write_time_layers(self):
+        """4D writes to a single channel volume go to the per-time layers and read back"""
+        resource = self.get_resource("col1/exp1/chan_write")
+        for t in range(2):
+            cv_path = "col1/exp1/chan_write" + (f"_t{t}" if t else "")
+            create_local_cloudvolume(self.get_resource(cv_path), self.CHUNKSIZE)
+
+        data = np.random.randint(1, 254, size=(2, 10, 50, 70), dtype=np.uint8)
+        self.db.write_cuboid(resource, (5, 6, 4), 0, data)
+        cube = self.db.cutout(resource, (5, 6, 4), (70, 50, 10), 0, time_sample_range=[0, 2])
+        np.testing.assert_array_equal(cube.data, data)
+
+    def test_aligned_cutout(self):
+        """Chunk aligned cutouts skip zero filling yet leave missing chunks zero"""
+        resource = self.get_resource("col1/exp1/chan_sparse")
+        for t in range(2):
+            cv_path = "col1/exp1/chan_sparse" + (f"_t{t}" if t else "")
+            create_local_cloudvolume(self.get_resource(cv_path), self.CHUNKSIZE)
+        data = np.random.randint(1, 254, size=(2, 8, 64, 56), dtype=np.uint8)
+        self.db.write_cuboid(resource, (64, 0, 8), 0, data)
+
+        allocate = Cube.allocate
+        zero_filled = []
+
+        def dirty_allocate(cube, zero=True):
+            zero_filled.append(zero)
+            return allocate(cube, zero) if zero else np.full(cube.get_shape(), 7, dtype=cube.datatype)
+
+        with mock.patch.object(Cube, "allocate", dirty_allocate):
+            cube = self.db.cutout(resource, (0, 0, 0), (120, 100, 16), 0, time_sample_range=[0, 2])
+            self.db.cutout(resource, (0, 0, 1), (120, 100, 15), 0)
+
+        self.assertEqual(zero_filled, [False, True])
+        expected = np.zeros((2, 16, 100, 120), dtype=np.uint8)
+        expected[:, 8:16, 0:64, 64:120] = data
+        np.testing.assert_array_equal(cube.data, expected)
+
+    def test_out_of_range(self):
+        """Time samples past the channel axis are rejected"""
+        with self.assertRaises(CVDBError):
+            self.db.cutout(self.channel_resource, (0, 0, 0), self.CHUNKSIZE, 0, time_sample_range=[2, 4])
+
+    def test_no_time_layers(self):
+        """Without a time_layer_template, single channel volumes only hold time sample 0"""
+        db = CloudVolumeDB(handle_cache=VolumeHandleCache(factory=open_local_volume), chunk_cache=ChunkCache())
+        cube = db.cutout(self.layer_resource, (0, 0, 0), self.CHUNKSIZE, 0)
+        np.testing.assert_array_equal(cube.data[0], self.data[0, :8, :64, :64])
+        with self.assertRaises(CVDBError):
+            db.cutout(self.layer_resource, (0, 0, 0), self.CHUNKSIZE, 0, time_sample_range=[0, 2])
+
+        cube = db.cutout(self.channel_resource, (0, 0, 0), self.CHUNKSIZE, 0, time_sample_range=[0, 2])
+        np.testing.assert_array_equal(cube.data, self.data[0:2, :8, :64, :64])
+
+        with self.assertRaises(CVDBError):
+            CloudVolumeDB(cv_config={"time_layer_template": "{cv_path}_t"})
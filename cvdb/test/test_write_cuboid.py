@@ -0,0 +1,135 @@
+# Copyright 2021 The Johns Hopkins University Applied Physics Laboratory
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+import numpy as np
+
+from cvdb import CloudVolumeDB, ChunkCache, CVDBError, VolumeHandleCache
+from cvdb.chunks import ChunkReader
+from cvdb.project import BossResourceBasic
+from cvdb.project.test.resource_setup import get_image_dict
+from .setup import create_local_cloudvolume, open_local_volume
+
+
+class TestWriteCuboid(unittest.TestCase):
+
+    CHUNKSIZE = (64, 64, 8)
+
+    def setUp(self):
+        """Create an empty local volume standing in for S3, with partial chunks on the upper edges"""
+        self.bucket = tempfile.mkdtemp()
+        self.resource = self.get_resource("col1/exp1/chan1")
+        self.vol = create_local_cloudvolume(self.resource, self.CHUNKSIZE)
+        self.db = CloudVolumeDB(handle_cache=VolumeHandleCache(factory=open_local_volume), chunk_cache=ChunkCache())
+
+    def tearDown(self):
+        shutil.rmtree(self.bucket)
+
+    def get_resource(self, cv_path):
+        data = get_image_dict(storage_type="cloudvol")
+        data["channel"]["bucket"] = self.bucket
+        data["channel"]["cv_path"] = cv_path
+        data["coord_frame"]["x_stop"] = 200
+        data["coord_frame"]["y_stop"] = 160
+        data["coord_frame"]["z_stop"] = 20
+        return BossResourceBasic(data)
+
+    def random(self, zyx):
+        return np.random.randint(1, 255, size=zyx, dtype=np.uint8)
+
+    def test_aligned_write_skips_reads(self):
+        """Covered chunks, including clipped ones on the volume edge, are uploaded without reading storage"""
+        data = self.random((20, 160, 200))
+        with mock.patch.object(ChunkReader, "fetch", side_effect=AssertionError("read during aligned write")):
+            self.db.write_cuboid(self.resource, (0, 0, 0), 0, data)
+
+        np.testing.assert_array_equal(self.vol[:, :, :][:, :, :, 0], data.T)
+
+    def test_unaligned_write(self):
+        """Unaligned writes leave the rest of the boundary chunks intact"""
+        base = self.random((20, 160, 200))
+        self.db.write_cuboid(self.resource, (0, 0, 0), 0, base)
+
+        patch = self.random((11, 70, 100))
+        corner = (30, 50, 5)
+        self.db.write_cuboid(self.resource, corner, 0, patch)
+
+        expected = base.copy()
+        expected[5:16, 50:120, 30:130] = patch
+        np.testing.assert_array_equal(self.vol[:, :, :][:, :, :, 0], expected.T)
+
+    def test_write_invalidates_cache(self):
+        """Cached chunks are dropped so the next cutout sees the new data"""
+        self.db.write_cuboid(self.resource, (0, 0, 0), 0, self.random((8, 64, 64)))
+        self.db.cutout(self.resource, (0, 0, 0), self.CHUNKSIZE, 0)
+        self.assertEqual(len(self.db.chunk_cache), 1)
+
+        data = self.random((8, 64, 64))
+        self.db.write_cuboid(self.resource, (0, 0, 0), 0, data)
+        cube = self.db.cutout(self.resource, (0, 0, 0), self.CHUNKSIZE, 0)
+        np.testing.assert_array_equal(cube.data[0], data)
+
+    def test_to_black(self):
+        """to_black zeroes the voxels set in the mask and nothing else"""
+        base = self.random((20, 160, 200))
+        self.db.write_cuboid(self.resource, (0, 0, 0), 0, base)
+
+        mask = np.zeros((4, 100, 100), dtype=np.uint8)
+        mask[:, 10:20, 10:90] = 1
+        self.db.write_cuboid(self.resource, (50, 20, 6), 0, mask, to_black=True)
+
+        expected = base.copy()
+        expected[6:10, 30:40, 60:140] = 0
+        np.testing.assert_array_equal(self.vol[:, :, :][:, :, :, 0], expected.T)
+
+    def test_time_samples(self):
+        """4D cuboids are written to the channel axis starting at time_sample_start"""
+        resource = self.get_resource("col1/exp1/chan_time")
+        vol = create_local_cloudvolume(resource, self.CHUNKSIZE, num_channels=3)
+
+        first = self.random((20, 160, 200))
+        self.db.write_cuboid(resource, (0, 0, 0), 0, first)
+        data = self.random((2, 10, 100, 100))
+        self.db.write_cuboid(resource, (40, 40, 4), 0, data, time_sample_start=1)
+
+        stored = vol[:, :, :]
+        np.testing.assert_array_equal(stored[:, :, :, 0], first.T)
+        np.testing.assert_array_equal(stored[40:140, 40:140, 4:14, 1:3], data.T)
+        self.assertFalse(stored[:40, :, :, 1:3].any())
+
+        with self.assertRaises(CVDBError):
+            self.db.write_cuboid(resource, (0, 0, 0), 0, data, time_sample_start=2)
+
+    def test_invalid_writes(self):
+        """Writes outside the volume or with the wrong datatype are rejected"""
+        with self.assertRaises(CVDBError):
+            self.db.write_cuboid(self.resource, (150, 0, 0), 0, self.random((8, 64, 64)))
+        with self.assertRaises(CVDBError):
+            self.db.write_cuboid(self.resource, (0, 0, 0), 0, np.ones((8, 64, 64), dtype=np.uint16))
+
+    def test_iso_mip(self):
+        """Isotropic resolutions map to the volume scale with matching voxel size"""
+        for factor in ((2, 2, 1), (4, 4, 1), (8, 8, 1), (16, 16, 1), (16, 16, 2)):
+            self.vol.add_scale(factor)
+        self.vol.commit_info()
+
+        self.assertEqual(self.db.get_mip(self.resource, 2, iso=True), 2)
+        self.assertEqual(self.db.get_mip(self.resource, 4, iso=False), 4)
+        self.assertEqual(self.db.get_mip(self.resource, 4, iso=True), 5)
+        with self.assertRaises(CVDBError):
+            self.db.get_mip(self.resource, 5, iso=True)